@@ -0,0 +1,293 @@
+# Import required libraries
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARK_DIR)
+from synthetic_configs import synthetic_baseline, synthetic_range_acl, synthetic_running_config
+from fleet_benchmark import git_commit
+from config_tree import ConfigTree
+from acl_analyzer import analyze_acl
+from acl_engine import compare_acls, parse_access_lists, parse_acl_text
+from device_collection import split_access_lists
+
+# Every run is appended here so later runs can be compared with earlier ones
+DEFAULT_RESULTS = os.path.join(BENCHMARK_DIR, 'results', 'compare.jsonl')
+
+
+def case_parse(config, baseline):
+    ConfigTree.parse(config['lines'])
+
+
+def case_stig(config, baseline):
+    # The STIG check of the Flask app's compare_device()
+    satisfied = baseline.stig_matcher.evaluate(config['tree'])
+    baseline.stig_matcher.missing(satisfied)
+
+
+def case_sections(config, baseline):
+    # The golden_config.json section loop of jason_parse.py
+    satisfied = baseline.section_matcher.evaluate(config['tree'])
+    baseline.section_matcher.missing_by_section(satisfied)
+
+
+def case_acls(config, baseline):
+    # Split show access-lists, parse every ACL and compare the golden ones, semantics included
+    compare_acls(baseline.acls, parse_access_lists(split_access_lists(config['show_acls'])))
+
+
+def case_acl_ranges(config, baseline):
+    # Unreachable entries of a large extended ACL of port ranges, past analyze_acl()'s cache
+    analysis = analyze_acl.__wrapped__(config['range_acl'])
+    # Each narrower copy is inside the entry nine places before it; anything less means a lost coverer
+    if len(analysis.unreachable) != len(config['range_acl'].entries) // 10:
+        raise AssertionError(f"{len(analysis.unreachable)} unreachable entries in BENCH-RANGES, "
+                             f"expected {len(config['range_acl'].entries) // 10}")
+
+
+CASES = {
+    'parse': case_parse,
+    'stig': case_stig,
+    'sections': case_sections,
+    'acls': case_acls,
+    'acl_ranges': case_acl_ranges,
+}
+
+
+def reference_workload():
+    # Fixed pure Python work independent of this repo: string splitting, hashing and dict lookups like the engine's
+    seen = {}
+    for number in range(2000):
+        words = f'permit tcp 10.0.{number % 256}.0 0.0.0.255 any eq {number}'.split()
+        seen[words[3]] = seen.get(words[3], 0) + len(words)
+    return seen
+
+
+def golden_acl_entries(rules):
+    # Golden ACLs grow with the baseline: 5 entries each at 10 rules, 250 each at 5,000
+    return max(5, rules // 20)
+
+
+def range_acl_entries(config_lines):
+    # The port range ACL grows with the config: 40 entries at 1k lines, 4,000 at 100k
+    return max(10, config_lines // 25)
+
+
+def time_case(function, config, baseline, repeat, min_time):
+    """
+    Time a case, each call paired with a call of the reference workload.
+
+    The fastest call is the one least disturbed by the rest of the machine. The
+    throughput relative to the reference workload is the median over the pairs:
+    both calls of a pair run at the same machine speed, so it hardly changes on
+    a shared or throttled host.
+
+    :return tuple:  (seconds of the fastest call, configs per run of the reference workload)
+    """
+    function(config, baseline)
+    reference_workload()
+    timings = []
+    ratios = []
+    started = time.perf_counter()
+    while len(timings) < repeat or time.perf_counter() - started < min_time:
+        call_started = time.perf_counter()
+        function(config, baseline)
+        call_ended = time.perf_counter()
+        reference_workload()
+        reference_ended = time.perf_counter()
+        timings.append(call_ended - call_started)
+        ratios.append((reference_ended - call_ended) / timings[-1])
+    return min(timings), statistics.median(ratios)
+
+
+def peak_allocation(function, config, baseline):
+    """
+    Peak bytes allocated by one call, measured with tracemalloc.
+
+    Run separately from the timing because tracing slows every allocation down.
+    """
+    tracemalloc.start()
+    try:
+        start_size = tracemalloc.get_traced_memory()[0]
+        function(config, baseline)
+        return tracemalloc.get_traced_memory()[1] - start_size
+    finally:
+        tracemalloc.stop()
+
+
+def run(args, only=None):
+    """
+    Time every case over the config size x baseline size grid and return one result per measurement.
+
+    :param set only:    result_key()s to measure again, every case when None
+    """
+    results = []
+    for config_lines in args.config_lines:
+        for rules in args.rules:
+            acl_entries = golden_acl_entries(rules)
+            if only is not None and not any(key[2] == rules for key in only):
+                continue
+            running_config, show_acls = synthetic_running_config(config_lines, acl_entries=acl_entries, seed=args.seed)
+            lines = running_config.splitlines()
+            config = {'lines': lines, 'tree': ConfigTree.parse(lines), 'show_acls': show_acls,
+                      'range_acl': parse_acl_text(synthetic_range_acl(range_acl_entries(config_lines)))['BENCH-RANGES']}
+            baseline = synthetic_baseline(rules, acl_entries=acl_entries, seed=args.seed)
+            for case in args.cases:
+                if only is not None and (case, len(lines), rules, acl_entries) not in only:
+                    continue
+                function = CASES[case]
+                seconds, relative = time_case(function, config, baseline, args.repeat, args.min_time)
+                peak = peak_allocation(function, config, baseline) if not args.no_memory else None
+                result = {
+                    'case': case,
+                    'config_lines': len(lines),
+                    'rules': rules,
+                    'acl_entries': acl_entries,
+                    'seconds': round(seconds, 6),
+                    'configs_per_second': round(1 / seconds, 2) if seconds else None,
+                    # Configs per run of the reference workload, comparable between machines and busy hosts
+                    'relative_throughput': round(relative, 5),
+                    'peak_kib': round(peak / 1024, 1) if peak is not None else None,
+                }
+                results.append(result)
+                print(f"{case:<10} {result['config_lines']:>7} lines {rules:>5} rules: {seconds * 1000:9.3f} ms, "
+                      f"{result['configs_per_second']:>9} configs/s"
+                      + (f", peak {result['peak_kib']} KiB" if peak is not None else ''))
+    return results
+
+
+def result_key(result):
+    return result['case'], result['config_lines'], result['rules'], result['acl_entries']
+
+
+def previous_results(path, against, seed):
+    """
+    Results of the most recent saved runs, per case and size, to compare against.
+
+    :param str against: Only use runs whose commit or label is this, None for any run
+    :return dict:       result_key() -> (result, run record)
+    """
+    previous = {}
+    if not os.path.exists(path):
+        return previous
+    with open(path, encoding='utf-8') as saved_runs:
+        for line in saved_runs:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get('seed') != seed:
+                continue
+            if against is not None and against not in (record.get('commit'), record.get('label')):
+                continue
+            for result in record.get('results', ()):
+                previous[result_key(result)] = (result, record)
+    return previous
+
+
+def regressions(results, previous, threshold, verbose=True):
+    """
+    Compare throughput with the previous results, printing the change of every case.
+
+    Throughput relative to the reference workload is compared when both runs have it,
+    so a slower or busier machine doesn't show up as a regression.
+
+    :return dict:   result_key() -> description, for the cases that lost more than threshold of their throughput
+    """
+    regressed = {}
+    for result in results:
+        saved = previous.get(result_key(result))
+        if saved is None:
+            continue
+        old, record = saved
+        metric = 'relative_throughput' if old.get('relative_throughput') else 'configs_per_second'
+        if not old.get(metric) or not result[metric]:
+            continue
+        change = result[metric] / old[metric] - 1
+        description = (f"{result['case']} {result['config_lines']} lines {result['rules']} rules: "
+                       f"{change * 100:+.1f}% {'relative throughput' if metric == 'relative_throughput' else 'configs/s'} "
+                       f"vs {record.get('commit') or 'previous run'}")
+        if old.get('peak_kib') and result['peak_kib']:
+            description += f", peak {result['peak_kib'] / old['peak_kib'] * 100 - 100:+.1f}%"
+        if verbose:
+            print(description)
+        if change < -threshold:
+            regressed[result_key(result)] = description
+    return regressed
+
+
+def int_list(value):
+    return [int(item) for item in value.split(',') if item.strip()]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Microbenchmark the compare engine on synthetic configs and baselines')
+    parser.add_argument('--config-lines', type=int_list, default=[1000, 10000, 100000],
+                        help='comma separated running config sizes in lines')
+    parser.add_argument('--rules', type=int_list, default=[10, 500, 5000], help='comma separated baseline sizes in rules')
+    parser.add_argument('--cases', type=lambda value: value.split(','), default=list(CASES),
+                        help='comma separated cases: ' + ', '.join(CASES))
+    parser.add_argument('--repeat', type=int, default=5, help='minimum timed calls per case')
+    parser.add_argument('--min-time', type=float, default=0.5, help='minimum seconds spent timing each case')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic configs and baselines')
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc pass')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='exit with status 1 when a case loses more than this share of its configs/s')
+    parser.add_argument('--confirm', type=int, default=2,
+                        help='times a case that looks slower is measured again before it counts as a regression')
+    parser.add_argument('--against', default=None,
+                        help='commit or label of the saved run to compare with, the latest matching run when not given')
+    parser.add_argument('--label', default='', help='free text saved with the results, e.g. the change being measured')
+    parser.add_argument('--output', default=DEFAULT_RESULTS, help='JSON lines file the results are appended to')
+    parser.add_argument('--no-save', action='store_true', help="compare without appending this run to --output")
+    args = parser.parse_args()
+    unknown = [case for case in args.cases if case not in CASES]
+    if unknown:
+        parser.error('unknown case ' + ', '.join(unknown))
+    return args
+
+
+def main():
+    args = parse_args()
+    previous = previous_results(args.output, args.against, args.seed)
+    results = run(args)
+    regressed = regressions(results, previous, args.threshold)
+    for _ in range(args.confirm):
+        if not regressed:
+            break
+        # A real regression is slower every time, a busy moment of the machine isn't
+        print(f'Measuring {len(regressed)} slower case(s) again')
+        retries = {result_key(retry): retry for retry in run(args, only=set(regressed))}
+        for position, result in enumerate(results):
+            retry = retries.get(result_key(result))
+            if retry is not None and (retry['relative_throughput'] or 0) > (result['relative_throughput'] or 0):
+                results[position] = retry
+        regressed = regressions(results, previous, args.threshold, verbose=False)
+    if not args.no_save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        record = {
+            'time': time.time(),
+            'label': args.label,
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'seed': args.seed,
+            'results': results,
+        }
+        with open(args.output, 'a', encoding='utf-8') as saved_runs:
+            saved_runs.write(json.dumps(record) + '\n')
+        print('Results appended to ' + args.output)
+    if regressed:
+        print(f'{len(regressed)} case(s) regressed by more than {args.threshold * 100:.0f}%:')
+        for description in regressed.values():
+            print('  ' + description)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,440 @@
+# Import required libraries
+from collections import namedtuple
+import argparse
+import ipaddress
+import logging
+import os
+import random
+import re
+import selectors
+import signal
+import socket
+import sys
+import threading
+import time
+import paramiko
+
+# The golden templates are the source of the simulated configurations
+FLASK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'flask')
+sys.path.insert(0, FLASK_DIR)
+from golden_baseline import DEFAULT_GOLDEN_DIR, STIG_FILE, BaselineLoader
+
+# Commands that open a configuration sub-mode, and the mode shown in the prompt
+SUB_MODES = (
+    (re.compile(r'^ip access-list standard '), 'std-nacl'),
+    (re.compile(r'^ip access-list extended '), 'ext-nacl'),
+    (re.compile(r'^interface '), 'if'),
+    (re.compile(r'^line '), 'line'),
+    (re.compile(r'^archive$'), 'archive'),
+    (re.compile(r'^router '), 'router'),
+)
+INVALID_INPUT = "% Invalid input detected at '^' marker.\r\n"
+
+
+class DeviceProfile(namedtuple('DeviceProfile', 'username password secret running_config access_lists outputs '
+                                                'latency jitter chunk_size chunk_delay connect_delay auth_failure_rate',
+                               defaults=(None, {}, {}, 0.0, 0.0, 0, 0.0, 0.0, 0.0))):
+    """
+    How one simulated device behaves.
+
+    :param str username:            Login username
+    :param str password:            Login password
+    :param str secret:              Enable secret; logins land in user exec mode when set, privileged mode when None
+    :param str running_config:      show running-config output
+    :param dict access_lists:       ACL name -> show access-lists text of that ACL
+    :param dict outputs:            Other show commands -> output
+    :param float latency:           Seconds before the device answers each line
+    :param float jitter:            Random +/- seconds added to latency
+    :param int chunk_size:          Send output in chunks of this many bytes, 0 sends it at once
+    :param float chunk_delay:       Seconds between output chunks, simulating a slow device
+    :param float connect_delay:     Seconds before the SSH banner is sent
+    :param float auth_failure_rate: Share of logins rejected even with the right password
+    """
+    __slots__ = ()
+
+
+def golden_running_config(golden_dir=DEFAULT_GOLDEN_DIR, config_lines=2000, missing_rate=0.0, seed=0):
+    """
+    show running-config output built from the golden STIG file, padded with interfaces to config_lines lines.
+
+    :param float missing_rate:  Share of golden top-level blocks left out, so the device isn't compliant
+    """
+    with open(os.path.join(golden_dir, STIG_FILE), 'r') as f:
+        golden_lines = [line.rstrip() for line in f.read().splitlines() if line.strip()]
+    blocks = []
+    for line in golden_lines:
+        if line.startswith(' ') and blocks:
+            blocks[-1].append(line)
+        else:
+            blocks.append([line])
+    rng = random.Random(seed)
+    lines = ['Building configuration...', '', 'Current configuration : 0 bytes', '!',
+             '! Last configuration change at 10:00:00 UTC Mon Jan 1 2024 by admin', '!', 'version 17.9',
+             'hostname bench', '!']
+    for block in blocks:
+        if rng.random() >= missing_rate:
+            lines.extend(block)
+            lines.append('!')
+    port = 0
+    while len(lines) < config_lines - 1:
+        port += 1
+        lines.extend([f'interface GigabitEthernet1/0/{port}', f' description bench access port {port}',
+                      ' switchport access vlan 10', ' switchport mode access', ' spanning-tree portfast', '!'])
+    lines.append('end')
+    return '\r\n'.join(lines) + '\r\n'
+
+
+def golden_access_lists(golden_dir=DEFAULT_GOLDEN_DIR, acl_entries=0):
+    """
+    show access-lists text of every golden ACL, plus an extended ACL BENCH with acl_entries entries.
+    """
+    access_lists = {}
+    for name, acl in BaselineLoader(golden_dir, pack_path=None).get().acls.items():
+        kind = (acl.kind or 'standard').capitalize()
+        lines = [f'{kind} IP access list {name}']
+        lines.extend(f'    {(position + 1) * 10} {entry.text}' for position, entry in enumerate(acl.entries))
+        access_lists[name] = '\r\n'.join(lines) + '\r\n'
+    if acl_entries:
+        lines = ['Extended IP access list BENCH']
+        lines.extend(f'    {(entry + 1) * 10} permit tcp host 10.{entry // 65536 % 256}.{entry // 256 % 256}.{entry % 256} '
+                     f'any eq 22 ({entry} matches)' for entry in range(acl_entries))
+        access_lists['BENCH'] = '\r\n'.join(lines) + '\r\n'
+    return access_lists
+
+
+class _DeviceServer(paramiko.ServerInterface):
+    # SSH side of one connection: password login, a session channel with a PTY and a shell
+    def __init__(self, profile, rng):
+        self.profile = profile
+        self.rng = rng
+        self.shell_requested = threading.Event()
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_auth_password(self, username, password):
+        if self.profile.auth_failure_rate and self.rng.random() < self.profile.auth_failure_rate:
+            return paramiko.AUTH_FAILED
+        if username == self.profile.username and password == self.profile.password:
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_pty_request(self, channel, term, width, height, pixelwidth, pixelheight, modes):
+        return True
+
+    def check_channel_shell_request(self, channel):
+        self.shell_requested.set()
+        return True
+
+
+class _Shell:
+    """
+    IOS command line on one channel: echo, prompts, enable, configuration modes and show commands.
+    """
+    def __init__(self, channel, profile, hostname, rng):
+        self.channel = channel
+        self.profile = profile
+        self.hostname = hostname
+        self.rng = rng
+        self.mode = 'user' if profile.secret else 'enable'
+        self.sub_mode = None
+        self.awaiting = None
+
+    def prompt(self):
+        if self.mode == 'user':
+            return self.hostname + '>'
+        if self.mode == 'config':
+            return f'{self.hostname}(config-{self.sub_mode})#' if self.sub_mode else self.hostname + '(config)#'
+        return self.hostname + '#'
+
+    def run(self):
+        self.send(self.prompt())
+        pending = ''
+        skip_newline = False
+        while True:
+            data = self.channel.recv(65536)
+            if not data:
+                return
+            for char in data.decode('utf-8', 'replace'):
+                if char == '\n' and skip_newline:
+                    skip_newline = False
+                    continue
+                skip_newline = char == '\r'
+                if char in '\r\n':
+                    if not self.handle(pending):
+                        return
+                    pending = ''
+                else:
+                    pending += char
+
+    def send(self, text):
+        profile = self.profile
+        if not profile.chunk_size:
+            self.channel.sendall(text.encode())
+            return
+        for start in range(0, len(text), profile.chunk_size):
+            self.channel.sendall(text[start:start + profile.chunk_size].encode())
+            if profile.chunk_delay:
+                time.sleep(profile.chunk_delay)
+
+    def handle(self, line):
+        """
+        Answer one line; False once the session should close.
+        """
+        if self.awaiting == 'enable':
+            # Passwords aren't echoed
+            self.awaiting = None
+            self.wait()
+            if line == self.profile.secret:
+                self.mode = 'enable'
+                self.send('\r\n' + self.prompt())
+            else:
+                self.send('\r\n% Access denied\r\n\r\n' + self.prompt())
+            return True
+
+        command = line.strip()
+        self.wait()
+        if self.awaiting == 'mkdir':
+            self.awaiting = None
+            self.send(line + '\r\nCreated dir flash:/archived_configs\r\n' + self.prompt())
+            return True
+        if not command:
+            self.send('\r\n' + self.prompt())
+            return True
+        output = self.execute(command)
+        if output is None:
+            self.channel.close()
+            return False
+        self.send(line + '\r\n' + output)
+        return True
+
+    def wait(self):
+        # Per-line round trip, with jitter
+        delay = self.profile.latency + self.rng.uniform(-self.profile.jitter, self.profile.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def execute(self, command):
+        # Output for a command, ending with the next prompt; None closes the session
+        if self.mode == 'config':
+            return self.configure(command)
+        if command.startswith('show '):
+            return self.show(command[5:]) + self.prompt()
+        if self.mode == 'user':
+            if command == 'enable':
+                self.awaiting = 'enable'
+                return 'Password: '
+            if command in ('exit', 'logout', 'quit'):
+                return None
+            if command.startswith('terminal '):
+                return self.prompt()
+            return INVALID_INPUT + self.prompt()
+        if command in ('configure terminal', 'conf t', 'config term'):
+            self.mode = 'config'
+            return 'Enter configuration commands, one per line.  End with CNTL/Z.\r\n' + self.prompt()
+        if command.startswith('terminal ') or command == 'enable':
+            return self.prompt()
+        if command == 'disable':
+            self.mode = 'user'
+            return self.prompt()
+        if command.startswith('mkdir '):
+            self.awaiting = 'mkdir'
+            return f'Create directory filename [{command[6:]}]? '
+        if command in ('exit', 'logout', 'quit'):
+            return None
+        return INVALID_INPUT + self.prompt()
+
+    def configure(self, command):
+        if command == 'end':
+            self.mode, self.sub_mode = 'enable', None
+        elif command == 'exit':
+            if self.sub_mode:
+                self.sub_mode = None
+            else:
+                self.mode = 'enable'
+        elif command.startswith('do '):
+            if command.startswith('do show '):
+                return self.show(command[8:]) + self.prompt()
+        else:
+            for pattern, sub_mode in SUB_MODES:
+                if pattern.match(command):
+                    self.sub_mode = sub_mode
+                    break
+        return self.prompt()
+
+    def show(self, command):
+        # show output, with '| include' and '| exclude' filters
+        command, _, pipe = command.partition('|')
+        command = command.strip()
+        if command in ('run', 'running-config', 'running', 'runn'):
+            output = self.profile.running_config
+        elif re.match(r'^(ip )?access-lists?$', command):
+            output = ''.join(self.profile.access_lists.values())
+        elif re.match(r'^(ip )?access-lists? \S+$', command):
+            output = self.profile.access_lists.get(command.split()[-1], '')
+        else:
+            output = self.profile.outputs.get(command, '')
+        filter_match = re.match(r'\s*(include|exclude|i|e)\s+(.*)$', pipe)
+        if filter_match:
+            keep = filter_match.group(1) in ('include', 'i')
+            pattern = re.compile(filter_match.group(2))
+            output = ''.join(line + '\r\n' for line in output.splitlines() if bool(pattern.search(line)) == keep)
+        return output
+
+
+class FakeIOSServer:
+    """
+    Simulated Cisco IOS devices, one per local address, all on the same port.
+
+    Every address in 127.0.0.0/8 reaches the loopback interface on Linux, so
+    hundreds of devices can be simulated with distinct IPs, each answered with
+    its own DeviceProfile and a hostname taken from its address.
+    """
+    def __init__(self, profiles, port=2222, host_key=None, seed=0):
+        """
+        :param dict profiles:   IP address -> DeviceProfile
+        :param int port:        TCP port every simulated device listens on
+        :param PKey host_key:   SSH host key, a new RSA key when None
+        :param int seed:        Seed for latency jitter and injected authentication failures
+        """
+        self.profiles = profiles
+        self.port = port
+        self.host_key = host_key or paramiko.RSAKey.generate(2048)
+        self.rng = random.Random(seed)
+        self.connections = 0
+        self._selector = selectors.DefaultSelector()
+        self._sockets = []
+        self._closed = threading.Event()
+        self._thread = None
+
+    def start(self):
+        for address in self.profiles:
+            listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            listener.bind((address, self.port))
+            listener.listen(128)
+            listener.setblocking(False)
+            self._selector.register(listener, selectors.EVENT_READ, address)
+            self._sockets.append(listener)
+        self._thread = threading.Thread(target=self._accept, name='fake-ios-accept', daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._closed.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        for listener in self._sockets:
+            listener.close()
+        self._selector.close()
+
+    def _accept(self):
+        while not self._closed.is_set():
+            for key, _ in self._selector.select(timeout=0.5):
+                try:
+                    connection, _ = key.fileobj.accept()
+                except BlockingIOError:
+                    continue
+                connection.setblocking(True)
+                self.connections += 1
+                threading.Thread(target=self._serve, args=(connection, key.data), daemon=True).start()
+
+    def _serve(self, connection, address):
+        profile = self.profiles[address]
+        rng = random.Random(self.rng.random())
+        if profile.connect_delay:
+            time.sleep(profile.connect_delay)
+        transport = paramiko.Transport(connection)
+        try:
+            transport.add_server_key(self.host_key)
+            server = _DeviceServer(profile, rng)
+            transport.start_server(server=server)
+            channel = transport.accept(timeout=30)
+            if channel is None or not server.shell_requested.wait(timeout=30):
+                return
+            hostname = 'bench-' + address.replace('.', '-')
+            _Shell(channel, profile, hostname, rng).run()
+        except (EOFError, OSError, paramiko.SSHException):
+            # The client went away
+            pass
+        finally:
+            transport.close()
+
+
+def device_addresses(count, first='127.1.0.1'):
+    """
+    count consecutive loopback addresses starting at first.
+    """
+    start = ipaddress.ip_address(first)
+    return [str(start + offset) for offset in range(count)]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Simulate Cisco IOS devices over SSH on loopback addresses')
+    parser.add_argument('--devices', type=int, default=100, help='number of simulated devices')
+    parser.add_argument('--first-address', default='127.1.0.1', help='address of the first device (Linux loopback range)')
+    parser.add_argument('--port', type=int, default=2222, help='SSH port of every device')
+    parser.add_argument('--username', default='bench')
+    parser.add_argument('--password', default='bench')
+    parser.add_argument('--secret', default=None, help='enable secret, logins start in privileged mode without one')
+    parser.add_argument('--config-lines', type=int, default=2000, help='lines of show running-config output')
+    parser.add_argument('--acl-entries', type=int, default=0, help='entries in an extra extended ACL BENCH')
+    parser.add_argument('--missing-rate', type=float, default=0.0, help='share of golden blocks missing from the config')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds before each line is answered')
+    parser.add_argument('--jitter', type=float, default=0.0, help='random +/- seconds added to the latency')
+    parser.add_argument('--chunk-size', type=int, default=0, help='send output in chunks of this many bytes')
+    parser.add_argument('--chunk-delay', type=float, default=0.0, help='seconds between output chunks')
+    parser.add_argument('--connect-delay', type=float, default=0.0, help='seconds before the SSH banner')
+    parser.add_argument('--auth-failure-rate', type=float, default=0.0, help='share of logins rejected')
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args(argv)
+
+
+def server_from_args(args):
+    """
+    Build a FakeIOSServer where every device shares one profile built from the arguments.
+    """
+    profile = DeviceProfile(
+        username=args.username,
+        password=args.password,
+        secret=args.secret,
+        running_config=golden_running_config(config_lines=args.config_lines, missing_rate=args.missing_rate,
+                                             seed=args.seed),
+        access_lists=golden_access_lists(acl_entries=args.acl_entries),
+        outputs={'snmp user': '', 'ip ssh': 'SSH Enabled - version 2.0\r\nAuthentication timeout: 60 secs; '
+                                            'Authentication retries: 3\r\n'},
+        latency=args.latency,
+        jitter=args.jitter,
+        chunk_size=args.chunk_size,
+        chunk_delay=args.chunk_delay,
+        connect_delay=args.connect_delay,
+        auth_failure_rate=args.auth_failure_rate,
+    )
+    addresses = device_addresses(args.devices, args.first_address)
+    return FakeIOSServer({address: profile for address in addresses}, port=args.port, seed=args.seed)
+
+
+def main():
+    args = parse_args()
+    # Clients dropping the TCP connection on logout is normal here, don't log every reset
+    logging.getLogger('paramiko').setLevel(logging.CRITICAL)
+    server = server_from_args(args).start()
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopped.set())
+    # The benchmark harness waits for this line before connecting
+    print(f'ready {args.devices} devices on port {args.port}', flush=True)
+    try:
+        while not stopped.wait(1):
+            pass
+    except KeyboardInterrupt:
+        pass
+    server.close()
+
+
+if __name__ == '__main__':
+    main()
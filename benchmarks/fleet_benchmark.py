@@ -0,0 +1,252 @@
+# Import required libraries
+from contextlib import redirect_stdout
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+# Every run is appended here so later runs can be compared with earlier ones
+DEFAULT_RESULTS = os.path.join(BENCHMARK_DIR, 'results', 'fleet.jsonl')
+MODES = ('audit', 'push')
+# Enable secret of the simulated devices in audit mode; pushes log in privileged like TACACS users
+AUDIT_SECRET = 'bench-enable'
+
+
+def percentile(values, fraction):
+    """
+    Nearest-rank percentile of a list of numbers, None for an empty list.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))]
+
+
+def peak_rss_kb():
+    # ru_maxrss is kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def run_audit(args, addresses, scratch):
+    """
+    Audit every simulated device through the Flask app's audit path and time each device.
+    """
+    os.environ['SPECTER_SSH_PORT'] = str(args.port)
+    os.environ['SPECTER_CONFIG_CACHE_PATH'] = os.path.join(scratch, 'config_cache.sqlite3')
+    os.environ['SPECTER_HISTORY_PATH'] = os.path.join(scratch, 'compliance_history.sqlite3')
+    os.environ['SPECTER_LEASE_PATH'] = os.path.join(scratch, 'device_leases.sqlite3')
+    os.environ['SPECTER_METRICS_PATH'] = os.path.join(scratch, 'metrics.sqlite3')
+    os.environ['SPECTER_FLEET_MAX_SESSIONS'] = str(args.workers)
+    sys.path.insert(0, os.path.join(REPO_DIR, 'flask'))
+    import stig_check_flask
+    from device_audit import audit_devices
+
+    ip_addrs, audit_func, record_results = stig_check_flask.build_audit(
+        {'ip_addrs': addresses, 'username': 'bench', 'password': 'bench', 'en_secret': AUDIT_SECRET})
+    rounds = []
+    for _ in range(args.rounds):
+        latencies = []
+
+        def timed_audit(ip):
+            started = time.perf_counter()
+            try:
+                return audit_func(ip)
+            finally:
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        results = audit_devices(ip_addrs, timed_audit, max_workers=args.workers, device_timeout=args.device_timeout)
+        elapsed = time.perf_counter() - started
+        record_results(results)
+        statuses = {}
+        for result in results:
+            statuses[result['status']] = statuses.get(result['status'], 0) + 1
+        rounds.append((elapsed, latencies, statuses))
+    stig_check_flask.session_pool.close_all()
+    return rounds
+
+
+def run_push(args, addresses, scratch):
+    """
+    Push the golden delta to every simulated device with NetmikoHandler.config_device().
+    """
+    sys.path.insert(0, os.path.join(REPO_DIR, 'stig_push'))
+    from netmiko_connection import NetmikoHandler
+
+    rounds = []
+    for number in range(args.rounds):
+        journal_path = os.path.join(scratch, f'push_{number}.ndjson')
+        handler = NetmikoHandler('bench', 'bench', addresses, max_workers=args.workers, push_mode='interactive',
+                                 delta=True, journal_path=journal_path, ssh_port=args.port,
+                                 lease_path=os.path.join(scratch, 'device_leases.sqlite3'), fleet_sessions=args.workers)
+        started = time.perf_counter()
+        handler.config_device()
+        elapsed = time.perf_counter() - started
+        handler.close()
+        latencies = []
+        statuses = {}
+        with open(journal_path, encoding='utf-8') as journal:
+            for line in journal:
+                record = json.loads(line)
+                if record.get('event') == 'device':
+                    latencies.append(record['seconds'])
+                    statuses[record['status']] = statuses.get(record['status'], 0) + 1
+        rounds.append((elapsed, latencies, statuses))
+    return rounds
+
+
+def _run_mode(mode, args, addresses, queue):
+    # Runs in its own process so the peak memory is this mode's alone
+    with tempfile.TemporaryDirectory() as scratch:
+        with open(os.devnull, 'w') as quiet, redirect_stdout(quiet if not args.verbose else sys.stdout):
+            rounds = (run_audit if mode == 'audit' else run_push)(args, addresses, scratch)
+    queue.put((rounds, peak_rss_kb()))
+
+
+def start_simulator(args, secret):
+    """
+    Start fake_ios.py in its own process, so its CPU and memory aren't measured, and wait until it listens.
+    """
+    command = [sys.executable, os.path.join(BENCHMARK_DIR, 'fake_ios.py'),
+               '--devices', str(args.devices), '--first-address', args.first_address, '--port', str(args.port),
+               '--config-lines', str(args.config_lines), '--acl-entries', str(args.acl_entries),
+               '--missing-rate', str(args.missing_rate), '--latency', str(args.latency), '--jitter', str(args.jitter),
+               '--chunk-size', str(args.chunk_size), '--chunk-delay', str(args.chunk_delay),
+               '--connect-delay', str(args.connect_delay), '--auth-failure-rate', str(args.auth_failure_rate)]
+    if secret:
+        command += ['--secret', secret]
+    simulator = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    ready = simulator.stdout.readline()
+    if not ready.startswith('ready'):
+        simulator.kill()
+        raise RuntimeError('Device simulator did not start')
+    return simulator
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def benchmark(mode, args):
+    """
+    Run one mode against a fresh simulator and return one result record per round.
+    """
+    from fake_ios import device_addresses
+    addresses = device_addresses(args.devices, args.first_address)
+    simulator = start_simulator(args, AUDIT_SECRET if mode == 'audit' else None)
+    try:
+        context = multiprocessing.get_context('spawn')
+        queue = context.Queue()
+        worker = context.Process(target=_run_mode, args=(mode, args, addresses, queue))
+        worker.start()
+        rounds, peak = queue.get()
+        worker.join()
+    finally:
+        simulator.terminate()
+        simulator.wait(timeout=30)
+
+    records = []
+    for number, (elapsed, latencies, statuses) in enumerate(rounds, 1):
+        records.append({
+            'time': time.time(),
+            'label': args.label,
+            'commit': git_commit(),
+            'mode': mode,
+            'round': number,
+            'devices': args.devices,
+            'workers': args.workers,
+            'simulator': {
+                'config_lines': args.config_lines, 'acl_entries': args.acl_entries, 'missing_rate': args.missing_rate,
+                'latency': args.latency, 'jitter': args.jitter, 'chunk_size': args.chunk_size,
+                'chunk_delay': args.chunk_delay, 'connect_delay': args.connect_delay,
+                'auth_failure_rate': args.auth_failure_rate,
+            },
+            'seconds': round(elapsed, 3),
+            'devices_per_minute': round(len(latencies) / elapsed * 60, 1) if elapsed else None,
+            'p50_seconds': round(percentile(latencies, 0.50), 3) if latencies else None,
+            'p99_seconds': round(percentile(latencies, 0.99), 3) if latencies else None,
+            'max_seconds': round(max(latencies), 3) if latencies else None,
+            'peak_rss_kb': peak,
+            'statuses': statuses,
+        })
+    return records
+
+
+def previous_record(path, record):
+    """
+    Most recent saved run with the same mode, round, fleet and simulator settings.
+    """
+    if not os.path.exists(path):
+        return None
+    previous = None
+    keys = ('mode', 'round', 'devices', 'workers', 'simulator')
+    with open(path, encoding='utf-8') as results:
+        for line in results:
+            try:
+                saved = json.loads(line)
+            except ValueError:
+                continue
+            if all(saved.get(key) == record[key] for key in keys):
+                previous = saved
+    return previous
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Measure audit and push throughput against simulated IOS devices')
+    parser.add_argument('--mode', choices=MODES + ('both',), default='both')
+    parser.add_argument('--devices', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=25, help='devices handled at the same time')
+    parser.add_argument('--rounds', type=int, default=1,
+                        help='runs per mode; later rounds reuse warm sessions and the config cache')
+    parser.add_argument('--device-timeout', type=int, default=300)
+    parser.add_argument('--first-address', default='127.1.0.1')
+    parser.add_argument('--port', type=int, default=2222)
+    parser.add_argument('--config-lines', type=int, default=2000)
+    parser.add_argument('--acl-entries', type=int, default=0)
+    parser.add_argument('--missing-rate', type=float, default=0.1)
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--jitter', type=float, default=0.005)
+    parser.add_argument('--chunk-size', type=int, default=0)
+    parser.add_argument('--chunk-delay', type=float, default=0.0)
+    parser.add_argument('--connect-delay', type=float, default=0.0)
+    parser.add_argument('--auth-failure-rate', type=float, default=0.0)
+    parser.add_argument('--label', default='', help='free text saved with the results, e.g. the change being measured')
+    parser.add_argument('--output', default=DEFAULT_RESULTS, help='JSON lines file the results are appended to')
+    parser.add_argument('--verbose', action='store_true', help="show the audit and push output")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    sys.path.insert(0, BENCHMARK_DIR)
+    modes = MODES if args.mode == 'both' else (args.mode,)
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    for mode in modes:
+        for record in benchmark(mode, args):
+            previous = previous_record(args.output, record)
+            with open(args.output, 'a', encoding='utf-8') as results:
+                results.write(json.dumps(record) + '\n')
+            line = (f"{mode} round {record['round']}: {record['devices']} devices in {record['seconds']}s, "
+                    f"{record['devices_per_minute']} devices/min, p50 {record['p50_seconds']}s, "
+                    f"p99 {record['p99_seconds']}s, peak RSS {record['peak_rss_kb'] / 1024:.1f} MiB, {record['statuses']}")
+            if previous and previous.get('devices_per_minute') and record['devices_per_minute']:
+                change = (record['devices_per_minute'] / previous['devices_per_minute'] - 1) * 100
+                line += f" ({change:+.1f}% devices/min vs {previous.get('commit') or 'previous run'})"
+            print(line)
+    print('Results appended to ' + args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+# Import required libraries
+import json
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'flask'))
+from golden_baseline import GOLDEN_CONFIG_FILE, STIG_FILE, GoldenBaseline
+
+# Families of global configuration lines; line k of the config is family k % len(GLOBAL_FAMILIES), item k // len()
+GLOBAL_FAMILIES = (
+    lambda i: f'ntp server 10.{i // 256 % 256}.{i % 256}.1',
+    lambda i: f'logging host 10.1.{i // 256 % 256}.{i % 256}',
+    lambda i: f'snmp-server host 10.2.{i // 256 % 256}.{i % 256} version 3 priv bench',
+    lambda i: f'ip route 10.{i // 256 % 256}.{i % 256}.0 255.255.255.0 192.0.2.1',
+    lambda i: f'username user{i} privilege 1 secret 9 $9$benchhash{i}',
+    lambda i: f'tacacs-server host 10.3.{i // 256 % 256}.{i % 256} key 7 0{i:08x}',
+)
+# Golden lines allowed to vary on the device, matched against the tacacs-server family
+TOLERANT_PATTERNS = (r'tacacs-server host 10\.3\.\d+\.\d+ key 7 \S+',)
+# Lines under every access interface
+INTERFACE_LINES = (' switchport access vlan {vlan}', ' switchport mode access', ' switchport nonegotiate',
+                   ' spanning-tree portfast', ' spanning-tree bpduguard enable', ' ip dhcp snooping limit rate 15')
+# Numbered standard ACLs in the synthetic golden baseline
+GOLDEN_ACLS = (1, 2, 5, 55)
+
+
+def global_line(k):
+    return GLOBAL_FAMILIES[k % len(GLOBAL_FAMILIES)](k // len(GLOBAL_FAMILIES))
+
+
+def interface_name(number):
+    return f'GigabitEthernet{number // 48 + 1}/0/{number % 48 + 1}'
+
+
+def acl_entry(acl, position):
+    return f'permit 10.{acl % 256}.{position // 256 % 256}.{position % 256}'
+
+
+def synthetic_running_config(lines, interface_share=0.6, acl_share=0.2, acl_entries=50, missing_rate=0.05, seed=0):
+    """
+    A show running-config of about lines lines: global lines, access interfaces and extended ACLs.
+
+    :param int lines:           Approximate number of lines
+    :param float interface_share: Share of the lines spent on interface blocks
+    :param float acl_share:     Share of the lines spent on extended ACL entries
+    :param int acl_entries:     Entries in each of the golden standard ACLs on the device
+    :param float missing_rate:  Share of golden ACL entries and interface lines left out
+    :return tuple:              (running config text, show access-lists text)
+    """
+    rng = random.Random(seed)
+    config = ['Building configuration...', '', 'version 17.9', 'hostname synthetic', '!']
+    global_count = max(1, int(lines * (1 - interface_share - acl_share)))
+    config.extend(global_line(k) for k in range(global_count))
+    config.append('!')
+
+    interface = 0
+    interface_budget = int(lines * interface_share)
+    while interface_budget > 0:
+        config.append('interface ' + interface_name(interface))
+        config.append(f' description access port {interface}')
+        for line in INTERFACE_LINES:
+            if rng.random() >= missing_rate:
+                config.append(line.format(vlan=interface % 4000 + 1))
+        config.append('!')
+        interface_budget -= len(INTERFACE_LINES) + 3
+        interface += 1
+
+    show = []
+    extended = 0
+    acl_budget = int(lines * acl_share)
+    while acl_budget > 0:
+        name = f'BENCH-{extended}'
+        count = min(acl_budget, 200)
+        config.append('ip access-list extended ' + name)
+        show.append('Extended IP access list ' + name)
+        for position in range(count):
+            entry = (f'permit tcp 10.{extended % 256}.{position // 256 % 256}.0 0.0.0.255 '
+                     f'host 192.0.2.{position % 256} eq {1024 + position}')
+            config.append(f' {(position + 1) * 10} {entry}')
+            show.append(f'    {(position + 1) * 10} {entry} ({rng.randrange(10000)} matches)')
+        acl_budget -= count + 1
+        extended += 1
+
+    for acl in GOLDEN_ACLS:
+        show.append(f'Standard IP access list {acl}')
+        sequence = 0
+        for position in range(acl_entries):
+            if rng.random() < missing_rate:
+                continue
+            sequence += 10
+            show.append(f'    {sequence} {acl_entry(acl, position)}')
+        show.append(f'    {sequence + 10} deny   any log')
+    config.extend(['line vty 0 4', ' exec-timeout 5 0', ' transport input ssh', '!', 'end'])
+    return '\n'.join(config) + '\n', '\n'.join(show) + '\n'
+
+
+def range_acl_entry(position):
+    # Entries take turns at tcp/udp and at range, lt and gt destination ports, one source /24 each
+    protocol = ('tcp', 'udp')[position % 2]
+    ports = (f'range {1024 + position * 7} {1074 + position * 7}', f'lt {1024 + position}', f'gt {position + 1}')[position % 3]
+    return f'permit {protocol} 10.{position // 256 % 256}.{position % 256}.0 0.0.0.255 any {ports}'
+
+
+def synthetic_range_acl(entries):
+    """
+    show access-lists text of one extended ACL whose entries match port ranges (range, lt, gt).
+
+    Every tenth entry is a narrower copy of the entry nine places earlier, so
+    the analyzer has unreachable entries to find among the rest.
+
+    :param int entries: Entries in the ACL
+    """
+    show = ['Extended IP access list BENCH-RANGES']
+    for position in range(entries):
+        entry = range_acl_entry(position)
+        if position % 10 == 9:
+            earlier = position - 9
+            port = (1025 + earlier * 7, 1000, earlier + 100)[earlier % 3]
+            entry = (f'deny {("tcp", "udp")[earlier % 2]} host 10.{earlier // 256 % 256}.{earlier % 256}.1 '
+                     f'any range {port} {port + 1}')
+        show.append(f'    {(position + 1) * 10} {entry}')
+    return '\n'.join(show) + '\n'
+
+
+def synthetic_golden_rules(rules, seed=0):
+    """
+    rules golden lines mixing present and absent global lines, nested interface lines and tolerant lines.
+
+    :return lst:    Golden lines, nested lines indented under their parent
+    """
+    rng = random.Random(seed)
+    golden = []
+    for rule in range(rules):
+        kind = rule % 10
+        if kind < 6:
+            # Spread over the global lines so larger configs contain more of them
+            golden.append(global_line(rng.randrange(rules * 4)))
+        elif kind < 8:
+            golden.append('interface ' + interface_name(rule % 96))
+            golden.append(INTERFACE_LINES[rule % len(INTERFACE_LINES)].format(vlan=rule % 96 % 4000 + 1))
+        elif kind == 8:
+            golden.append(f'tacacs-server host 10.3.{rule // 256 % 256}.{rule % 256} key 7 golden')
+        else:
+            golden.append(f'no service pad {rule}' if rule % 20 else 'service password-encryption')
+    return golden
+
+
+def synthetic_baseline(rules, acl_entries=50, section_size=25, seed=0):
+    """
+    A GoldenBaseline with rules STIG rules, the same rules split into golden_config.json sections
+    (with rule objects) and the golden standard ACLs.
+    """
+    golden = synthetic_golden_rules(rules, seed)
+    sections = {}
+    section = []
+    for line in golden:
+        # Keep nested lines in the same section as their parent
+        if len(section) >= section_size and not line.startswith(' '):
+            sections[f'section_{len(sections)}'] = section
+            section = []
+        section.append(line)
+    if section:
+        sections[f'section_{len(sections)}'] = section
+    for number, name in enumerate(sections):
+        if number % 2 == 0:
+            sections[name].append({'must_not_exist': 'ip http server'})
+        if number % 3 == 0:
+            sections[name].append({'count': r'logging host .*', 'match': 'regex', 'min': 1})
+        if number % 4 == 0:
+            sections[name].append({'any_of': ['ip domain name bench.mil', 'ip domain-name bench.mil']})
+
+    contents = {
+        STIG_FILE: '\n'.join(golden) + '\n',
+        GOLDEN_CONFIG_FILE: json.dumps({'tolerant': list(TOLERANT_PATTERNS), 'sections': sections}),
+    }
+    for acl in GOLDEN_ACLS:
+        entries = [acl_entry(acl, position) for position in range(acl_entries)] + ['deny   any log']
+        contents[f'golden_acl{acl}_file.txt'] = f'ip access-list standard {acl}\n' + '\n'.join(entries) + '\n'
+    return GoldenBaseline(contents)
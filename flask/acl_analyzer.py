@@ -0,0 +1,493 @@
+# Import required libraries
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from functools import lru_cache
+from itertools import combinations
+import re
+import socket
+
+# Full ranges of each dimension an ACE matches on
+ADDRESS_RANGE = (0, 2 ** 32 - 1)
+PORT_RANGE = (0, 65535)
+PROTOCOL_RANGE = (0, 255)
+
+PROTOCOLS = {
+    'icmp': 1, 'igmp': 2, 'ipinip': 4, 'tcp': 6, 'udp': 17, 'gre': 47, 'esp': 50, 'ahp': 51,
+    'eigrp': 88, 'ospf': 89, 'nos': 94, 'pim': 103, 'pcp': 108, 'sctp': 132,
+}
+PORTS = {
+    'bgp': 179, 'bootpc': 68, 'bootps': 67, 'cmd': 514, 'domain': 53, 'echo': 7, 'ftp': 21, 'ftp-data': 20,
+    'isakmp': 500, 'lpd': 515, 'netbios-dgm': 138, 'netbios-ns': 137, 'netbios-ss': 139, 'non500-isakmp': 4500,
+    'ntp': 123, 'pim-auto-rp': 496, 'pop3': 110, 'rip': 520, 'smtp': 25, 'snmp': 161, 'snmptrap': 162,
+    'ssh': 22, 'syslog': 514, 'tacacs': 49, 'telnet': 23, 'tftp': 69, 'www': 80, 'http': 80, 'https': 443,
+}
+# Keywords that only change logging, not what the entry matches
+_LOGGING = {'log', 'log-input'}
+_DOTTED_QUAD = re.compile(r'^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}$')
+
+
+class Ace(namedtuple('Ace', 'index action protocol source source_port destination destination_port qualifiers logging')):
+    """
+    An ACE as integer ranges.
+
+    Every address, port and protocol field is an inclusive (low, high) range;
+    qualifiers are the remaining match keywords (established, fragments, ICMP
+    types ...) which narrow the entry further. logging holds the log keywords,
+    which don't change what the entry matches but are part of what it does.
+    """
+    __slots__ = ()
+
+    def contains(self, other):
+        # True when every packet other matches is also matched by this entry
+        return (_within(other.protocol, self.protocol) and _within(other.source, self.source)
+                and _within(other.source_port, self.source_port) and _within(other.destination, self.destination)
+                and _within(other.destination_port, self.destination_port) and self.qualifiers <= other.qualifiers)
+
+    def box(self):
+        return (self.protocol, self.source, self.source_port, self.destination, self.destination_port, self.qualifiers)
+
+
+class Unreachable(namedtuple('Unreachable', 'index text kind covered_by')):
+    """
+    An entry that can never be the first match.
+
+    :param int index:       Position of the entry in the ACL
+    :param str text:        Entry text
+    :param str kind:        'redundant' (earlier entries with the same action already match it)
+                            or 'shadowed' (an earlier entry with the other action matches it first)
+    :param int covered_by:  Position of the earlier entry that covers it, None when several do together
+    """
+    __slots__ = ()
+
+
+class AclAnalysis(namedtuple('AclAnalysis', 'aces unreachable unparsed outcomes one_dimensional')):
+    """
+    Result of analyze_acl().
+
+    :param tuple aces:              Ace for each entry, None where the entry couldn't be parsed
+    :param tuple unreachable:       Unreachable entries in ACL order
+    :param tuple unparsed:          Entry texts that couldn't be turned into ranges (object groups, neq ...)
+    :param dict outcomes:           (action, logging) -> IntervalSet of the source addresses whose first match
+                                    does that, the implicit deny included, for ACLs that only match on source
+                                    address; None otherwise
+    :param bool one_dimensional:    True when every entry only matches on source address
+    """
+    __slots__ = ()
+
+    def effective(self):
+        # Entries that can still be the first match, as comparable (action, logging, ranges) tuples
+        unreachable = {item.index for item in self.unreachable}
+        return tuple((ace.action, ace.logging, ace.box())
+                     for ace in self.aces if ace is not None and ace.index not in unreachable)
+
+
+class IntervalSet:
+    """
+    Sorted, disjoint integer intervals kept in two parallel arrays.
+
+    Lookups are a bisect; adding an interval merges it with its neighbours, so
+    building a set from n intervals is O(n log n) plus array moves.
+    """
+    __slots__ = ('starts', 'ends')
+
+    def __init__(self):
+        self.starts = array('Q')
+        self.ends = array('Q')
+
+    def covers(self, low, high):
+        position = bisect_right(self.starts, low) - 1
+        return position >= 0 and self.ends[position] >= high
+
+    def gaps(self, low, high):
+        """
+        Parts of [low, high] not in the set.
+        """
+        gaps = []
+        current = low
+        position = max(bisect_right(self.starts, low) - 1, 0)
+        while position < len(self.starts) and self.starts[position] <= high and current <= high:
+            start, end = self.starts[position], self.ends[position]
+            if end >= current:
+                if start > current:
+                    gaps.append((current, start - 1))
+                current = end + 1
+            position += 1
+        if current <= high:
+            gaps.append((current, high))
+        return gaps
+
+    def add(self, low, high):
+        # Merge with every interval that overlaps or touches [low, high]
+        first = bisect_left(self.ends, low - 1) if low else 0
+        last = bisect_right(self.starts, high + 1)
+        if first < last:
+            low = min(low, self.starts[first])
+            high = max(high, self.ends[last - 1])
+        self.starts[first:last] = array('Q', [low])
+        self.ends[first:last] = array('Q', [high])
+
+    def __eq__(self, other):
+        return isinstance(other, IntervalSet) and self.starts == other.starts and self.ends == other.ends
+
+    def __iter__(self):
+        return zip(self.starts, self.ends)
+
+
+class PortRanges:
+    """
+    Port ranges of several entries, answering which earliest entry contains a given range.
+
+    The ranges are sorted by start, so those starting at or below a query's low
+    end are a prefix; a Fenwick tree over that order keeps, for each of its
+    nodes, the node's ranges by descending end with the earliest entry so far.
+    A query visits O(log n) nodes with a bisect each.
+    """
+    __slots__ = ('starts', 'nodes')
+
+    def __init__(self, ranges):
+        """
+        :param lst ranges:  ((low, high), Ace) pairs
+        """
+        ranges = sorted(ranges, key=lambda item: item[0][0])
+        self.starts = [low for (low, _), _ in ranges]
+        self.nodes = [None]
+        for position in range(1, len(ranges) + 1):
+            members = sorted(ranges[position - (position & -position):position], key=lambda item: -item[0][1])
+            ends = []
+            earliest = []
+            best = None
+            for (_, high), ace in members:
+                if best is None or ace.index < best.index:
+                    best = ace
+                ends.append(-high)
+                earliest.append(best)
+            self.nodes.append((ends, earliest))
+
+    def earliest(self, low, high):
+        # Earliest entry whose range contains [low, high], None when no range does
+        best = None
+        position = bisect_right(self.starts, low)
+        while position:
+            ends, earliest = self.nodes[position]
+            count = bisect_right(ends, -high)
+            if count and (best is None or earliest[count - 1].index < best.index):
+                best = earliest[count - 1]
+            position -= position & -position
+        return best
+
+
+class _IrregularIndex:
+    """
+    Entries with port ranges (lt, gt, range) that the widenings of the hash index don't produce.
+
+    Entries are bucketed by protocol, qualifiers and source/destination prefix,
+    probed through the same widenings as the hash index. Within a bucket they
+    are grouped by whichever port field takes fewer distinct values there, and
+    the other port field is kept in a PortRanges.
+    """
+    def __init__(self, aces):
+        members = {}
+        for ace in aces:
+            if ace is not None and _irregular(ace):
+                members.setdefault((ace.protocol, ace.source, ace.destination, ace.qualifiers), []).append(ace)
+        self.source_lengths = {_prefix_length(key[1]) for key in members}
+        self.destination_lengths = {_prefix_length(key[2]) for key in members}
+        self.buckets = {}
+        for key, bucket in members.items():
+            by_source = len({ace.source_port for ace in bucket}) <= len({ace.destination_port for ace in bucket})
+            groups = {}
+            for ace in bucket:
+                group, ranged = (ace.source_port, ace.destination_port) if by_source else (ace.destination_port, ace.source_port)
+                groups.setdefault(group, []).append((ranged, ace))
+            self.buckets[key] = (by_source, [(group, PortRanges(ranges)) for group, ranges in groups.items()])
+
+    def earliest(self, ace, before):
+        """
+        Earliest entry containing ace with an index below before, None when there is none.
+        """
+        best = None
+        if not self.buckets:
+            return best
+        sources = set(_ancestors(ace.source, self.source_lengths))
+        destinations = set(_ancestors(ace.destination, self.destination_lengths))
+        for qualifiers in _qualifier_subsets(ace.qualifiers):
+            for protocol in {ace.protocol, PROTOCOL_RANGE}:
+                for source in sources:
+                    for destination in destinations:
+                        bucket = self.buckets.get((protocol, source, destination, qualifiers))
+                        if bucket is None:
+                            continue
+                        by_source, groups = bucket
+                        grouped, ranged = (ace.source_port, ace.destination_port) if by_source else (ace.destination_port, ace.source_port)
+                        for group, ranges in groups:
+                            if not _within(grouped, group):
+                                continue
+                            found = ranges.earliest(*ranged)
+                            if found is not None and found.index < before:
+                                best, before = found, found.index
+        return best
+
+
+def _irregular(ace):
+    return any(ports != PORT_RANGE and ports[0] != ports[1] for ports in (ace.source_port, ace.destination_port))
+
+
+def _within(inner, outer):
+    return outer[0] <= inner[0] and inner[1] <= outer[1]
+
+
+def _address_int(token):
+    # socket.inet_aton is much cheaper than ipaddress for the thousands of addresses in a large ACL
+    if not _DOTTED_QUAD.match(token):
+        raise ValueError('not an IPv4 address: ' + token)
+    try:
+        return int.from_bytes(socket.inet_aton(token), 'big')
+    except OSError:
+        raise ValueError('not an IPv4 address: ' + token)
+
+
+def _address(tokens, position, standard):
+    # Address spec at tokens[position] -> ((low, high) or None if non-contiguous, next position)
+    token = tokens[position]
+    if token == 'any':
+        return ADDRESS_RANGE, position + 1
+    if token == 'host':
+        address = _address_int(tokens[position + 1])
+        return (address, address), position + 2
+    address = _address_int(token)
+    wildcard = 0
+    if position + 1 < len(tokens) and _DOTTED_QUAD.match(tokens[position + 1]):
+        wildcard = _address_int(tokens[position + 1])
+        position += 1
+    elif not standard:
+        raise ValueError('extended ACE address without wildcard')
+    if (wildcard + 1) & wildcard:
+        # Non-contiguous wildcard bits can't be one range
+        return None, position + 1
+    low = address & ~wildcard & ADDRESS_RANGE[1]
+    return (low, low | wildcard), position + 1
+
+
+def _port_number(token):
+    return int(token) if token.isdigit() else PORTS[token]
+
+
+def _ports(tokens, position):
+    # Optional port operator at tokens[position] -> ((low, high), next position)
+    if position >= len(tokens):
+        return PORT_RANGE, position
+    operator = tokens[position]
+    if operator == 'eq':
+        port = _port_number(tokens[position + 1])
+        return (port, port), position + 2
+    if operator == 'lt':
+        return (0, _port_number(tokens[position + 1]) - 1), position + 2
+    if operator == 'gt':
+        return (_port_number(tokens[position + 1]) + 1, PORT_RANGE[1]), position + 2
+    if operator == 'range':
+        return (_port_number(tokens[position + 1]), _port_number(tokens[position + 2])), position + 3
+    if operator == 'neq':
+        raise ValueError('neq matches two port ranges')
+    return PORT_RANGE, position
+
+
+def parse_ace(index, text, standard):
+    """
+    Turn normalized ACE text into an Ace, or None when it can't be expressed as ranges.
+
+    :param int index:       Position of the entry in its ACL
+    :param str text:        Entry text from acl_engine, e.g. 'permit tcp any any eq 22'
+    :param bool standard:   True for a standard ACL (source address only)
+    """
+    tokens = text.split()
+    if len(tokens) < 2 or tokens[0] not in ('permit', 'deny') or 'object-group' in tokens:
+        return None
+    action = tokens[0]
+    try:
+        if standard:
+            source, position = _address(tokens, 1, standard=True)
+            if source is None:
+                return None
+            qualifiers = frozenset(token for token in tokens[position:] if token not in _LOGGING)
+            logging = frozenset(token for token in tokens[position:] if token in _LOGGING)
+            return Ace(index, action, PROTOCOL_RANGE, source, PORT_RANGE, ADDRESS_RANGE, PORT_RANGE, qualifiers, logging)
+
+        protocol_name = tokens[1]
+        if protocol_name == 'ip':
+            protocol = PROTOCOL_RANGE
+        else:
+            number = int(protocol_name) if protocol_name.isdigit() else PROTOCOLS[protocol_name]
+            protocol = (number, number)
+        has_ports = protocol_name in ('tcp', 'udp')
+        source, position = _address(tokens, 2, standard=False)
+        source_port, position = _ports(tokens, position) if has_ports else (PORT_RANGE, position)
+        destination, position = _address(tokens, position, standard=False)
+        destination_port, position = _ports(tokens, position) if has_ports else (PORT_RANGE, position)
+    except (IndexError, KeyError, ValueError):
+        return None
+    if source is None or destination is None:
+        return None
+    qualifiers = frozenset(token for token in tokens[position:] if token not in _LOGGING)
+    logging = frozenset(token for token in tokens[position:] if token in _LOGGING)
+    return Ace(index, action, protocol, source, source_port, destination, destination_port, qualifiers, logging)
+
+
+def _prefix_length(address_range):
+    # Prefix length of an address range that came from a contiguous wildcard
+    return 32 - (address_range[1] - address_range[0]).bit_length()
+
+
+def _ancestors(address_range, lengths):
+    # The same address range widened to each prefix length seen so far
+    low = address_range[0]
+    own = _prefix_length(address_range)
+    for length in lengths:
+        if length <= own:
+            mask = (ADDRESS_RANGE[1] >> length) if length < 32 else 0
+            yield (low & ~mask & ADDRESS_RANGE[1], (low & ~mask & ADDRESS_RANGE[1]) | mask)
+
+
+def _qualifier_subsets(qualifiers):
+    if len(qualifiers) > 4:
+        return (frozenset(), qualifiers)
+    return tuple(frozenset(subset) for size in range(len(qualifiers) + 1) for subset in combinations(sorted(qualifiers), size))
+
+
+@lru_cache(maxsize=512)
+def analyze_acl(acl):
+    """
+    Find unreachable entries and, for source-only ACLs, the permitted address space.
+
+    Runs in roughly O(n log n) for n entries instead of comparing every pair:
+    - an entry wholly inside one earlier entry is found through a hash index of
+      earlier entries, probing only the prefix lengths and port/protocol widenings
+      that actually occur, and one with port ranges (lt, gt, range) through
+      per-bucket PortRanges;
+    - an entry covered by several earlier entries that differ only in source (or
+      only in destination) address is found through per-group IntervalSets.
+    Coverage by combinations that differ in more than one field is not reported,
+    so every reported entry is provably unreachable.
+
+    :param Acl acl: Parsed ACL from acl_engine
+    """
+    standard = acl.kind == 'standard'
+    aces = tuple(parse_ace(index, entry.text, standard) for index, entry in enumerate(acl.entries))
+    unparsed = tuple(entry.text for entry, ace in zip(acl.entries, aces) if ace is None)
+    one_dimensional = all(ace is None or (ace.protocol == PROTOCOL_RANGE and ace.destination == ADDRESS_RANGE
+                                          and ace.source_port == PORT_RANGE and ace.destination_port == PORT_RANGE
+                                          and not ace.qualifiers) for ace in aces)
+
+    index = {}
+    irregular = _IrregularIndex(aces)
+    source_lengths = set()
+    destination_lengths = set()
+    source_groups = {}
+    destination_groups = {}
+    unreachable = []
+    outcomes = {} if one_dimensional and not unparsed else None
+    covered = IntervalSet() if outcomes is not None else None
+
+    for ace in aces:
+        if ace is None:
+            continue
+        coverer = _dominating(ace, index, irregular, source_lengths, destination_lengths)
+        kind = None
+        if coverer is not None:
+            kind = 'redundant' if coverer.action == ace.action else 'shadowed'
+        else:
+            kind = _union_coverage(ace, source_groups, destination_groups)
+        if kind is not None:
+            unreachable.append(Unreachable(ace.index, acl.entries[ace.index].text, kind,
+                                           coverer.index if coverer is not None else None))
+
+        # First-match partition of the address space for source-only ACLs
+        if outcomes is not None:
+            gaps = covered.gaps(*ace.source)
+            if gaps:
+                outcome = outcomes.setdefault((ace.action, ace.logging), IntervalSet())
+                for low, high in gaps:
+                    outcome.add(low, high)
+            covered.add(*ace.source)
+
+        _remember(ace, index, source_lengths, destination_lengths, source_groups, destination_groups)
+
+    if outcomes is not None:
+        # Whatever no entry matches is denied without logging, the same as an explicit 'deny any'
+        for low, high in covered.gaps(*ADDRESS_RANGE):
+            outcomes.setdefault(('deny', frozenset()), IntervalSet()).add(low, high)
+    return AclAnalysis(aces, tuple(unreachable), unparsed, outcomes, one_dimensional)
+
+
+def _dominating(ace, index, irregular, source_lengths, destination_lengths):
+    # Earliest earlier entry that contains ace, looked up through the widenings of each field
+    best = None
+    protocols = {ace.protocol, PROTOCOL_RANGE}
+    source_ports = {ace.source_port, PORT_RANGE}
+    destination_ports = {ace.destination_port, PORT_RANGE}
+    sources = set(_ancestors(ace.source, source_lengths))
+    destinations = set(_ancestors(ace.destination, destination_lengths))
+    for qualifiers in _qualifier_subsets(ace.qualifiers):
+        for protocol in protocols:
+            for source in sources:
+                for source_port in source_ports:
+                    for destination in destinations:
+                        for destination_port in destination_ports:
+                            found = index.get((protocol, source, source_port, destination, destination_port, qualifiers))
+                            if found is not None and (best is None or found.index < best.index):
+                                best = found
+    # Earlier entries with port ranges (lt, gt, range) the widenings above don't produce
+    earlier = irregular.earliest(ace, ace.index if best is None else best.index)
+    return earlier or best
+
+
+def _union_coverage(ace, source_groups, destination_groups):
+    # Covered by several earlier entries that only differ in one address field
+    for groups, key, field in ((source_groups, _source_key(ace), ace.source),
+                               (destination_groups, _destination_key(ace), ace.destination)):
+        group = groups.get(key)
+        if group is None or not group['all'].covers(*field):
+            continue
+        same = group.get(ace.action)
+        return 'redundant' if same is not None and same.covers(*field) else 'shadowed'
+    return None
+
+
+def _source_key(ace):
+    return (ace.protocol, ace.source_port, ace.destination, ace.destination_port, ace.qualifiers)
+
+
+def _destination_key(ace):
+    return (ace.protocol, ace.source, ace.source_port, ace.destination_port, ace.qualifiers)
+
+
+def _remember(ace, index, source_lengths, destination_lengths, source_groups, destination_groups):
+    index.setdefault(ace.box(), ace)
+    source_lengths.add(_prefix_length(ace.source))
+    destination_lengths.add(_prefix_length(ace.destination))
+    for groups, key, field in ((source_groups, _source_key(ace), ace.source),
+                               (destination_groups, _destination_key(ace), ace.destination)):
+        group = groups.setdefault(key, {'all': IntervalSet()})
+        group['all'].add(*field)
+        group.setdefault(ace.action, IntervalSet()).add(*field)
+
+
+def equivalent(golden_acl, running_acl):
+    """
+    Whether two ACLs match the same traffic the same way under first-match semantics.
+
+    Logging is part of the way: an entry without the log keyword of its golden
+    entry, or a missing 'deny any log' left to the implicit deny, is a difference.
+
+    :return bool:   True or False for source-only ACLs (exact), True when extended ACLs have the same
+                    reachable entries in the same order, None when equivalence can't be decided
+    """
+    golden = analyze_acl(golden_acl)
+    running = analyze_acl(running_acl)
+    if golden.outcomes is not None and running.outcomes is not None:
+        return golden.outcomes == running.outcomes
+    if golden.unparsed or running.unparsed:
+        return None
+    if golden.effective() == running.effective():
+        return True
+    return None
@@ -0,0 +1,221 @@
+# Import required libraries
+from collections import namedtuple
+from acl_analyzer import analyze_acl, equivalent
+import re
+
+# ACL header as it appears in the running config and in show access-lists output
+CONFIG_HEADER = re.compile(r'^ip(?:v6)? access-list (?:(standard|extended|role-based) )?(\S+)', re.IGNORECASE)
+SHOW_HEADER = re.compile(r'^(?:(Standard|Extended|Reflexive|Role-based) IP|IPv6) access list (\S+)', re.IGNORECASE)
+# Parts of show access-lists entries that are not part of the rule itself
+_SEQUENCE = re.compile(r'^(?:sequence )?\d+ ')
+_HIT_COUNTER = re.compile(r'\s*\((?:\d+ matches?|hitcnt=\d+)\)\s*$')
+_WILDCARD_BITS = ', wildcard bits'
+# Numbered ACL entry written on one line of the running config, e.g. 'access-list 10 permit 10.0.0.0 0.0.0.255'
+LEGACY_ENTRY = re.compile(r'^access-list (\d+) (.+)$')
+
+
+class AclEntry(namedtuple('AclEntry', 'sequence text')):
+    """
+    One access control entry.
+
+    :param int sequence:    Sequence number on the device, None when the source had none
+    :param str text:        Normalized rule text, e.g. 'permit 10.0.0.0 0.0.0.255 log'
+    """
+    __slots__ = ()
+
+
+class Acl(namedtuple('Acl', 'name kind entries')):
+    """
+    A parsed access list.
+
+    :param str name:        ACL number or name
+    :param str kind:        'standard', 'extended' or '' when the header didn't say
+    :param tuple entries:   AclEntry tuples in device order
+    """
+    __slots__ = ()
+
+    def entry_set(self):
+        return frozenset(entry.text for entry in self.entries)
+
+
+def normalize_entry(line):
+    """
+    Strip the sequence number, wildcard-bits wording and hit counter from one ACE.
+
+    :return AclEntry:   The entry, or None for a blank line or remark
+    """
+    line = ' '.join(line.replace(_WILDCARD_BITS, '').split())
+    if not line:
+        return None
+    sequence = None
+    match = _SEQUENCE.match(line)
+    if match:
+        sequence = int(match.group(0).split()[-1])
+        line = line[match.end():]
+    line = _HIT_COUNTER.sub('', line)
+    if not line or line.startswith('remark'):
+        return None
+    return AclEntry(sequence, line)
+
+
+class AclCollector:
+    """
+    Builds access lists from ACL text fed one line at a time.
+
+    With names given, entries of every other ACL are dropped as they arrive, so
+    collecting the golden ACLs from a large show access-lists costs memory only
+    for those ACLs.
+    """
+    def __init__(self, name=None, kind='', names=None):
+        """
+        :param str name:    Name to use for entries that appear before any header
+        :param str kind:    Kind to use for entries that appear before any header
+        :param names:       ACL names to keep, every ACL when None
+        """
+        self.name = name
+        self.kind = kind
+        self.names = None if names is None else frozenset(names)
+        self._kinds = {}
+        self._entries = {}
+
+    def feed(self, line):
+        stripped = line.strip()
+        header = CONFIG_HEADER.match(stripped) or SHOW_HEADER.match(stripped)
+        if header:
+            self.kind = (header.group(1) or '').lower()
+            self.name = header.group(2)
+            self._add(self.name, self.kind)
+            return
+        if self.name is None or (self.names is not None and self.name not in self.names):
+            return
+        entry = normalize_entry(stripped)
+        if entry is None:
+            return
+        self._add(self.name, self.kind)
+        self._entries[self.name].append(entry)
+
+    def _add(self, name, kind):
+        if name not in self._kinds and (self.names is None or name in self.names):
+            self._kinds[name] = kind
+            self._entries[name] = []
+
+    def acls(self):
+        """
+        :return dict:   ACL name -> Acl, in the order the ACLs first appeared
+        """
+        return {name: Acl(name, kind, tuple(self._entries[name])) for name, kind in self._kinds.items()}
+
+
+def parse_acl_text(text, name=None, kind=''):
+    """
+    Parse access lists from show access-lists output, running config or a golden file.
+
+    Both header styles ('ip access-list standard 1' and 'Standard IP access list 1')
+    are recognised, so a golden file may carry either or both.
+
+    :param str text:    ACL text
+    :param str name:    Name to use for entries that appear before any header
+    :param str kind:    Kind to use for entries that appear before any header
+    :return dict:       ACL name -> Acl, in the order the ACLs first appear
+    """
+    collector = AclCollector(name, kind)
+    for line in text.splitlines():
+        collector.feed(line)
+    return collector.acls()
+
+
+def _numbered_kind(number):
+    # 1-99 and 1300-1999 are standard ACLs, 100-199 and 2000-2699 extended
+    return 'standard' if number < 100 or 1300 <= number < 2000 else 'extended'
+
+
+def config_access_lists(lines):
+    """
+    Split the ACLs out of a saved running config, for devices audited from a backup instead of show access-lists.
+
+    'ip access-list' blocks are taken with their indented entries; numbered ACLs
+    written as 'access-list N ...' lines are gathered under one header per number.
+
+    :param lst lines:   Running config lines
+    :return dict:       ACL name -> ACL text, as parse_access_lists() takes it
+    """
+    texts = {}
+    name = None
+    for line in lines:
+        if name is not None and line.startswith(' '):
+            texts[name].append(line)
+            continue
+        name = None
+        header = CONFIG_HEADER.match(line)
+        if header:
+            name = header.group(2)
+            texts.setdefault(name, [line])
+            continue
+        legacy = LEGACY_ENTRY.match(line)
+        if legacy:
+            number = legacy.group(1)
+            texts.setdefault(number, [f'ip access-list {_numbered_kind(int(number))} {number}']).append(' ' + legacy.group(2))
+    return {acl_name: '\n'.join(text) for acl_name, text in texts.items()}
+
+
+def parse_access_lists(acl_texts):
+    """
+    Parse the per-ACL text collected from a device.
+
+    :param dict acl_texts:  ACL name -> show access-lists text for that ACL
+    :return dict:           ACL name -> Acl
+    """
+    acls = {}
+    for name, text in acl_texts.items():
+        acls.update(parse_acl_text(text, name))
+    return acls
+
+
+def compare_acl(golden_acl, running_acl, semantic=True):
+    """
+    Golden entries missing from the device's ACL, in golden order.
+
+    Entries are compared as normalized text through a set, so the cost is linear
+    in the number of entries and sequence numbers or hit counters don't matter.
+    With semantic=True the ACLs are also compared by what they match: an ACL
+    worded differently from the golden one but provably equivalent passes, and
+    golden entries that are present but can never be the first match (because an
+    earlier entry on the device already matches their traffic) are reported.
+
+    :param Acl golden_acl:  ACL from the golden file
+    :param Acl running_acl: ACL collected from the device, None if the device doesn't have it
+    :param bool semantic:   Also compare first-match behaviour through acl_analyzer
+    """
+    present = running_acl.entry_set() if running_acl is not None else frozenset()
+    missing = [entry.text for entry in golden_acl.entries if entry.text not in present]
+    if not semantic or running_acl is None:
+        return missing
+    if missing and equivalent(golden_acl, running_acl):
+        return []
+
+    golden_entries = golden_acl.entry_set()
+    for item in analyze_acl(running_acl).unreachable:
+        if item.text not in golden_entries:
+            continue
+        if item.covered_by is None:
+            missing.append(f'{item.text} ({item.kind} by earlier entries)')
+        else:
+            missing.append(f'{item.text} ({item.kind} by {running_acl.entries[item.covered_by].text})')
+    return missing
+
+
+def compare_acls(golden_acls, running_acls, semantic=True):
+    """
+    Compare every golden ACL with the device.
+
+    :param dict golden_acls:    ACL name -> golden Acl
+    :param dict running_acls:   ACL name -> Acl collected from the device
+    :param bool semantic:       Also compare first-match behaviour, see compare_acl()
+    :return dict:               ACL name -> missing entry texts, only for ACLs with something missing
+    """
+    missing = {}
+    for name, golden_acl in golden_acls.items():
+        missing_entries = compare_acl(golden_acl, running_acls.get(name), semantic)
+        if missing_entries:
+            missing[name] = missing_entries
+    return missing
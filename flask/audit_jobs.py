@@ -0,0 +1,176 @@
+# Import required libraries
+from concurrent.futures import ThreadPoolExecutor
+from device_audit import run_device_audits
+import json
+import threading
+import time
+import uuid
+
+
+class AuditJob:
+    """
+    One background audit: the devices it covers and the results collected so far.
+    """
+    def __init__(self, ip_addrs):
+        """
+        :param lst ip_addrs:    IP addresses the job will audit
+        """
+        self.job_id = uuid.uuid4().hex
+        self.ip_addrs = list(ip_addrs)
+        self.status = 'queued'
+        self.results = []
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self._changed = threading.Condition()
+
+    def add_result(self, result):
+        with self._changed:
+            self.results.append(result)
+            self._changed.notify_all()
+
+    def set_status(self, status, error=None):
+        with self._changed:
+            self.status = status
+            self.error = error
+            if status == 'running':
+                self.started = time.time()
+            elif status in ('finished', 'failed') and self.finished is None:
+                self.finished = time.time()
+            self._changed.notify_all()
+
+    def done(self):
+        return self.status in ('finished', 'failed')
+
+    def summary(self):
+        """
+        Job status without the per-device results, for the status endpoint.
+        """
+        counts = {}
+        for result in list(self.results):
+            counts[result['status']] = counts.get(result['status'], 0) + 1
+        return {
+            'job_id': self.job_id,
+            'status': self.status,
+            'error': self.error,
+            'total': len(self.ip_addrs),
+            'completed': len(self.results),
+            'counts': counts,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+        }
+
+    def iter_results(self, start=0, keepalive=15):
+        """
+        Yield results from position start onwards as they arrive, until the job is done.
+
+        None is yielded after keepalive seconds without a new result so streaming
+        responses can send something to keep proxies from closing the connection.
+        """
+        position = start
+        while True:
+            with self._changed:
+                if position >= len(self.results) and not self.done():
+                    self._changed.wait(timeout=keepalive)
+                new_results = self.results[position:]
+                finished = self.done()
+            if not new_results and not finished:
+                yield None
+            for result in new_results:
+                yield result
+            position += len(new_results)
+            if finished and position >= len(self.results):
+                return
+
+
+class JobManager:
+    """
+    Runs audit jobs on background threads so web workers return immediately.
+    """
+    def __init__(self, max_jobs=4, max_workers=25, device_timeout=300, retention=3600):
+        """
+        :param int max_jobs:        Jobs allowed to run at the same time, later jobs wait in the queue
+        :param int max_workers:     Devices audited at the same time within one job
+        :param int device_timeout:  Per-device deadline in seconds
+        :param int retention:       Seconds a finished job is kept for status and stream requests
+        """
+        self.max_workers = max_workers
+        self.device_timeout = device_timeout
+        self.retention = retention
+        self.jobs = {}
+        self._lock = threading.Lock()
+        self._runner = ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix='audit-job')
+
+    def submit(self, ip_addrs, audit_func, on_finished=None):
+        """
+        Queue an audit and return the AuditJob straight away.
+
+        :param lst ip_addrs:        IP addresses to audit
+        :param func audit_func:     Callable taking an IP and returning a device_result()
+        :param func on_finished:    Called with the AuditJob once every device has a result
+        """
+        job = AuditJob(ip_addrs)
+        with self._lock:
+            self._expire()
+            self.jobs[job.job_id] = job
+        self._runner.submit(self._run, job, audit_func, on_finished)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def _run(self, job, audit_func, on_finished=None):
+        job.set_status('running')
+        try:
+            for result in run_device_audits(job.ip_addrs, audit_func, self.max_workers, self.device_timeout):
+                job.add_result(result)
+        except Exception as unknown_error:
+            print('Audit job ' + job.job_id + ' failed ' + str(unknown_error))
+            job.set_status('failed', str(unknown_error))
+            return
+        # Recorded in the history and trace before the job reads as finished, so a client that
+        # sees it finished finds both
+        job.finished = time.time()
+        if on_finished is not None:
+            try:
+                on_finished(job)
+            except Exception as unknown_error:
+                print('Recording audit job ' + job.job_id + ' failed ' + str(unknown_error))
+        job.set_status('finished')
+
+    def _expire(self):
+        # Drop finished jobs older than the retention period
+        cutoff = time.time() - self.retention
+        for job_id in [job_id for job_id, job in self.jobs.items() if job.done() and job.finished < cutoff]:
+            del self.jobs[job_id]
+
+
+def ndjson_stream(job, start=0, transform=None):
+    """
+    Stream a job's results as newline-delimited JSON, one device per line.
+
+    :param func transform:  Applied to each result before it is written, e.g. device_audit.structured_result
+    """
+    for result in job.iter_results(start):
+        if result is None:
+            yield '\n'
+            continue
+        yield json.dumps(result if transform is None else transform(result)) + '\n'
+    yield json.dumps({'job': job.summary()}) + '\n'
+
+
+def sse_stream(job, start=0):
+    """
+    Stream a job's results as Server-Sent Events, ending with a 'done' event.
+    """
+    position = start
+    for result in job.iter_results(start):
+        if result is None:
+            yield ': keepalive\n\n'
+            continue
+        position += 1
+        yield f"id: {position}\nevent: result\ndata: {json.dumps(result)}\n\n"
+    yield f"event: done\ndata: {json.dumps(job.summary())}\n\n"
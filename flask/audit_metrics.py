@@ -0,0 +1,447 @@
+# Import required libraries
+from contextlib import contextmanager
+from device_leases import process_alive
+import audit_trace
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+
+# Latency buckets in seconds, from a fast show command to a slow full push
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+# Seconds between snapshots each process publishes to the shared metrics store
+PUBLISH_INTERVAL = 5.0
+# Distinct network label values kept by default, and the value every other network is reported as
+MAX_NETWORKS = 50
+OTHER_NETWORK = 'other'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def values(self):
+        # Copy of the label values -> value map, safe to use outside the lock
+        with self._lock:
+            return {key: list(value) if isinstance(value, list) else value for key, value in self._values.items()}
+
+    def reset(self):
+        # A forked child starts from zero, its parent's counts are the parent's to report
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def render(self, values=None):
+        """
+        :param dict values: Label values -> value to render instead of this process's own, e.g. summed over workers
+        """
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        items = sorted((self.values() if values is None else values).items())
+        for key, value in items:
+            lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}')
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """
+    Gauge whose values are read from a callback at scrape time.
+
+    A host-wide gauge reads the same values in every process (e.g. from a
+    store shared by all of them), so it is never summed over workers.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), callback=None, host_wide=False):
+        super().__init__(name, documentation, labelnames)
+        self.callbacks = [callback] if callback else []
+        self.host_wide = host_wide
+
+    def values(self):
+        values = {}
+        for callback in self.callbacks:
+            for key, value in callback().items():
+                values[tuple(str(part) for part in key)] = value
+        return values
+
+    def reset(self):
+        # Callbacks watch objects the child inherits and go on reporting them
+        self._lock = threading.Lock()
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # One count per bucket, then the sum
+                counts = self._values[key] = [0] * len(self.buckets) + [0.0]
+            for position, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[position] += 1
+                    break
+            counts[-1] += value
+
+    def render(self, values=None):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        items = sorted((self.values() if values is None else values).items())
+        for key, counts in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, (('le', _format_value(bound)),))
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(counts[-1])}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class SharedMetrics:
+    """
+    SQLite file every worker process publishes its metrics to, so whichever worker is scraped reports them all.
+
+    Each process replaces its own rows with a snapshot of its metrics. Rows of
+    processes that exited are folded into one row per series for counters and
+    histograms, so their sums never go down, and dropped for gauges, which only
+    count processes that are still running.
+    """
+    def __init__(self, path):
+        """
+        :param str path:    SQLite file shared by the processes whose metrics are summed
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Autocommit mode, so BEGIN IMMEDIATE below takes the write lock before the rows are read
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('''
+            CREATE TABLE IF NOT EXISTS metric_values (
+                process TEXT NOT NULL,
+                pid INTEGER NOT NULL,
+                metric TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                labels TEXT NOT NULL,
+                value TEXT NOT NULL,
+                PRIMARY KEY (process, metric, labels)) WITHOUT ROWID''')
+
+    def publish(self, process, snapshot):
+        """
+        Replace one process's rows with a snapshot of its metrics.
+
+        :param str process:     Id of the process, unique for its lifetime
+        :param dict snapshot:   Metric name -> (kind, {label values: value})
+        """
+        rows = [(process, os.getpid(), name, kind, json.dumps(key), json.dumps(value))
+                for name, (kind, values) in snapshot.items() for key, value in values.items()]
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                self._db.execute('DELETE FROM metric_values WHERE process = ?', (process,))
+                self._db.executemany('INSERT INTO metric_values VALUES (?, ?, ?, ?, ?, ?)', rows)
+                self._fold_exited()
+                self._db.execute('COMMIT')
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+
+    def merged(self):
+        """
+        :return dict:   Metric name -> {label values: value summed over every process}
+        """
+        with self._lock:
+            rows = self._db.execute('SELECT metric, labels, value FROM metric_values').fetchall()
+        merged = {}
+        for name, labels, value in rows:
+            values = merged.setdefault(name, {})
+            key = tuple(json.loads(labels))
+            values[key] = _add(values.get(key), json.loads(value))
+        return merged
+
+    def _fold_exited(self):
+        # The exited processes' counters and histograms go into the '' process, their gauges are dropped
+        exited = [(pid,) for pid, in self._db.execute("SELECT DISTINCT pid FROM metric_values WHERE process != ''")
+                  if pid != os.getpid() and not process_alive(pid)]
+        if not exited:
+            return
+        folded = {}
+        for pid, in exited:
+            for name, kind, labels, value in self._db.execute(
+                    "SELECT metric, kind, labels, value FROM metric_values WHERE pid = ? AND process != '' "
+                    "AND kind != 'gauge'", (pid,)):
+                folded[(name, kind, labels)] = _add(folded.get((name, kind, labels)), json.loads(value))
+        for (name, kind, labels), value in folded.items():
+            row = self._db.execute("SELECT value FROM metric_values WHERE process = '' AND metric = ? AND labels = ?",
+                                   (name, labels)).fetchone()
+            if row is not None:
+                value = _add(json.loads(row[0]), value)
+            self._db.execute("INSERT OR REPLACE INTO metric_values VALUES ('', 0, ?, ?, ?, ?)",
+                             (name, kind, labels, json.dumps(value)))
+        self._db.executemany("DELETE FROM metric_values WHERE pid = ? AND process != ''", exited)
+
+
+def _add(total, value):
+    # Sum of two counter values or two histograms' bucket counts and sums
+    if total is None:
+        return value
+    if isinstance(value, list):
+        return [left + right for left, right in zip(total, value)]
+    return total + value
+
+
+class MetricsRegistry:
+    """
+    Metrics rendered together in the Prometheus text exposition format.
+
+    With share(), the process publishes its metrics to a SharedMetrics store
+    every PUBLISH_INTERVAL seconds and renders the sum over every process
+    publishing there, so a scrape of any Gunicorn worker reports all of them.
+    """
+    def __init__(self):
+        self.metrics = []
+        self.shared = None
+        self.interval = PUBLISH_INTERVAL
+        self._process = None
+        self._pid = None
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def share(self, path, interval=PUBLISH_INTERVAL):
+        """
+        Publish this process's metrics to the store at path and render the sum over every process publishing there.
+        """
+        self.shared = SharedMetrics(path)
+        self.interval = interval
+        self._start_publishing()
+
+    def publish(self):
+        snapshot = {metric.name: (metric.kind, metric.values()) for metric in self.metrics
+                    if not getattr(metric, 'host_wide', False)}
+        self.shared.publish(self._process, snapshot)
+
+    def render(self):
+        merged = None
+        if self.shared is not None:
+            self.publish()
+            merged = self.shared.merged()
+        lines = []
+        for metric in self.metrics:
+            if merged is None or getattr(metric, 'host_wide', False):
+                lines.extend(metric.render())
+            else:
+                lines.extend(metric.render(merged.get(metric.name, {})))
+        return '\n'.join(lines) + '\n'
+
+    def _start_publishing(self):
+        self._process = uuid.uuid4().hex
+        self._pid = os.getpid()
+        threading.Thread(target=self._publish_loop, args=(self._pid,), name='metrics-publish', daemon=True).start()
+
+    def _publish_loop(self, pid):
+        # Ends when the process forks a new publisher for itself
+        while self._pid == pid:
+            time.sleep(self.interval)
+            try:
+                self.publish()
+            except Exception as unknown_error:
+                print('Publishing metrics failed ' + str(unknown_error))
+
+    def _after_fork(self):
+        # A worker forked from a preloaded app counts and publishes on its own, under its own process id
+        for metric in self.metrics:
+            metric.reset()
+        if self.shared is not None:
+            self.shared = SharedMetrics(self.shared.path)
+            self._start_publishing()
+
+    def write_textfile(self, path):
+        """
+        Write the metrics for the node_exporter textfile collector, replacing the file atomically.
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with tempfile.NamedTemporaryFile('w', dir=directory, suffix='.tmp', delete=False) as textfile:
+            textfile.write(self.render())
+        os.replace(textfile.name, path)
+
+
+# Shared by the Flask checker and stig_push
+REGISTRY = MetricsRegistry()
+os.register_at_fork(after_in_child=REGISTRY._after_fork)
+DEVICE_LABELS = ('component', 'network')
+PHASE_SECONDS = REGISTRY.register(Histogram(
+    'specter_phase_seconds', 'Seconds spent in each phase of a device audit or push',
+    DEVICE_LABELS + ('phase', 'command')))
+BYTES_RECEIVED = REGISTRY.register(Counter(
+    'specter_bytes_received_total', 'Bytes of command output received from devices', DEVICE_LABELS))
+ERRORS = REGISTRY.register(Counter(
+    'specter_errors_total', 'Device failures by exception class', DEVICE_LABELS + ('error',)))
+DEVICES = REGISTRY.register(Counter(
+    'specter_devices_total', 'Device audits and push attempts by outcome', DEVICE_LABELS + ('status',)))
+SESSIONS = REGISTRY.register(Gauge(
+    'specter_sessions', 'SSH sessions held by each session pool', ('pool', 'state')))
+DEVICE_LEASES = REGISTRY.register(Gauge(
+    'specter_device_leases', 'Device sessions leased across every worker and push run on the host', ('purpose', 'state'),
+    host_wide=True))
+
+_context = threading.local()
+
+
+class NetworkLabels:
+    """
+    Bounds the values of the network label, which comes from user input.
+
+    Only the allowed networks keep their own series when a list is given,
+    otherwise the first max_networks networks seen; every other network is
+    recorded as OTHER_NETWORK, so the number of series can't grow without end.
+    """
+    def __init__(self, allowed=None, max_networks=MAX_NETWORKS):
+        """
+        :param allowed:             Networks that get their own series, None to take them as they come
+        :param int max_networks:    Most networks with their own series when allowed is None
+        """
+        self.allowed = None if allowed is None else frozenset(allowed)
+        self.max_networks = max_networks
+        self._seen = set()
+        self._lock = threading.Lock()
+
+    def label(self, network):
+        if not network:
+            return ''
+        if self.allowed is not None:
+            return network if network in self.allowed else OTHER_NETWORK
+        with self._lock:
+            if network in self._seen:
+                return network
+            if len(self._seen) < self.max_networks:
+                self._seen.add(network)
+                return network
+        return OTHER_NETWORK
+
+
+NETWORK_LABELS = NetworkLabels()
+
+
+def limit_networks(allowed=None, max_networks=MAX_NETWORKS):
+    """
+    Set which networks get their own series, see NetworkLabels.
+    """
+    global NETWORK_LABELS
+    NETWORK_LABELS = NetworkLabels(allowed, max_networks)
+
+
+@contextmanager
+def device_context(component, network=''):
+    """
+    Label every metric recorded by this thread until the block ends, e.g. the audit of one device.
+
+    :param str component:   'audit' for the Flask checker, 'push' for stig_push
+    :param str network:     Network (VirtualNetworkID) of the device, '' when unknown; bounded by NETWORK_LABELS
+    """
+    previous = getattr(_context, 'labels', None)
+    _context.labels = {'component': component, 'network': NETWORK_LABELS.label(network)}
+    try:
+        yield
+    finally:
+        _context.labels = previous
+
+
+def current_labels():
+    return dict(getattr(_context, 'labels', None) or {})
+
+
+def observe_phase(phase, seconds, command=''):
+    PHASE_SECONDS.observe(seconds, phase=phase, command=command, **current_labels())
+
+
+@contextmanager
+def phase(name, command=''):
+    """
+    Time a block as one phase, whether it finishes or raises; also a span when the thread is being traced.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        observe_phase(name, seconds, command)
+        audit_trace.add_span(name, started, seconds, 'phase', {'command': command} if command else None)
+
+
+def count_error(error):
+    ERRORS.inc(error=type(error).__name__, **current_labels())
+
+
+def count_device(status):
+    DEVICES.inc(status=status, **current_labels())
+
+
+def record_collection(stats):
+    """
+    Record the per-command timings and bytes from device_collection.collect_device() stats.
+    """
+    for command, seconds in stats.get('command_seconds', {}).items():
+        observe_phase('command', seconds, command)
+    BYTES_RECEIVED.inc(stats.get('bytes_received', 0), **current_labels())
+
+
+def watch_session_pool(name, pool):
+    """
+    Report a SessionPool's in-use and idle sessions in the specter_sessions gauge.
+    """
+    def sessions():
+        counts = pool.counts()
+        return {(name, 'in_use'): counts['open'] - counts['idle'], (name, 'idle'): counts['idle']}
+    SESSIONS.callbacks.append(sessions)
+
+
+def watch_device_leases(leases):
+    """
+    Report the leases of a DeviceLeases store in the specter_device_leases gauge.
+    """
+    DEVICE_LEASES.callbacks.append(leases.counts)
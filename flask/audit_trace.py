@@ -0,0 +1,163 @@
+# Import required libraries
+from contextlib import contextmanager, nullcontext
+import cProfile
+import json
+import os
+import pstats
+import tempfile
+import threading
+import time
+
+# Only one cProfile profiler can be active at a time, devices that find it busy are traced without it
+_PROFILER_LOCK = threading.Lock()
+_context = threading.local()
+
+
+class AuditTrace:
+    """
+    Nested spans recorded while auditing or pushing devices, exported as a Chrome trace.
+
+    Spans from every worker thread go into the same trace, one track per
+    thread, so the file opened in chrome://tracing or Perfetto shows where each
+    device spent its time: connecting, waiting for prompts or comparing.
+    """
+    def __init__(self, name, profile=False, profile_limit=25):
+        """
+        :param str name:            Name of the traced run, shown in the trace metadata
+        :param bool profile:        Also run the compare engine under cProfile and attach the hottest functions
+        :param int profile_limit:   Functions kept from each profile, by cumulative time
+        """
+        self.name = name
+        self.profile = profile
+        self.profile_limit = profile_limit
+        self.events = []
+        self.created = time.time()
+        self._origin = time.perf_counter()
+        self._threads = {}
+        self._lock = threading.Lock()
+
+    def add_span(self, name, start, duration, category='audit', args=None):
+        """
+        Record a span that already finished.
+
+        :param float start:     time.perf_counter() when the span started
+        :param float duration:  Seconds the span took
+        """
+        thread = threading.current_thread()
+        event = {
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': round((start - self._origin) * 1e6, 1),
+            'dur': round(duration * 1e6, 1),
+            'pid': os.getpid(),
+            'tid': thread.ident,
+        }
+        if args:
+            event['args'] = args
+        with self._lock:
+            self._threads.setdefault(thread.ident, thread.name)
+            self.events.append(event)
+
+    @contextmanager
+    def span(self, name, category='audit', **args):
+        """
+        Time a block as one span, whether it finishes or raises.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        except BaseException as error:
+            args['error'] = type(error).__name__
+            raise
+        finally:
+            self.add_span(name, started, time.perf_counter() - started, category, args)
+
+    @contextmanager
+    def profiled(self, name):
+        """
+        Run a block under cProfile and record its hottest functions as a span.
+
+        Nothing is profiled when profiling is off or another thread holds the profiler.
+        """
+        if not self.profile or not _PROFILER_LOCK.acquire(blocking=False):
+            yield
+            return
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        try:
+            profiler.enable()
+            try:
+                yield
+            finally:
+                profiler.disable()
+        finally:
+            _PROFILER_LOCK.release()
+        duration = time.perf_counter() - started
+        stats = pstats.Stats(profiler).stats
+        hottest = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:self.profile_limit]
+        functions = [f'{os.path.basename(filename)}:{line}({function}) calls={calls} '
+                     f'tottime={tottime * 1000:.3f}ms cumtime={cumtime * 1000:.3f}ms'
+                     for (filename, line, function), (_, calls, tottime, cumtime, _) in hottest]
+        self.add_span('profile ' + name, started, duration, 'profile', {'functions': functions})
+
+    def to_chrome(self):
+        """
+        The trace in the Chrome trace event format understood by chrome://tracing and Perfetto.
+        """
+        with self._lock:
+            events = list(self.events)
+            threads = dict(self._threads)
+        metadata = [{'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': ident, 'args': {'name': name}}
+                    for ident, name in threads.items()]
+        return {
+            'traceEvents': metadata + sorted(events, key=lambda event: event['ts']),
+            'displayTimeUnit': 'ms',
+            'otherData': {'name': self.name, 'created': self.created, 'profile': self.profile},
+        }
+
+    def write(self, path):
+        """
+        Write the Chrome trace JSON, replacing the file atomically.
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with tempfile.NamedTemporaryFile('w', dir=directory, suffix='.tmp', delete=False) as trace_file:
+            json.dump(self.to_chrome(), trace_file)
+        os.replace(trace_file.name, path)
+
+
+@contextmanager
+def activate(trace):
+    """
+    Send the spans recorded by this thread to trace until the block ends; None records nothing.
+    """
+    previous = getattr(_context, 'trace', None)
+    _context.trace = trace
+    try:
+        yield trace
+    finally:
+        _context.trace = previous
+
+
+def current():
+    return getattr(_context, 'trace', None)
+
+
+def span(name, category='audit', **args):
+    """
+    A span in the thread's active trace, or a no-op when nothing is being traced.
+    """
+    trace = current()
+    return trace.span(name, category, **args) if trace is not None else nullcontext()
+
+
+def add_span(name, start, duration, category='audit', args=None):
+    trace = current()
+    if trace is not None:
+        trace.add_span(name, start, duration, category, args)
+
+
+def profiled(name):
+    trace = current()
+    return trace.profiled(name) if trace is not None else nullcontext()
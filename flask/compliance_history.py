@@ -0,0 +1,257 @@
+# Import required libraries
+import os
+import sqlite3
+import threading
+import time
+
+# Section golden ACLs are recorded under, one rule per ACL
+ACL_SECTION = 'acl'
+
+
+def baseline_rules(baseline):
+    """
+    Every rule a device is scored on, as (section, text) pairs in report order.
+    """
+    rules = [(rule.section, rule.display) for rule in baseline.stig_matcher.rules]
+    rules.extend((ACL_SECTION, 'access-list ' + name) for name in baseline.acls)
+    return rules
+
+
+class ComplianceHistory:
+    """
+    SQLite store of every audit: one row per device, rule and run.
+
+    Besides the raw rows, the latest state of every device, the rules each
+    device currently fails and how many devices fail each rule, fleet-wide and
+    per network, are maintained when a run is recorded, so fleet questions are
+    answered from small indexed tables without rescanning the history or
+    touching a device.
+    """
+    def __init__(self, path):
+        """
+        :param str path:    SQLite file holding the history
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript('''
+            CREATE TABLE IF NOT EXISTS rules (
+                rule_id INTEGER PRIMARY KEY,
+                section TEXT NOT NULL,
+                text TEXT NOT NULL,
+                UNIQUE (section, text));
+            CREATE TABLE IF NOT EXISTS runs (
+                run_id INTEGER PRIMARY KEY,
+                job_id TEXT,
+                network TEXT NOT NULL,
+                baseline_version TEXT NOT NULL,
+                started REAL,
+                finished REAL NOT NULL,
+                devices INTEGER NOT NULL,
+                compliant INTEGER NOT NULL,
+                errors INTEGER NOT NULL);
+            CREATE INDEX IF NOT EXISTS runs_network ON runs (network, finished);
+            CREATE TABLE IF NOT EXISTS results (
+                run_id INTEGER NOT NULL,
+                device TEXT NOT NULL,
+                rule_id INTEGER NOT NULL,
+                section TEXT NOT NULL,
+                passed INTEGER NOT NULL,
+                timestamp REAL NOT NULL,
+                PRIMARY KEY (run_id, device, rule_id)) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS results_device ON results (device, timestamp);
+            CREATE INDEX IF NOT EXISTS results_rule ON results (rule_id, passed, run_id);
+            CREATE INDEX IF NOT EXISTS results_section ON results (section, run_id);
+            CREATE INDEX IF NOT EXISTS results_timestamp ON results (timestamp);
+            CREATE TABLE IF NOT EXISTS device_latest (
+                device TEXT PRIMARY KEY,
+                network TEXT NOT NULL,
+                run_id INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                failed INTEGER NOT NULL,
+                timestamp REAL NOT NULL);
+            CREATE INDEX IF NOT EXISTS device_latest_network ON device_latest (network, status);
+            CREATE TABLE IF NOT EXISTS failures_latest (
+                rule_id INTEGER NOT NULL,
+                device TEXT NOT NULL,
+                network TEXT NOT NULL,
+                PRIMARY KEY (rule_id, device)) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS failures_latest_device ON failures_latest (device);
+            CREATE TABLE IF NOT EXISTS rule_failing (
+                rule_id INTEGER PRIMARY KEY,
+                failing INTEGER NOT NULL);
+            CREATE INDEX IF NOT EXISTS rule_failing_count ON rule_failing (failing);
+            CREATE TABLE IF NOT EXISTS rule_failing_network (
+                rule_id INTEGER NOT NULL,
+                network TEXT NOT NULL,
+                failing INTEGER NOT NULL,
+                PRIMARY KEY (rule_id, network)) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS rule_failing_network_count ON rule_failing_network (network, failing);
+        ''')
+        # Stores written before the counts existed get them from the latest failures once
+        if self._db.execute('SELECT NOT EXISTS (SELECT 1 FROM rule_failing)').fetchone()[0]:
+            self._db.execute('INSERT INTO rule_failing SELECT rule_id, COUNT(*) FROM failures_latest GROUP BY rule_id')
+            self._db.execute('INSERT INTO rule_failing_network SELECT rule_id, network, COUNT(*) FROM failures_latest '
+                             'GROUP BY rule_id, network')
+        self._db.commit()
+
+    def record_run(self, results, baseline, network='', job_id=None, started=None, finished=None):
+        """
+        Store one audit run and refresh the latest-state tables.
+
+        Devices that errored are recorded in the run totals and latest state but
+        get no rule rows, since nothing was compared, and no longer count as
+        failing the rules of their previous audit.
+
+        :param lst results:             device_result() records, each with 'failed' for audited devices
+        :param GoldenBaseline baseline: Baseline the devices were compared against
+        :param str network:             Network the devices belong to, '' when unknown
+        :return int:                    run_id of the new run
+        """
+        finished = finished or time.time()
+        rules = baseline_rules(baseline)
+        compliant = sum(1 for result in results if result['status'] == 'compliant')
+        errors = sum(1 for result in results if result['status'] == 'error')
+        with self._lock:
+            rule_ids = self._rule_ids(rules)
+            run_id = self._db.execute('INSERT INTO runs (job_id, network, baseline_version, started, finished, devices, '
+                                      'compliant, errors) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                      (job_id, network, baseline.version, started, finished, len(results),
+                                       compliant, errors)).lastrowid
+            for result in results:
+                device = result['ip']
+                failed = set()
+                # Errors weren't compared and results cached before rules were recorded carry no 'failed'
+                if result['status'] == 'error':
+                    self._set_failures(device, network, failed)
+                elif 'failed' in result:
+                    failed = {rule_ids[tuple(rule)] for rule in result.get('failed', ()) if tuple(rule) in rule_ids}
+                    self._db.executemany('INSERT INTO results VALUES (?, ?, ?, ?, ?, ?)',
+                                         ((run_id, device, rule_id, section, int(rule_id not in failed), finished)
+                                          for (section, _), rule_id in rule_ids.items()))
+                    self._set_failures(device, network, failed)
+                self._db.execute('INSERT OR REPLACE INTO device_latest VALUES (?, ?, ?, ?, ?, ?)',
+                                 (device, network, run_id, result['status'], len(failed), finished))
+            self._db.commit()
+        return run_id
+
+    def fleet_summary(self, network=None, limit=100, offset=0):
+        """
+        Latest status of every device: totals per status and one page of devices, worst first.
+        """
+        where, params = ('WHERE network = ?', (network,)) if network is not None else ('', ())
+        with self._lock:
+            counts = dict(self._db.execute(f'SELECT status, COUNT(*) FROM device_latest {where} GROUP BY status', params))
+            devices = self._db.execute(f'SELECT device, network, status, failed, run_id, timestamp FROM device_latest '
+                                       f'{where} ORDER BY failed DESC, device LIMIT ? OFFSET ?',
+                                       params + (limit, offset)).fetchall()
+        return {
+            'network': network,
+            'total': sum(counts.values()),
+            'counts': counts,
+            'devices': [dict(zip(('device', 'network', 'status', 'failed', 'run_id', 'timestamp'), row)) for row in devices],
+            'limit': limit,
+            'offset': offset,
+        }
+
+    def rule_summary(self, network=None, section=None, limit=100, offset=0):
+        """
+        Rules ordered by how many devices currently fail them.
+        """
+        # Counts are kept up to date by record_run(), so this is a walk down an index
+        counts, clauses, params = 'rule_failing', [], []
+        if network is not None:
+            counts = 'rule_failing_network'
+            clauses.append('counts.network = ?')
+            params.append(network)
+        if section is not None:
+            clauses.append('rules.section = ?')
+            params.append(section)
+        where = ('WHERE ' + ' AND '.join(clauses)) if clauses else ''
+        with self._lock:
+            rows = self._db.execute(f'SELECT rules.rule_id, rules.section, rules.text, counts.failing '
+                                    f'FROM {counts} AS counts JOIN rules ON rules.rule_id = counts.rule_id {where} '
+                                    f'ORDER BY counts.failing DESC, rules.rule_id LIMIT ? OFFSET ?',
+                                    params + [limit, offset]).fetchall()
+        return {
+            'rules': [dict(zip(('rule_id', 'section', 'text', 'failing'), row)) for row in rows],
+            'limit': limit,
+            'offset': offset,
+        }
+
+    def rule_failures(self, rule_id, network=None, limit=100, offset=0):
+        """
+        Devices whose latest audit fails a rule, or None when the rule is unknown.
+        """
+        where, params = ('AND network = ?', (network,)) if network is not None else ('', ())
+        with self._lock:
+            rule = self._db.execute('SELECT section, text FROM rules WHERE rule_id = ?', (rule_id,)).fetchone()
+            if rule is None:
+                return None
+            total = self._db.execute(f'SELECT COUNT(*) FROM failures_latest WHERE rule_id = ? {where}',
+                                     (rule_id,) + params).fetchone()[0]
+            devices = self._db.execute(f'SELECT device, network FROM failures_latest WHERE rule_id = ? {where} '
+                                       f'ORDER BY device LIMIT ? OFFSET ?', (rule_id,) + params + (limit, offset)).fetchall()
+        return {
+            'rule_id': rule_id,
+            'section': rule[0],
+            'text': rule[1],
+            'total': total,
+            'devices': [{'device': device, 'network': device_network} for device, device_network in devices],
+            'limit': limit,
+            'offset': offset,
+        }
+
+    def network_trend(self, network, limit=100, offset=0):
+        """
+        Compliance of a network run by run, newest first.
+        """
+        with self._lock:
+            rows = self._db.execute('SELECT run_id, finished, devices, compliant, errors, baseline_version FROM runs '
+                                    'WHERE network = ? ORDER BY finished DESC LIMIT ? OFFSET ?',
+                                    (network, limit, offset)).fetchall()
+        trend = []
+        for run_id, finished, devices, compliant, errors, version in rows:
+            audited = devices - errors
+            trend.append({
+                'run_id': run_id,
+                'finished': finished,
+                'devices': devices,
+                'compliant': compliant,
+                'errors': errors,
+                'compliance': round(compliant / audited, 4) if audited else None,
+                'baseline_version': version,
+            })
+        return {'network': network, 'runs': trend, 'limit': limit, 'offset': offset}
+
+    def _set_failures(self, device, network, failed):
+        # Replace the device's latest failures and move the per-rule counts with them
+        previous = self._db.execute('SELECT rule_id, network FROM failures_latest WHERE device = ?', (device,)).fetchall()
+        self._db.executemany('UPDATE rule_failing SET failing = failing - 1 WHERE rule_id = ?',
+                             ((rule_id,) for rule_id, _ in previous))
+        self._db.executemany('UPDATE rule_failing_network SET failing = failing - 1 WHERE rule_id = ? AND network = ?',
+                             previous)
+        self._db.execute('DELETE FROM failures_latest WHERE device = ?', (device,))
+        self._db.executemany('INSERT INTO failures_latest VALUES (?, ?, ?)',
+                             ((rule_id, device, network) for rule_id in failed))
+        self._db.executemany('INSERT INTO rule_failing VALUES (?, 1) '
+                             'ON CONFLICT (rule_id) DO UPDATE SET failing = failing + 1',
+                             ((rule_id,) for rule_id in failed))
+        self._db.executemany('INSERT INTO rule_failing_network VALUES (?, ?, 1) '
+                             'ON CONFLICT (rule_id, network) DO UPDATE SET failing = failing + 1',
+                             ((rule_id, network) for rule_id in failed))
+        self._db.executemany('DELETE FROM rule_failing WHERE rule_id = ? AND failing <= 0',
+                             ((rule_id,) for rule_id, _ in previous))
+        self._db.executemany('DELETE FROM rule_failing_network WHERE rule_id = ? AND network = ? AND failing <= 0',
+                             previous)
+
+    def _rule_ids(self, rules):
+        # (section, text) -> rule_id, adding rules the store hasn't seen yet
+        self._db.executemany('INSERT OR IGNORE INTO rules (section, text) VALUES (?, ?)', rules)
+        ids = {}
+        for section, text in rules:
+            ids[(section, text)] = self._db.execute('SELECT rule_id FROM rules WHERE section = ? AND text = ?',
+                                                    (section, text)).fetchone()[0]
+        return ids
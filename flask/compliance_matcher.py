@@ -0,0 +1,511 @@
+# Import required libraries
+from collections import namedtuple
+from collections.abc import Mapping
+from config_tree import BLOCK_END, ConfigTree, normalize_line, parse_line
+import re
+
+# Leading keyword of a pattern, used to skip the regex for lines that can't match it
+_LITERAL_HEAD = re.compile(r'([\w-]+) ')
+# Rule kinds written as objects in golden_config.json sections, next to plain golden lines
+DSL_KINDS = ('exact', 'regex', 'any_of', 'must_not_exist', 'count')
+# Kinds decided by how many lines match rather than by one line being present
+_COUNTED_KINDS = ('absent', 'count')
+
+
+class Rule(namedtuple('Rule', 'rule_id section kind text golden parents minimum maximum',
+                      defaults=(None, (), 1, None))):
+    """
+    One golden rule.
+
+    :param str rule_id:     Unique id of the rule, e.g. 'stig:12'
+    :param str section:     Section the rule is reported under
+    :param str kind:        'exact' (whole line, whitespace-insensitive), 'regex' (re.match on the line),
+                            'any_of' (one of several exact lines), 'absent' (no line matches) or
+                            'count' (between minimum and maximum lines match)
+    :param text:            Golden line, regular expression, or tuple of lines for 'any_of'
+    :param str golden:      Golden command shown in reports when it differs from text
+    :param tuple parents:   Parent lines the rule has to appear under, () for a top-level line
+    :param int minimum:     Fewest matching lines for a 'count' rule
+    :param int maximum:     Most matching lines for a 'count' rule, None for no limit
+    """
+    __slots__ = ()
+
+    @property
+    def display(self):
+        if self.kind == 'any_of':
+            text = self.golden or ' | '.join(self.text)
+        elif self.kind == 'absent':
+            text = 'must not exist: ' + (self.golden or self.text)
+        elif self.kind == 'count':
+            bounds = f'at least {self.minimum}' if self.maximum is None else f'{self.minimum} to {self.maximum}'
+            text = f'{self.golden or self.text} ({bounds} times)'
+        else:
+            text = self.golden or self.text
+        return ' > '.join(self.parents + (text,))
+
+    @property
+    def command(self):
+        """
+        Configuration command that fixes the rule when it fails, None when there is no single command.
+        """
+        if self.kind in ('exact', 'regex'):
+            return self.golden or (self.text if self.kind == 'exact' else None)
+        if self.kind == 'any_of':
+            return self.golden or self.text[0]
+        if self.kind == 'absent' and self.golden:
+            return 'no ' + self.golden
+        return None
+
+
+def _has_backreference(pattern):
+    """
+    True when the regex refers to a group: \\1 to \\99, (?P=name) or a (?(group)...) conditional.
+    """
+    position = 0
+    in_class = False
+    while position < len(pattern):
+        char = pattern[position]
+        if char == '\\':
+            digits = pattern[position + 1:position + 4]
+            # \0 and three octal digits are octal escapes, other digits a group number
+            octal = digits[:1] == '0' or (len(digits) == 3 and all(digit in '01234567' for digit in digits))
+            if not in_class and digits[:1].isdigit() and not octal:
+                return True
+            position += 1
+        elif in_class:
+            in_class = char != ']'
+        elif char == '[':
+            in_class = True
+            if pattern[position + 1:position + 2] == '^':
+                position += 1
+            if pattern[position + 1:position + 2] == ']':
+                position += 1
+        elif pattern.startswith('(?P=', position) or pattern.startswith('(?(', position):
+            return True
+        position += 1
+    return False
+
+
+def check_pattern(pattern, owner):
+    """
+    Compile a rule's regex and make sure it still means the same as one alternative of a combined regex.
+
+    The patterns of a block are joined into one regex with a (?P<rN>...) group per
+    rule, so a backreference would count the wrong groups, a named group could clash
+    with another rule's and inline flags like (?i) can't sit inside the group.
+    Scoped flags such as (?i:...) are fine.
+
+    :param str pattern: Regular expression of the rule
+    :param str owner:   What the pattern belongs to in the error, e.g. 'Rule section_1:4'
+    :raises ValueError: For a pattern that can't be combined
+    :raises re.error:   For an invalid regular expression
+    """
+    compiled = re.compile(pattern)
+    if compiled.groupindex:
+        raise ValueError(f'{owner}: named groups are not supported in {pattern!r}, use (?:...)')
+    if compiled.flags & ~re.UNICODE:
+        raise ValueError(f'{owner}: inline flags are not supported in {pattern!r}, use a scoped group like (?i:...)')
+    if _has_backreference(pattern):
+        raise ValueError(f'{owner}: backreferences are not supported in {pattern!r}')
+    return compiled
+
+
+def tree_rules(section, lines, tolerant_patterns=()):
+    """
+    Build rules from golden lines, scoping indented lines to the block they sit in.
+
+    :param str section:             Section the rules are reported under
+    :param iter lines:              Golden template lines, indented like show running-config
+    :param tuple tolerant_patterns: Patterns for commands allowed to vary on the device
+    """
+    tolerant = [re.compile(pattern) for pattern in tolerant_patterns]
+    rules = []
+    for number, (parents, node) in enumerate(ConfigTree.parse(lines).walk()):
+        rule_id = f'{section}:{number}'
+        pattern = next((match.pattern for match in tolerant if match.match(node.line)), None)
+        if pattern:
+            rules.append(Rule(rule_id, section, 'regex', pattern, node.line, parents))
+        else:
+            rules.append(Rule(rule_id, section, 'exact', node.line, None, parents))
+    return rules
+
+
+def dsl_rule(rule_id, section, item):
+    """
+    Compile one rule object from a golden_config.json section.
+
+    The object has exactly one of the DSL_KINDS keys, e.g.
+    {"regex": "ntp server .*"}, {"any_of": ["ip domain name a", "ip domain-name a"]},
+    {"must_not_exist": "ip http server"} or {"count": "logging host .*", "match": "regex", "min": 2}.
+    must_not_exist and count compare whole lines unless "match" is "regex". Optional keys
+    are "parents" (the block the rule applies to, top level by default) and "golden"
+    (the command shown in reports and used for remediation).
+
+    :raises ValueError:     For an object that isn't a valid rule or a regex check_pattern() rejects
+    :raises re.error:       For an invalid regular expression
+    """
+    if not isinstance(item, Mapping):
+        raise ValueError(f'Rule {rule_id} must be a golden line or a rule object')
+    kinds = [kind for kind in DSL_KINDS if kind in item]
+    if len(kinds) != 1:
+        raise ValueError(f'Rule {rule_id} needs exactly one of ' + ', '.join(DSL_KINDS))
+    kind = kinds[0]
+    value = item[kind]
+    parents = tuple(normalize_line(parent) for parent in item.get('parents', ()))
+    golden = item.get('golden')
+
+    if kind == 'exact':
+        return Rule(rule_id, section, 'exact', normalize_line(value), golden, parents)
+    if kind == 'regex':
+        check_pattern(value, f'Rule {rule_id}')
+        return Rule(rule_id, section, 'regex', value, golden, parents)
+    if kind == 'any_of':
+        if isinstance(value, str) or not value:
+            raise ValueError(f'Rule {rule_id}: any_of needs a list of golden lines')
+        return Rule(rule_id, section, 'any_of', tuple(normalize_line(line) for line in value), golden, parents)
+
+    # must_not_exist and count are matched as anchored regexes so both match styles count the same way
+    if item.get('match', 'exact') == 'regex':
+        pattern = value
+    else:
+        pattern = re.escape(normalize_line(value)) + r'\Z'
+        golden = golden or normalize_line(value)
+    check_pattern(pattern, f'Rule {rule_id}')
+    if kind == 'must_not_exist':
+        return Rule(rule_id, section, 'absent', pattern, golden, parents, 0, 0)
+    minimum = int(item.get('min', 1))
+    maximum = None if item.get('max') is None else int(item['max'])
+    if minimum < 0 or (maximum is not None and maximum < minimum):
+        raise ValueError(f'Rule {rule_id}: count needs 0 <= min <= max')
+    return Rule(rule_id, section, 'count', pattern, golden, parents, minimum, maximum)
+
+
+def section_rules(sections, tolerant_patterns=()):
+    """
+    Build rules from golden_config.json sections, turning tolerant commands into regex rules.
+
+    Plain golden lines are scoped by their indentation like the golden STIG file;
+    rule objects (see dsl_rule()) follow them in the section's rule order.
+
+    :param dict sections:           Section name -> list of golden commands and rule objects
+    :param tuple tolerant_patterns: Patterns for commands allowed to vary on the device
+    """
+    rules = []
+    for section, items in sections.items():
+        scoped = tree_rules(section, [item for item in items if isinstance(item, str)], tolerant_patterns)
+        for item in items:
+            if not isinstance(item, str):
+                scoped.append(dsl_rule(f'{section}:{len(scoped)}', section, item))
+        rules.extend(scoped)
+    return rules
+
+
+def _branches(pattern):
+    """
+    Split a regex on its top-level '|', leaving alternations inside groups and character classes alone.
+    """
+    branches = []
+    depth = 0
+    start = 0
+    position = 0
+    in_class = False
+    while position < len(pattern):
+        char = pattern[position]
+        if char == '\\':
+            position += 1
+        elif in_class:
+            in_class = char != ']'
+        elif char == '[':
+            in_class = True
+            # A ']' right after '[' or '[^' is a literal, not the end of the class
+            if pattern[position + 1:position + 2] == '^':
+                position += 1
+            if pattern[position + 1:position + 2] == ']':
+                position += 1
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == '|' and depth == 0:
+            branches.append(pattern[start:position])
+            start = position + 1
+        position += 1
+    branches.append(pattern[start:])
+    return branches
+
+
+def _pattern_heads(pattern):
+    """
+    Leading keywords a line needs for the pattern to match it, one per top-level alternative.
+
+    :return set:    Keywords, or None when an alternative has no plain leading keyword
+    """
+    heads = set()
+    for branch in _branches(pattern):
+        head = _LITERAL_HEAD.match(branch)
+        if head is None:
+            return None
+        heads.add(head.group(1))
+    return heads
+
+
+class _Scope:
+    """
+    Rules that share the same parent lines, compiled into an exact-line hash index
+    plus one combined regex. Counted rules (absent, count) get their own combined
+    regex that is only used to skip lines none of them can match.
+    """
+    __slots__ = ('parents', 'exact', 'patterns', 'pattern_rules', 'combined', 'heads', 'counted', 'counted_any')
+
+    def __init__(self, parents, indexed_rules):
+        self.parents = parents
+        exact = {}
+        patterns = []
+        counted = []
+        for index, rule in indexed_rules:
+            if rule.kind == 'exact':
+                exact.setdefault(normalize_line(rule.text), []).append(index)
+            elif rule.kind == 'any_of':
+                # Every alternative satisfies the same rule
+                for line in rule.text:
+                    exact.setdefault(normalize_line(line), []).append(index)
+            elif rule.kind == 'regex':
+                patterns.append((index, rule.text))
+            elif rule.kind in _COUNTED_KINDS:
+                counted.append((index, re.compile(rule.text), rule.minimum, rule.maximum))
+            else:
+                raise ValueError(f'Unknown rule kind {rule.kind!r} for {rule.rule_id}')
+        self.exact = {line: tuple(indexes) for line, indexes in exact.items()}
+        self.counted = tuple(counted)
+        self.counted_any = re.compile('|'.join(f'(?:{pattern.pattern})' for _, pattern, _, _ in counted)) if counted else None
+
+        self.pattern_rules = {f'r{index}': index for index, _ in patterns}
+        self.patterns = {index: re.compile(pattern) for index, pattern in patterns}
+        self.combined = None
+        self.heads = None
+        if patterns:
+            self.combined = re.compile('|'.join(f'(?P<r{index}>{pattern})' for index, pattern in patterns))
+            heads = {}
+            for index, pattern in patterns:
+                pattern_heads = _pattern_heads(pattern)
+                if pattern_heads is None:
+                    # A pattern without a plain leading keyword has to be tried on every line
+                    heads = None
+                    break
+                for head in pattern_heads:
+                    heads.setdefault(head, []).append(index)
+            self.heads = heads
+
+    def evaluate(self, lines, satisfied):
+        """
+        Mark the scope's rules satisfied by lines, a single pass over the block.
+
+        :return int:    Number of rules newly satisfied
+        """
+        # Same work as match_line() per line, kept inline since a call per line costs 10-20% of the pass
+        marked = 0
+        exact = self.exact
+        combined = self.combined
+        heads = self.heads
+        counted_any = self.counted_any
+        hits = [0] * len(self.counted)
+        for line in lines:
+            if counted_any is not None and counted_any.match(line):
+                for position, (_, pattern, _, _) in enumerate(self.counted):
+                    if pattern.match(line):
+                        hits[position] += 1
+            indexes = exact.get(line)
+            if indexes:
+                for index in indexes:
+                    if not satisfied[index]:
+                        satisfied[index] = 1
+                        marked += 1
+            if combined is not None:
+                candidates = self.patterns if heads is None else heads.get(line.split(' ', 1)[0])
+                if candidates:
+                    match = combined.match(line)
+                    if match:
+                        marked += self._mark_patterns(line, match, candidates, satisfied)
+        return marked + self.finish(hits, satisfied)
+
+    def match_line(self, line, satisfied, hits):
+        """
+        Mark the rules one line of the block satisfies and count it for the counted rules.
+
+        :param list hits:   Lines matched so far by each counted rule, updated in place
+        :return int:        Number of rules newly satisfied
+        """
+        marked = 0
+        if self.counted_any is not None and self.counted_any.match(line):
+            for position, (_, pattern, _, _) in enumerate(self.counted):
+                if pattern.match(line):
+                    hits[position] += 1
+        indexes = self.exact.get(line)
+        if indexes:
+            for index in indexes:
+                if not satisfied[index]:
+                    satisfied[index] = 1
+                    marked += 1
+        if self.combined is not None:
+            candidates = self.patterns if self.heads is None else self.heads.get(line.split(' ', 1)[0])
+            if candidates:
+                match = self.combined.match(line)
+                if match:
+                    marked += self._mark_patterns(line, match, candidates, satisfied)
+        return marked
+
+    def finish(self, hits, satisfied):
+        """
+        Decide the counted rules once every line of the scope has been seen.
+        """
+        marked = 0
+        for (index, _, minimum, maximum), count in zip(self.counted, hits):
+            if count >= minimum and (maximum is None or count <= maximum):
+                satisfied[index] = 1
+                marked += 1
+        return marked
+
+    def _mark_patterns(self, line, match, candidates, satisfied):
+        # The combined regex reports the first alternative that matched; check the other
+        # unsatisfied pattern rules sharing the line's keyword in case they overlap
+        marked = 0
+        first = self.pattern_rules[match.lastgroup]
+        for index in candidates:
+            if satisfied[index]:
+                continue
+            if index == first or self.patterns[index].match(line):
+                satisfied[index] = 1
+                marked += 1
+        return marked
+
+
+class ComplianceMatcher:
+    """
+    Golden rules compiled into per-block exact-line hash indexes and combined regexes.
+
+    The running config is parsed into a ConfigTree once; top-level rules are
+    checked in one pass over the top-level lines and every nested rule only
+    looks at the block under its parent, so a child line never matches under
+    the wrong parent.
+    """
+    def __init__(self, rules):
+        """
+        :param lst rules:   Rule tuples, reported back in this order
+        """
+        self.rules = tuple(rules)
+        grouped = {}
+        for index, rule in enumerate(self.rules):
+            grouped.setdefault(tuple(rule.parents), []).append((index, rule))
+        self._scopes = tuple(_Scope(parents, indexed_rules) for parents, indexed_rules in grouped.items())
+        self._by_parents = {scope.parents: scope for scope in self._scopes}
+
+    def evaluate(self, config):
+        """
+        Check a running config against every rule.
+
+        :param config:      ConfigTree, or running config lines to parse into one
+        :return bytearray:  1 for each rule that is satisfied, 0 for each that is missing, in rule order
+        """
+        tree = config if isinstance(config, ConfigTree) else ConfigTree.parse(config)
+        satisfied = bytearray(len(self.rules))
+        for scope in self._scopes:
+            scope.evaluate(tree.block_lines(scope.parents), satisfied)
+        return satisfied
+
+    def stream(self):
+        """
+        Start an incremental evaluation that takes the running config one line at a time.
+
+        :return MatcherStream:  feed() it the lines, then finish() gives what evaluate() would have
+        """
+        return MatcherStream(self)
+
+    def missing(self, satisfied):
+        """
+        Rules that evaluate() found missing, in rule order.
+        """
+        return [rule for rule, passed in zip(self.rules, satisfied) if not passed]
+
+    def remediation(self, satisfied):
+        """
+        Configuration commands that add the missing rules, in rule order.
+
+        Each nested rule is preceded by the parent lines needed to enter its block
+        and blocks are left with 'exit', so the commands can be sent as they are.
+        Regex and any_of rules are remediated with their golden command, lines that
+        must not exist are removed with 'no', count rules are left to the operator.
+        """
+        commands = []
+        current = ()
+        for rule in self.missing(satisfied):
+            command = rule.command
+            if command is None:
+                continue
+            parents = tuple(rule.parents)
+            shared = 0
+            while shared < min(len(current), len(parents)) and current[shared] == parents[shared]:
+                shared += 1
+            for depth in range(len(current), shared, -1):
+                commands.append(' ' * (depth - 1) + 'exit')
+            for depth in range(shared, len(parents)):
+                commands.append(' ' * depth + parents[depth])
+            commands.append(' ' * len(parents) + command)
+            current = parents
+        for depth in range(len(current), 0, -1):
+            commands.append(' ' * (depth - 1) + 'exit')
+        return commands
+
+    def missing_by_section(self, satisfied):
+        """
+        Missing rules grouped as section -> list of golden text, sections in rule order.
+        """
+        missing = {}
+        for rule in self.missing(satisfied):
+            missing.setdefault(rule.section, []).append(rule.display)
+        return missing
+
+
+class MatcherStream:
+    """
+    Incremental ComplianceMatcher.evaluate() for lines fed as they are received.
+
+    Blocks are tracked the way ConfigTree builds them, but only the parent lines
+    of the open blocks are kept: memory depends on the rules, not on the size of
+    the running config.
+    """
+    __slots__ = ('_scopes', '_hits', '_stack', 'satisfied')
+
+    def __init__(self, matcher):
+        self._scopes = matcher._by_parents
+        self._hits = {parents: [0] * len(scope.counted) for parents, scope in self._scopes.items()}
+        # (indent, parent lines down to and including this line) of every open block, the top level first
+        self._stack = [(-1, ())]
+        self.satisfied = bytearray(len(matcher.rules))
+
+    def feed(self, raw_line):
+        """
+        Match one running config line against the rules of the block it is in.
+        """
+        parsed = parse_line(raw_line)
+        if parsed is None:
+            return
+        stack = self._stack
+        if parsed is BLOCK_END:
+            del stack[1:]
+            return
+        indent, line = parsed
+        while stack[-1][0] >= indent:
+            stack.pop()
+        parents = stack[-1][1]
+        scope = self._scopes.get(parents)
+        if scope is not None:
+            scope.match_line(line, self.satisfied, self._hits[parents])
+        stack.append((indent, parents + (line,)))
+
+    def finish(self):
+        """
+        :return bytearray:  1 for each rule that is satisfied, 0 for each that is missing, in rule order
+        """
+        for parents, scope in self._scopes.items():
+            scope.finish(self._hits[parents], self.satisfied)
+        return self.satisfied
@@ -0,0 +1,150 @@
+# Import required libraries
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+# One-line probe for the device's last configuration change, much cheaper to transfer than a full pull
+FINGERPRINT_COMMAND = 'show running-config | include Last configuration change'
+# Prefix of stored output that is a compressed capture from stream_device() rather than compressed JSON
+CAPTURE_BLOB = b'CAP1'
+
+
+def probe_fingerprint(net_connect, command=FINGERPRINT_COMMAND):
+    """
+    Ask the device for its change fingerprint.
+
+    :return tuple:  (fingerprint or None when the device gave nothing usable, raw probe output)
+    """
+    output = net_connect.send_command(command)
+    lines = [line.strip() for line in output.splitlines() if 'Last configuration change' in line]
+    if not lines:
+        return None, output
+    return hashlib.sha256('\n'.join(lines).encode()).hexdigest()[:32], output
+
+
+def _load_collected(blob):
+    if not blob:
+        return None
+    if blob.startswith(CAPTURE_BLOB):
+        return {'capture': blob[len(CAPTURE_BLOB):]}
+    return json.loads(zlib.decompress(blob))
+
+
+class ConfigCache:
+    """
+    On-disk cache of collected device output and compliance results, keyed by device.
+
+    An entry is only used while the device reports the same change fingerprint
+    and the entry is younger than ttl. When the entry's baseline version is
+    still current the cached compliance result is reused as well; otherwise the
+    cached output is re-compared against the new baseline without a full pull.
+    The cache is shared by every worker process through SQLite.
+    """
+    def __init__(self, path, ttl=86400, max_entries=10000, max_bytes=512 * 1024 * 1024):
+        """
+        :param str path:            SQLite file holding the cache
+        :param int ttl:             Seconds an entry stays valid even if the fingerprint never changes
+        :param int max_entries:     Entries kept before the least recently used ones are evicted
+        :param int max_bytes:       Compressed output kept before the least recently used entries are evicted
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('''CREATE TABLE IF NOT EXISTS device_cache (
+                                device TEXT PRIMARY KEY,
+                                fingerprint TEXT NOT NULL,
+                                baseline_version TEXT NOT NULL,
+                                collected BLOB NOT NULL,
+                                result TEXT NOT NULL,
+                                size INTEGER NOT NULL,
+                                updated REAL NOT NULL,
+                                accessed REAL NOT NULL)''')
+        self._db.execute('CREATE INDEX IF NOT EXISTS device_cache_accessed ON device_cache (accessed)')
+        self._db.commit()
+
+    def get(self, device, fingerprint):
+        """
+        Cached entry for the device if its fingerprint still matches and it hasn't expired.
+
+        :return dict:   fingerprint, baseline_version, collected, result and updated, or None; collected
+                        is {'capture': bytes} for a streamed audit and None when no output was kept
+        """
+        if fingerprint is None:
+            return None
+        now = time.time()
+        with self._lock:
+            row = self._db.execute('SELECT fingerprint, baseline_version, collected, result, updated '
+                                   'FROM device_cache WHERE device = ?', (device,)).fetchone()
+            if row is None:
+                return None
+            if row[0] != fingerprint or now - row[4] > self.ttl:
+                self._db.execute('DELETE FROM device_cache WHERE device = ?', (device,))
+                self._db.commit()
+                return None
+            self._db.execute('UPDATE device_cache SET accessed = ? WHERE device = ?', (now, device))
+            self._db.commit()
+        return {
+            'fingerprint': row[0],
+            'baseline_version': row[1],
+            'collected': _load_collected(row[2]),
+            'result': json.loads(row[3]),
+            'updated': row[4],
+        }
+
+    def put(self, device, fingerprint, baseline_version, collected, result):
+        """
+        Store the collected output and compliance result for the device.
+
+        :param dict collected:  collect_device() output, stream_device() output whose compressed
+                                capture is stored as it is, or None to keep only the result
+        """
+        if fingerprint is None:
+            return
+        if collected is None:
+            blob = b''
+        elif 'evaluation' in collected or 'capture' in collected:
+            blob = CAPTURE_BLOB + collected['capture'] if collected.get('capture') else b''
+        else:
+            blob = zlib.compress(json.dumps(collected).encode())
+        now = time.time()
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO device_cache VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                             (device, fingerprint, baseline_version, blob, json.dumps(result), len(blob), now, now))
+            self._evict()
+            self._db.commit()
+
+    def invalidate(self, device=None):
+        """
+        Drop the entry for one device, or every entry when device is None.
+        """
+        with self._lock:
+            if device is None:
+                self._db.execute('DELETE FROM device_cache')
+            else:
+                self._db.execute('DELETE FROM device_cache WHERE device = ?', (device,))
+            self._db.commit()
+
+    def _evict(self):
+        # Expired entries first, then least recently used until both limits are met
+        self._db.execute('DELETE FROM device_cache WHERE updated < ?', (time.time() - self.ttl,))
+        count, size = self._db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM device_cache').fetchone()
+        if count <= self.max_entries and size <= self.max_bytes:
+            return
+        removed = []
+        for device, entry_size in self._db.execute('SELECT device, size FROM device_cache ORDER BY accessed'):
+            if count <= self.max_entries and size <= self.max_bytes:
+                break
+            removed.append((device,))
+            count -= 1
+            size -= entry_size
+        self._db.executemany('DELETE FROM device_cache WHERE device = ?', removed)
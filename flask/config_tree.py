@@ -0,0 +1,142 @@
+# Import required libraries
+import re
+
+# Lines that close a configuration block in show running-config output
+_BLOCK_END = re.compile(r'^!\s*$')
+
+
+def normalize_line(line):
+    """
+    Collapse runs of whitespace and strip the line so spacing differences don't matter.
+    """
+    return ' '.join(line.split())
+
+
+# parse_line() result for a '!' in the first column, which ends every open block
+BLOCK_END = object()
+
+
+def parse_line(raw_line):
+    """
+    Indent and normalized text of one configuration line.
+
+    :return:    (indent, normalized line), BLOCK_END, or None for a blank or comment line
+    """
+    line = raw_line.rstrip()
+    if not line.strip():
+        return None
+    if _BLOCK_END.match(line):
+        return BLOCK_END
+    stripped = line.lstrip(' ')
+    if stripped.startswith('!'):
+        return None
+    return len(line) - len(stripped), normalize_line(stripped)
+
+
+class ConfigNode:
+    """
+    One configuration line and the block of lines indented under it.
+    """
+    __slots__ = ('line', 'indent', 'children', 'index')
+
+    def __init__(self, line, indent=-1):
+        """
+        :param str line:    Normalized configuration line ('' for the root)
+        :param int indent:  Number of leading spaces the line had on the device
+        """
+        self.line = line
+        self.indent = indent
+        self.children = []
+        # Child line -> list of child nodes, only created once the node has children
+        self.index = None
+
+    def add(self, node):
+        self.children.append(node)
+        if self.index is None:
+            self.index = {}
+        self.index.setdefault(node.line, []).append(node)
+        return node
+
+    def child(self, line):
+        """
+        Child nodes with the given (normalized) line, looked up in the block's index.
+        """
+        if self.index is None:
+            return ()
+        return self.index.get(line, ())
+
+    def walk(self, parents=()):
+        """
+        Yield (parents, node) for every node below this one, in configuration order.
+        """
+        for node in self.children:
+            yield parents, node
+            if node.children:
+                yield from node.walk(parents + (node.line,))
+
+
+class ConfigTree:
+    """
+    show running-config output parsed into an indented block tree.
+
+    Each block keeps an index from child line to child nodes, so finding a line
+    under a given parent costs a dict lookup per level instead of a scan of the
+    whole configuration.
+    """
+    def __init__(self):
+        self.root = ConfigNode('')
+        self._stack = [self.root]
+
+    @classmethod
+    def parse(cls, lines):
+        """
+        Build a tree from configuration lines in a single pass.
+
+        :param iter lines:  Lines of show running-config output (or a golden template)
+        """
+        tree = cls()
+        tree.feed(lines)
+        return tree
+
+    def feed(self, lines):
+        """
+        Add more lines to the tree, continuing the block structure of earlier lines.
+        """
+        stack = self._stack
+        for raw_line in lines:
+            parsed = parse_line(raw_line)
+            if parsed is None:
+                continue
+            if parsed is BLOCK_END:
+                del stack[1:]
+                continue
+            indent, line = parsed
+            while stack[-1].indent >= indent:
+                stack.pop()
+            stack.append(stack[-1].add(ConfigNode(line, indent)))
+        return self
+
+    def find(self, path):
+        """
+        Nodes reached by following path (a sequence of normalized lines) from the top level.
+        """
+        nodes = [self.root]
+        for line in path:
+            nodes = [child for node in nodes for child in node.child(line)]
+            if not nodes:
+                break
+        return nodes
+
+    def block_lines(self, parents):
+        """
+        Lines directly under every block matching parents; () gives the top-level lines.
+        """
+        for node in self.find(parents):
+            for child in node.children:
+                yield child.line
+
+    def __contains__(self, path):
+        return bool(self.find(path))
+
+    def walk(self):
+        return self.root.walk()
@@ -0,0 +1,160 @@
+# Import required libraries
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import csv
+import re
+import time
+
+# How often the pool is checked for finished or overdue devices (seconds)
+POLL_INTERVAL = 0.5
+# CSV columns holding the device address, NetMRI exports use DeviceIPDotted
+IP_COLUMNS = ('ip', 'ip_addrs', 'ip_address', 'deviceipdotted', 'address', 'host')
+
+
+def parse_ip_addrs(values):
+    """
+    Split the submitted IP address field(s) into a de-duplicated list.
+
+    :param lst values:  Raw values from request.form.getlist('ip_addrs')
+    :return lst:        IP addresses in the order they were entered
+    """
+    ip_addrs = []
+    seen = set()
+    for value in values:
+        for ip in re.split(r'[\s,;]+', value.strip()):
+            if ip and ip not in seen:
+                seen.add(ip)
+                ip_addrs.append(ip)
+    return ip_addrs
+
+
+def parse_device_csv(lines):
+    """
+    Read device addresses from a CSV file or NetMRI export, one row at a time.
+
+    The address column is found by its header (ip, ip_address, DeviceIPDotted ...);
+    without a recognised header the first column of every row is used.
+
+    :param iter lines:  Lines of CSV text
+    :return lst:        IP addresses in file order, de-duplicated
+    """
+    rows = csv.reader(lines)
+    first = next(rows, None)
+    if first is None:
+        return []
+    header = [cell.strip().lower() for cell in first]
+    column = next((header.index(name) for name in IP_COLUMNS if name in header), None)
+    values = []
+    if column is None:
+        column = 0
+        values.append(first[0] if first else '')
+    values.extend(row[column] for row in rows if len(row) > column)
+    return parse_ip_addrs(values)
+
+
+def device_result(ip, status, result, stats=None, failed=None):
+    """
+    Build the per-device result record gathered by run_device_audits().
+
+    :param str ip:      Device IP address
+    :param str status:  'compliant', 'not_compliant' or 'error'
+    :param str result:  Text shown for the device on the results page
+    :param dict stats:  Collection statistics (round trips, bytes) when the device was reached
+    :param lst failed:  [section, rule] pairs the device failed, for the compliance history
+    """
+    device = {'ip': ip, 'status': status, 'result': result}
+    if stats is not None:
+        device['stats'] = stats
+    if failed is not None:
+        device['failed'] = failed
+    return device
+
+
+def structured_result(device):
+    """
+    Per-device record for the JSON API: status and failed rules instead of the report text.
+    """
+    record = {'ip': device['ip'], 'status': device['status']}
+    if device['status'] == 'error':
+        record['error'] = device['result']
+    if 'failed' in device:
+        record['failed'] = [{'section': section, 'rule': rule} for section, rule in device['failed']]
+    if 'stats' in device:
+        record['stats'] = device['stats']
+    return record
+
+
+def run_device_audits(ip_addrs, audit_func, max_workers=25, device_timeout=300):
+    """
+    Audit every device in a bounded worker pool and yield results as they finish.
+
+    Wall-clock time tracks the slowest device instead of the sum of all of them.
+    A device that runs longer than device_timeout seconds (measured from when a
+    worker picks it up, not from when it was queued) is reported as an error and
+    its worker is abandoned so the rest of the report is not held up.
+
+    :param lst ip_addrs:        IP addresses to audit
+    :param func audit_func:     Callable taking an IP and returning a device_result()
+    :param int max_workers:     Maximum number of devices audited at the same time
+    :param int device_timeout:  Per-device deadline in seconds
+    """
+    started = {}
+
+    def timed_audit(index, ip):
+        started[index] = time.monotonic()
+        return audit_func(ip)
+
+    pool = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(ip_addrs) or 1)))
+    futures = {pool.submit(timed_audit, index, ip): (index, ip) for index, ip in enumerate(ip_addrs)}
+    pending = set(futures)
+    try:
+        while pending:
+            done, pending = wait(pending, timeout=POLL_INTERVAL, return_when=FIRST_COMPLETED)
+            for future in done:
+                ip = futures[future][1]
+                try:
+                    yield future.result()
+                except Exception as unknown_error:
+                    yield device_result(ip, 'error', 'Some other error ' + str(unknown_error))
+
+            # Give up on devices that have been running past their deadline
+            now = time.monotonic()
+            expired = set()
+            for future in pending:
+                index, ip = futures[future]
+                if index in started and now - started[index] > device_timeout:
+                    expired.add(future)
+                    yield device_result(ip, 'error', f'Audit did not finish within {device_timeout} seconds')
+            pending -= expired
+    finally:
+        # Don't block on abandoned workers; queued devices are cancelled if the caller stops early
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def audit_devices(ip_addrs, audit_func, max_workers=25, device_timeout=300):
+    """
+    Run run_device_audits() to completion and return the results in submitted order.
+    """
+    order = {ip: index for index, ip in enumerate(ip_addrs)}
+    results = list(run_device_audits(ip_addrs, audit_func, max_workers, device_timeout))
+    return sorted(results, key=lambda device: order.get(device['ip'], len(order)))
+
+
+def format_report(results):
+    """
+    Combine per-device results into the single report shown on specter_post.html.
+    """
+    compliant = sum(1 for device in results if device['status'] == 'compliant')
+    report = [f"{compliant} of {len(results)} devices are STIG compliant"]
+    for device in results:
+        report.append(f"\n\n==================== {device['ip']} ====================")
+        if 'stats' in device:
+            stats = device['stats']
+            if 'source' in stats:
+                # Audited offline from a saved config instead of the device
+                report.append(f"(saved configuration {stats['source']}, {stats['bytes_read']} bytes)")
+            else:
+                cached = ', configuration unchanged since the cached audit' if stats.get('cached') else ''
+                shared = ', result of an audit already in progress' if stats.get('shared') else ''
+                report.append(f"({stats['round_trips']} round trips, {stats['bytes_received']} bytes collected{cached}{shared})")
+        report.append(device['result'])
+    return "\n".join(report)
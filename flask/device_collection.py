@@ -0,0 +1,378 @@
+# Import required libraries
+from netmiko.exceptions import ReadTimeout
+from acl_engine import SHOW_HEADER
+import audit_trace
+import codecs
+import json
+import re
+import time
+import zlib
+
+# Header lines of each ACL in show access-lists output
+ACL_HEADER = re.compile(SHOW_HEADER.pattern, re.MULTILINE | re.IGNORECASE)
+# Command whose output goes to the ACL side of a streamed comparison, everything else is running config
+ACL_COMMAND = 'show access-lists'
+# Bump when the layout of raw captures changes
+CAPTURE_FORMAT = 1
+# Compressed bytes replayed at a time from a capture
+REPLAY_CHUNK = 64 * 1024
+# Seconds without output after which a timed-out pipelined read is taken to be over
+DRAIN_QUIET = 2.0
+
+
+def show_commands(bulk_config):
+    """
+    Turn the bulk config lines into exec-mode show commands.
+
+    'do show run' only needs config mode for the 'do', so the show commands are
+    sent straight from the enable prompt instead.
+
+    :param lst bulk_config: Lines of golden/bulk_config_file.txt
+    """
+    commands = []
+    for line in bulk_config:
+        command = line.strip()
+        if command.startswith('do '):
+            command = command[3:].strip()
+        if command and command not in commands:
+            commands.append(command)
+    return commands
+
+
+def split_access_lists(output):
+    """
+    Split show access-lists output into ACL name -> text of that ACL (header included).
+    """
+    acls = {}
+    headers = list(ACL_HEADER.finditer(output))
+    for position, header in enumerate(headers):
+        end = headers[position + 1].start() if position + 1 < len(headers) else len(output)
+        acls[header.group(2)] = output[header.start():end].rstrip()
+    return acls
+
+
+def _drain(net_connect, prompt_regex, remaining, read_timeout, tail=''):
+    """
+    Read what is left of pipelined output that timed out, then re-sync with the prompt.
+
+    The device may still be printing the commands it was sent, so reading stops
+    once their remaining prompts came back or the output has gone quiet for
+    DRAIN_QUIET seconds. find_prompt() then leaves the channel at a fresh prompt,
+    so send_command() in the fallback isn't handed the end of the pipelined output.
+
+    :param prompt_regex:        Compiled prompt regex, matching at the start of a line
+    :param int remaining:       Prompts still expected
+    :param int read_timeout:    Most seconds to keep reading
+    :param str tail:            Unfinished last line already read, it may hold the start of a prompt
+    """
+    deadline = time.monotonic() + read_timeout
+    quiet_since = time.monotonic()
+    pending = tail
+    while remaining > 0 and time.monotonic() < deadline:
+        data = net_connect.read_channel()
+        if not data:
+            if time.monotonic() - quiet_since >= DRAIN_QUIET:
+                break
+            time.sleep(0.02)
+            continue
+        quiet_since = time.monotonic()
+        pending += data
+        # Complete lines are counted now, the unfinished last one once it is a whole prompt
+        cut = pending.rfind('\n') + 1
+        for _ in prompt_regex.finditer(pending, 0, cut):
+            remaining -= 1
+        pending = pending[cut:]
+        if prompt_regex.match(pending):
+            remaining -= 1
+            pending = ''
+    net_connect.find_prompt()
+    net_connect.clear_buffer()
+
+
+def _pipelined_show(net_connect, commands, read_timeout):
+    # Send every command in one write and read until the prompt has come back once per
+    # command, so the device is paid one round trip instead of one per command
+    prompt = re.escape(net_connect.base_prompt) + r'[>#]'
+    prompt_regex = re.compile(r'^' + prompt, re.MULTILINE)
+    payload = ''.join(command + net_connect.RETURN for command in commands)
+    net_connect.clear_buffer()
+    net_connect.write_channel(payload)
+
+    output = ''
+    prompts = 0
+    scan_from = 0
+    # Each command is done when its prompt comes back, so the gaps between prompts time the commands
+    finished = [time.perf_counter()]
+    # read_timeout is per command, as send_command() would give each of them
+    timeout = read_timeout * len(commands)
+    deadline = time.monotonic() + timeout
+    while prompts < len(commands):
+        if time.monotonic() > deadline:
+            tail = output[max(scan_from, output.rfind('\n') + 1):]
+            _drain(net_connect, prompt_regex, len(commands) - prompts, read_timeout, tail)
+            raise ReadTimeout(f'Prompt returned {prompts} of {len(commands)} times within {timeout} seconds')
+        data = net_connect.read_channel()
+        if not data:
+            time.sleep(0.02)
+            continue
+        output += data
+        for match in prompt_regex.finditer(output, scan_from):
+            prompts += 1
+            scan_from = match.end()
+            finished.append(time.perf_counter())
+        # Only rescan the tail that could still hold a partial prompt
+        scan_from = max(scan_from, len(output) - len(net_connect.base_prompt) - 2)
+
+    output = net_connect.normalize_linefeeds(output)
+    # Each segment is the echoed command on its first line followed by its output
+    results = {}
+    segments = prompt_regex.split(output)
+    for command, segment in zip(commands, segments):
+        results[command] = segment.split('\n', 1)[1] if '\n' in segment else ''
+    seconds = {}
+    for position, command in enumerate(commands):
+        duration = finished[position + 1] - finished[position]
+        seconds[command] = round(duration, 4)
+        audit_trace.add_span('command', finished[position], duration, 'command', {'command': command, 'pipelined': True})
+    return results, seconds, len(payload), len(output)
+
+
+def collect_device(net_connect, bulk_config, pipeline=True, read_timeout=120):
+    """
+    Collect everything the baseline is compared against from an enabled session.
+
+    The show commands from the bulk config and a single 'show access-lists'
+    (split per ACL here instead of one 'show access-list N' per golden ACL)
+    are sent together. With pipeline=True they go out in one write; if that
+    times out, the rest of its output is read and the prompt found again before
+    the commands fall back to one send_command() each.
+
+    :param net_connect:         Enabled Netmiko connection
+    :param lst bulk_config:     Lines of golden/bulk_config_file.txt
+    :param bool pipeline:       Send all commands in one write instead of waiting for each prompt
+    :param int read_timeout:    Seconds to wait for the output of each command
+    :return dict:               running_config (show output), acls (name -> text) and stats, with the
+                                seconds each command took in stats['command_seconds']
+    """
+    commands = show_commands(bulk_config) + [ACL_COMMAND]
+    stats = {'commands': len(commands), 'round_trips': 0, 'bytes_sent': 0, 'bytes_received': 0, 'pipelined': False,
+             'command_seconds': {}}
+    started = time.monotonic()
+
+    outputs = None
+    if pipeline:
+        try:
+            with audit_trace.span('pipelined_show', 'command', commands=len(commands)):
+                outputs, seconds, sent, received = _pipelined_show(net_connect, commands, read_timeout)
+            stats.update(round_trips=1, bytes_sent=sent, bytes_received=received, pipelined=True,
+                         command_seconds=seconds)
+        except ReadTimeout as pipeline_error:
+            print('Pipelined collection failed, sending commands one at a time: ' + str(pipeline_error))
+            outputs = None
+
+    if outputs is None:
+        outputs = {}
+        for command in commands:
+            sent_at = time.perf_counter()
+            with audit_trace.span('send_command', 'command', command=command):
+                outputs[command] = net_connect.send_command(command, read_timeout=read_timeout)
+            stats['command_seconds'][command] = round(time.perf_counter() - sent_at, 4)
+            stats['round_trips'] += 1
+            stats['bytes_sent'] += len(command) + 1
+            stats['bytes_received'] += len(outputs[command])
+
+    stats['seconds'] = round(time.monotonic() - started, 3)
+    access_lists = outputs.pop(ACL_COMMAND, '')
+    return {
+        'running_config': '\n'.join(outputs[command] for command in commands if command in outputs),
+        'acls': split_access_lists(access_lists),
+        'stats': stats,
+    }
+
+
+class TranscriptReader:
+    """
+    Splits the transcript of pipelined show commands into lines as it arrives.
+
+    Each line goes straight to the evaluation: feed_acl() for show access-lists,
+    feed_config() for the other commands. Only the unfinished last line is kept,
+    plus, when capture is set, the transcript compressed as it streams through.
+    """
+    def __init__(self, base_prompt, commands, evaluation, capture=False):
+        """
+        :param str base_prompt:     Device prompt without the trailing > or #
+        :param lst commands:        Commands in the order they were sent
+        :param evaluation:          Object with feed_config(line) and feed_acl(line), e.g. DeviceEvaluation
+        :param bool capture:        Keep a zlib-compressed copy of the transcript, see replay_capture()
+        """
+        self.prompt_regex = re.compile(r'^' + re.escape(base_prompt) + r'[>#]')
+        self.commands = list(commands)
+        self.evaluation = evaluation
+        self.prompts = 0
+        self.received = 0
+        # Each command is done when its prompt comes back, so the gaps between prompts time the commands
+        self.finished = [time.perf_counter()]
+        self._partial = ''
+        # The transcript starts with the echo of the first command, later echoes follow a prompt
+        self._echo = True
+        self._compressor = None
+        self._capture = []
+        if capture:
+            self._compressor = zlib.compressobj()
+            header = {'format': CAPTURE_FORMAT, 'prompt': base_prompt, 'commands': self.commands}
+            self._capture.append(self._compressor.compress((json.dumps(header) + '\n').encode()))
+
+    @property
+    def done(self):
+        return self.prompts >= len(self.commands)
+
+    def feed(self, data):
+        self.received += len(data)
+        if self._compressor is not None:
+            self._capture.append(self._compressor.compress(data.encode('utf-8', 'replace')))
+        lines = (self._partial + data).split('\n')
+        self._partial = lines.pop()
+        for line in lines:
+            self._line(line.strip('\r'))
+        # The prompt after the last command isn't followed by a newline
+        if self.prompts == len(self.commands) - 1 and self.prompt_regex.match(self._partial.strip('\r')):
+            self._partial = ''
+            self._prompt()
+
+    def _prompt(self):
+        self.prompts += 1
+        self.finished.append(time.perf_counter())
+
+    def _line(self, line):
+        if self.prompt_regex.match(line):
+            # The rest of a prompt line is the echo of the next command
+            self._prompt()
+            return
+        if self._echo:
+            self._echo = False
+            return
+        if self.done:
+            return
+        if self.commands[self.prompts] == ACL_COMMAND:
+            self.evaluation.feed_acl(line)
+        else:
+            self.evaluation.feed_config(line)
+
+    def capture(self):
+        """
+        The compressed transcript, None when capture wasn't asked for.
+        """
+        if self._compressor is not None:
+            self._capture.append(self._compressor.flush())
+            self._compressor = None
+            self._capture = [b''.join(self._capture)]
+        return self._capture[0] if self._capture else None
+
+
+def _stream_pipelined_show(net_connect, reader, read_timeout):
+    # Like _pipelined_show(), but every chunk goes to the reader as soon as it is read instead of into one string
+    payload = ''.join(command + net_connect.RETURN for command in reader.commands)
+    net_connect.clear_buffer()
+    net_connect.write_channel(payload)
+    timeout = read_timeout * len(reader.commands)
+    deadline = time.monotonic() + timeout
+    while not reader.done:
+        if time.monotonic() > deadline:
+            _drain(net_connect, re.compile(reader.prompt_regex.pattern, re.MULTILINE),
+                   len(reader.commands) - reader.prompts, read_timeout, reader._partial)
+            raise ReadTimeout(f'Prompt returned {reader.prompts} of {len(reader.commands)} times within {timeout} seconds')
+        data = net_connect.read_channel()
+        if not data:
+            time.sleep(0.02)
+            continue
+        reader.feed(data)
+    seconds = {}
+    for position, command in enumerate(reader.commands):
+        duration = reader.finished[position + 1] - reader.finished[position]
+        seconds[command] = round(duration, 4)
+        audit_trace.add_span('command', reader.finished[position], duration, 'command', {'command': command, 'pipelined': True})
+    return seconds, len(payload)
+
+
+def stream_device(net_connect, bulk_config, new_evaluation, capture=False, pipeline=True, read_timeout=120):
+    """
+    Collect the same output as collect_device(), comparing it line by line as it is received.
+
+    The output is never held as a whole: each line is handed to the evaluation
+    and dropped, so memory per device stays bounded however large the config.
+    With capture=True a compressed copy of the transcript is kept, which
+    replay_capture() can compare again later (e.g. against a new baseline).
+
+    :param net_connect:         Enabled Netmiko connection
+    :param lst bulk_config:     Lines of golden/bulk_config_file.txt
+    :param func new_evaluation: Returns a fresh evaluation (feed_config/feed_acl), called again if collection restarts
+    :param bool capture:        Keep the compressed raw transcript
+    :param bool pipeline:       Send all commands in one write instead of waiting for each prompt
+    :param int read_timeout:    Seconds to wait for the output of each command
+    :return dict:               evaluation, capture (bytes or None) and stats as collect_device() records them
+    """
+    commands = show_commands(bulk_config) + [ACL_COMMAND]
+    stats = {'commands': len(commands), 'round_trips': 0, 'bytes_sent': 0, 'bytes_received': 0, 'pipelined': False,
+             'command_seconds': {}, 'streamed': True}
+    started = time.monotonic()
+
+    reader = None
+    if pipeline:
+        reader = TranscriptReader(net_connect.base_prompt, commands, new_evaluation(), capture)
+        try:
+            with audit_trace.span('pipelined_show', 'command', commands=len(commands)):
+                seconds, sent = _stream_pipelined_show(net_connect, reader, read_timeout)
+            stats.update(round_trips=1, bytes_sent=sent, bytes_received=reader.received, pipelined=True,
+                         command_seconds=seconds)
+        except ReadTimeout as pipeline_error:
+            print('Pipelined collection failed, sending commands one at a time: ' + str(pipeline_error))
+            reader = None
+
+    if reader is None:
+        # One command at a time, written to the reader as the transcript the pipelined commands would have given
+        reader = TranscriptReader(net_connect.base_prompt, commands, new_evaluation(), capture)
+        prompt = net_connect.base_prompt + '#'
+        for position, command in enumerate(commands):
+            sent_at = time.perf_counter()
+            with audit_trace.span('send_command', 'command', command=command):
+                output = net_connect.send_command(command, read_timeout=read_timeout)
+            stats['command_seconds'][command] = round(time.perf_counter() - sent_at, 4)
+            stats['round_trips'] += 1
+            stats['bytes_sent'] += len(command) + 1
+            stats['bytes_received'] += len(output)
+            reader.feed((prompt if position else '') + command + '\n' + output + '\n')
+        reader.feed(prompt)
+
+    stats['seconds'] = round(time.monotonic() - started, 3)
+    return {'evaluation': reader.evaluation, 'capture': reader.capture(), 'stats': stats}
+
+
+def replay_capture(capture, evaluation):
+    """
+    Feed a capture from stream_device() to a new evaluation, decompressing it a chunk at a time.
+
+    :param bytes capture:   Compressed transcript
+    :param evaluation:      Object with feed_config(line) and feed_acl(line)
+    :return:                The evaluation, fed every line of the transcript
+    :raises ValueError:     For a capture written in another format
+    """
+    decompressor = zlib.decompressobj()
+    decoder = codecs.getincrementaldecoder('utf-8')('replace')
+    reader = None
+    header = ''
+    for start in range(0, len(capture), REPLAY_CHUNK):
+        text = decoder.decode(decompressor.decompress(capture[start:start + REPLAY_CHUNK]))
+        if reader is None:
+            header += text
+            if '\n' not in header:
+                continue
+            line, text = header.split('\n', 1)
+            fields = json.loads(line)
+            if fields.get('format') != CAPTURE_FORMAT:
+                raise ValueError(f"Capture format {fields.get('format')} is not {CAPTURE_FORMAT}")
+            reader = TranscriptReader(fields['prompt'], fields['commands'], evaluation)
+        reader.feed(text)
+    if reader is None:
+        raise ValueError('Capture has no header')
+    reader.feed(decoder.decode(decompressor.flush(), final=True))
+    return evaluation
@@ -0,0 +1,99 @@
+# Import required libraries
+from device_audit import device_result
+from device_collection import replay_capture
+from acl_engine import AclCollector, compare_acls, parse_access_lists
+from compliance_history import ACL_SECTION
+from config_tree import ConfigTree
+import audit_metrics
+import audit_trace
+
+
+class DeviceEvaluation:
+    """
+    Comparison of one device with the golden templates, fed its output one line at a time.
+
+    Holds the matcher state and the entries of the device's golden-named ACLs,
+    never the output itself, see device_collection.stream_device().
+    """
+    def __init__(self, baseline):
+        """
+        :param GoldenBaseline baseline: Golden templates to compare against
+        """
+        self.baseline = baseline
+        self._config = baseline.stig_matcher.stream()
+        self._acls = AclCollector(names=baseline.acls)
+
+    def feed_config(self, line):
+        self._config.feed(line)
+
+    def feed_acl(self, line):
+        self._acls.feed(line)
+
+    def result(self, devices, stats):
+        """
+        :return dict:   device_result() for the device, as compare_device() gives it
+        """
+        with audit_metrics.phase('compare'), audit_trace.profiled('compare'):
+            satisfied = self._config.finish()
+            missing_by_acl = compare_acls(self.baseline.acls, self._acls.acls())
+        return device_report(devices, self.baseline, satisfied, missing_by_acl, stats)
+
+
+def compare_device(devices, collected, baseline):
+    """
+    Compare collected device output with the golden templates.
+
+    :param str devices:             IP address of the device
+    :param dict collected:          Output from collect_device(), or stream_device() with its evaluation
+                                    or capture (a capture is compared again against this baseline)
+    :param GoldenBaseline baseline: Golden templates to compare against
+    :return dict:                   device_result() for the device
+    """
+    stats = collected['stats']
+    if collected.get('evaluation') is not None:
+        return collected['evaluation'].result(devices, stats)
+    if collected.get('capture') is not None:
+        with audit_metrics.phase('parse'):
+            evaluation = replay_capture(collected['capture'], DeviceEvaluation(baseline))
+        return evaluation.result(devices, stats)
+
+    with audit_metrics.phase('parse'):
+        running_config = ConfigTree.parse(collected['running_config'].splitlines())
+        running_acls = parse_access_lists(collected['acls'])
+
+    with audit_metrics.phase('compare'), audit_trace.profiled('compare'):
+        # Validate STIG configuration commands in one pass over the running config
+        satisfied = baseline.stig_matcher.evaluate(running_config)
+        # Compare every golden ACL with the device's ACL of the same name
+        missing_by_acl = compare_acls(baseline.acls, running_acls)
+    return device_report(devices, baseline, satisfied, missing_by_acl, stats)
+
+
+def device_report(devices, baseline, satisfied, missing_by_acl, stats):
+    """
+    Turn the satisfied STIG rules and missing ACL entries into the device's result.
+    """
+    missing_rules = baseline.stig_matcher.missing(satisfied)
+    missing_commands = [rule.display for rule in missing_rules]
+
+    if missing_commands:
+        missing_commands.insert(0, "//////// Missing the following commands \\\\\\\\\\\\\\\\")
+
+    missing_acls = []
+    for name, missing_entries in missing_by_acl.items():
+        missing_acls.append(f"\n\n//////// Missing the following from ACL {name} \\\\\\\\\\\\\\\\")
+        missing_acls.extend(missing_entries)
+
+    # Combines all outputs into a single variable
+    stig_compliant_check = missing_commands + missing_acls
+    # Failed rules as recorded in the compliance history
+    failed = [[rule.section, rule.display] for rule in missing_rules]
+    failed.extend([ACL_SECTION, 'access-list ' + name] for name in missing_by_acl)
+
+    # Determine STIG compliance
+    if not stig_compliant_check:
+        return device_result(devices, 'compliant', "Device is STIG compliant", stats, failed)
+
+    result = "Device is not STIG compliant, revisit the IOS_Template and check again\nThe device is missing the following commands\n\n"
+    result += "\n".join(stig_compliant_check)
+    return device_result(devices, 'not_compliant', result, stats, failed)
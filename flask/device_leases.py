@@ -0,0 +1,305 @@
+# Import required libraries
+from contextlib import contextmanager
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+# Shared by every gunicorn worker and stig_push run on this host, so all of them count against the same cap
+DEFAULT_LEASE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'device_leases.sqlite3')
+# Seconds between checks of the lease table while waiting for a busy device or a free session
+POLL_INTERVAL = 0.25
+
+
+class DeviceBusy(TimeoutError):
+    """
+    No lease within the timeout: the device is held by another audit or push, or the session budget is used up.
+    """
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class DeviceLeases:
+    """
+    Cross-process device coordination through a SQLite lease table.
+
+    A lease is one row keyed by device and covers one open SSH session for its
+    whole life, idle time in a session pool included, so only one session to a
+    device is open at a time and no lease is granted while max_sessions rows
+    exist, keeping every gunicorn worker and CLI push under one session budget.
+    An idle session keeps its lease until someone else needs the device or a
+    slot: the waiter marks the idle lease wanted and the pool holding it closes
+    the session (see SessionPool). Leases of processes that died are reclaimed,
+    and a lease older than ttl is taken over in case its holder hangs.
+
+    Audits in flight are tracked separately with the result of every device's
+    last audit, so an audit asked for while another audit of the same device was
+    in flight can reuse that result instead of connecting again.
+    """
+    def __init__(self, path=DEFAULT_LEASE_PATH, max_sessions=100, ttl=1800, poll_interval=POLL_INTERVAL):
+        """
+        :param str path:            SQLite file holding the leases, the same file for every process to coordinate
+        :param int max_sessions:    Most sessions open at the same time across all processes
+        :param int ttl:             Seconds after which a lease not used since is taken over even though its
+                                    process is alive
+        :param float poll_interval: Seconds between checks while waiting for a lease
+        """
+        self.path = path
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+        self.stats = {'acquired': 0, 'shared': 0, 'reclaimed': 0}
+        self._lock = threading.Lock()
+        # Wakes up threads of this process as soon as one of them releases a lease or finishes an audit
+        self._released = threading.Condition()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Autocommit mode, so BEGIN IMMEDIATE below takes the write lock before the lease table is read
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript('''
+            CREATE TABLE IF NOT EXISTS device_leases (
+                device TEXT PRIMARY KEY,
+                token TEXT NOT NULL,
+                purpose TEXT NOT NULL,
+                pid INTEGER NOT NULL,
+                idle INTEGER NOT NULL,
+                wanted TEXT NOT NULL,
+                acquired REAL NOT NULL,
+                expires REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS audits_in_flight (
+                device TEXT NOT NULL,
+                key TEXT NOT NULL,
+                pid INTEGER NOT NULL,
+                started REAL NOT NULL,
+                PRIMARY KEY (device, key));
+            CREATE TABLE IF NOT EXISTS device_results (
+                device TEXT PRIMARY KEY,
+                key TEXT NOT NULL,
+                result TEXT NOT NULL,
+                finished REAL NOT NULL);
+            CREATE INDEX IF NOT EXISTS device_results_finished ON device_results (finished);
+        ''')
+
+    @contextmanager
+    def lease(self, device, purpose, timeout=None):
+        """
+        Hold the device's lease for the duration of the block.
+
+        :param str device:      Device IP address
+        :param str purpose:     What the lease is for, e.g. 'audit' or 'push'
+        :param float timeout:   Seconds to wait for the device and a free session, None waits forever
+        """
+        token = self.acquire(device, purpose, timeout)
+        try:
+            yield token
+        finally:
+            self.release(device, token)
+
+    def acquire(self, device, purpose, timeout=None):
+        """
+        Wait until the device is free and the session budget allows another lease, then take it.
+
+        :return str:    Token to release the lease with
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        # The token also marks the idle lease this caller waits for, so every waiter gets one session closed for it
+        token = uuid.uuid4().hex
+        while True:
+            holder = self._try_acquire(device, purpose, token)
+            if holder is None:
+                return token
+            self._wait(deadline, device, holder or None)
+
+    def release(self, device, token):
+        """
+        Give the lease back, once its session is closed.
+        """
+        with self._lock:
+            self._db.execute('DELETE FROM device_leases WHERE device = ? AND token = ?', (device, token))
+        with self._released:
+            self._released.notify_all()
+
+    def park(self, device, token):
+        """
+        Mark the lease idle: its session waits in a pool and may be closed for whoever wants the device or a slot.
+        """
+        with self._lock:
+            self._db.execute('UPDATE device_leases SET idle = 1, expires = ? WHERE device = ? AND token = ?',
+                             (time.time() + self.ttl, device, token))
+
+    def unpark(self, device, token):
+        """
+        Take an idle lease back into use.
+
+        :return bool:   False when the lease is gone or wanted by someone else, and its session must be closed
+        """
+        with self._lock:
+            updated = self._db.execute('UPDATE device_leases SET idle = 0, expires = ? '
+                                       "WHERE device = ? AND token = ? AND wanted = ''",
+                                       (time.time() + self.ttl, device, token)).rowcount
+        return bool(updated)
+
+    def wanted(self):
+        """
+        Tokens of this process's idle leases that another caller is waiting for.
+        """
+        with self._lock:
+            rows = self._db.execute("SELECT token FROM device_leases WHERE pid = ? AND idle = 1 AND wanted != ''",
+                                    (os.getpid(),)).fetchall()
+        return {token for token, in rows}
+
+    def shared_audit(self, device, key, audit_func, timeout=None):
+        """
+        Run an audit of the device, or reuse the result of an audit of the same device and key
+        that was in flight when this one was asked for.
+
+        :param str device:      Device IP address
+        :param str key:         Everything the result depends on besides the device, e.g. baseline and credentials
+        :param func audit_func: Callable doing the audit (leasing its session) and returning a JSON serializable result
+        :param float timeout:   Seconds to wait for the in-flight audit, None waits forever
+        :return tuple:          (result of audit_func(), True when it is the result of the in-flight audit)
+        """
+        requested = time.time()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            shared = self._result(device, key, requested)
+            if shared is not None:
+                self._count('shared')
+                return shared, True
+            if self._claim_audit(device, key):
+                break
+            self._wait(deadline, device, 'audit')
+
+        result = None
+        try:
+            result = audit_func()
+            return result, False
+        finally:
+            self._finish_audit(device, key, result)
+
+    def counts(self):
+        """
+        Leases held right now across every process, by purpose and whether their session is idle.
+        """
+        with self._lock:
+            rows = self._db.execute('SELECT purpose, idle, COUNT(*) FROM device_leases GROUP BY purpose, idle').fetchall()
+        return {(purpose, 'idle' if idle else 'in_use'): count for purpose, idle, count in rows}
+
+    def _try_acquire(self, device, purpose, token):
+        """
+        One attempt at taking the lease.
+
+        :return str:    None when granted, otherwise the purpose of the device's holder or '' when the
+                        session budget is used up
+        """
+        now = time.time()
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                holder = self._holder(device)
+                if holder is not None or self._held() >= self.max_sessions:
+                    # Only look for abandoned leases when one is in the way
+                    if self._reclaim(now):
+                        holder = self._holder(device)
+                if holder is not None:
+                    # An idle session to the device is closed by its pool for us
+                    self._db.execute('UPDATE device_leases SET wanted = ? WHERE device = ? AND idle = 1', (token, device))
+                    self._db.execute('COMMIT')
+                    return holder
+                if self._held() >= self.max_sessions:
+                    # Free a slot by having the longest idle session nobody asked for yet closed for this caller
+                    self._db.execute("UPDATE device_leases SET wanted = ? WHERE rowid = "
+                                     "(SELECT rowid FROM device_leases WHERE idle = 1 AND wanted = '' ORDER BY expires LIMIT 1) "
+                                     "AND NOT EXISTS (SELECT 1 FROM device_leases WHERE wanted = ?)", (token, token))
+                    self._db.execute('COMMIT')
+                    return ''
+                self._db.execute("INSERT INTO device_leases VALUES (?, ?, ?, ?, 0, '', ?, ?)",
+                                 (device, token, purpose, os.getpid(), now, now + self.ttl))
+                self._db.execute('COMMIT')
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+        self._count('acquired')
+        return None
+
+    def _holder(self, device):
+        row = self._db.execute('SELECT purpose FROM device_leases WHERE device = ?', (device,)).fetchone()
+        return None if row is None else row[0]
+
+    def _held(self):
+        return self._db.execute('SELECT COUNT(*) FROM device_leases').fetchone()[0]
+
+    def _reclaim(self, now):
+        # Leases past their ttl and leases of processes on this host that no longer exist
+        removed = self._db.execute('DELETE FROM device_leases WHERE expires < ?', (now,)).rowcount
+        dead = [(pid,) for pid, in self._db.execute('SELECT DISTINCT pid FROM device_leases')
+                if pid != os.getpid() and not process_alive(pid)]
+        if dead:
+            removed += self._db.executemany('DELETE FROM device_leases WHERE pid = ?', dead).rowcount
+        self.stats['reclaimed'] += removed
+        return removed
+
+    def _claim_audit(self, device, key):
+        # Register this audit as in flight unless a live process already runs one of the same device and key
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._db.execute('SELECT pid FROM audits_in_flight WHERE device = ? AND key = ?',
+                                       (device, key)).fetchone()
+                if row is not None and (row[0] == os.getpid() or process_alive(row[0])):
+                    self._db.execute('COMMIT')
+                    return False
+                self._db.execute('INSERT OR REPLACE INTO audits_in_flight VALUES (?, ?, ?, ?)',
+                                 (device, key, os.getpid(), time.time()))
+                self._db.execute('COMMIT')
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+        return True
+
+    def _finish_audit(self, device, key, result):
+        # Publish the result for the audits that waited for this one, in the same transaction that ends it
+        now = time.time()
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                if result is not None:
+                    self._db.execute('INSERT OR REPLACE INTO device_results VALUES (?, ?, ?, ?)',
+                                     (device, key, json.dumps(result), now))
+                    self._db.execute('DELETE FROM device_results WHERE finished < ?', (now - self.ttl,))
+                self._db.execute('DELETE FROM audits_in_flight WHERE device = ? AND key = ?', (device, key))
+                self._db.execute('COMMIT')
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+        with self._released:
+            self._released.notify_all()
+
+    def _result(self, device, key, since):
+        with self._lock:
+            row = self._db.execute('SELECT result FROM device_results WHERE device = ? AND key = ? AND finished >= ?',
+                                   (device, key, since)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def _wait(self, deadline, device, holder):
+        remaining = None if deadline is None else deadline - time.monotonic()
+        if remaining is not None and remaining <= 0:
+            if holder is None:
+                raise DeviceBusy(f'No free device session for {device}, {self.max_sessions} already in use')
+            raise DeviceBusy(f'Device {device} is busy with another {holder}')
+        with self._released:
+            self._released.wait(self.poll_interval if remaining is None else min(self.poll_interval, remaining))
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
@@ -0,0 +1,167 @@
+# Import required libraries
+from types import MappingProxyType
+from compliance_matcher import ComplianceMatcher
+from rule_pack import DEFAULT_PACK_PATH, cached_pack, compile_pack
+from acl_engine import parse_acl_text
+import glob
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+# Directory holding the golden templates, next to this file
+DEFAULT_GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'golden')
+
+# Golden files that make up the baseline
+BULK_CONFIG_FILE = 'bulk_config_file.txt'
+STIG_FILE = 'golden_stig_file.txt'
+GOLDEN_CONFIG_FILE = 'golden_config.json'
+# Every golden_acl<name>_file.txt is a golden ACL, adding one is just adding a file
+ACL_FILE_PATTERN = 'golden_acl*_file.txt'
+ACL_FILE_NAME = re.compile(r'^golden_acl(.+)_file\.txt$')
+
+
+def _freeze(value):
+    # Turn parsed JSON into read-only containers so requests can't change the shared baseline
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def golden_file_names(golden_dir):
+    """
+    Names of the golden files that make up the baseline, existing or not.
+    """
+    acl_files = sorted(os.path.basename(path) for path in glob.glob(os.path.join(golden_dir, ACL_FILE_PATTERN)))
+    return [BULK_CONFIG_FILE, STIG_FILE, GOLDEN_CONFIG_FILE] + acl_files
+
+
+def read_golden_files(golden_dir):
+    """
+    File name -> text of every golden file that exists, as GoldenBaseline() takes them.
+    """
+    contents = {}
+    for name in golden_file_names(golden_dir):
+        path = os.path.join(golden_dir, name)
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                contents[name] = f.read()
+    return contents
+
+
+def _golden_lines(text):
+    # Stripped, non-empty golden lines in file order
+    return tuple(line.strip() for line in text.splitlines() if line.strip())
+
+
+class GoldenBaseline:
+    """
+    Read-only compiled copy of the golden templates.
+
+    Built once and shared by every request and worker thread; nothing on it is
+    ever modified, a file change produces a new GoldenBaseline instead.
+    """
+    __slots__ = ('version', 'loaded', 'bulk_config', 'stig_lines', 'acls', 'golden_config', 'sources',
+                 'stig_matcher', 'section_matcher')
+
+    def __init__(self, contents, loaded=None, pack=None):
+        """
+        :param dict contents:   File name -> file text for every golden file that exists
+        :param float loaded:    Time the files were read
+        :param RulePack pack:   Rules already compiled from these files, compiled here when None
+        """
+        digest = hashlib.sha256()
+        for name in sorted(contents):
+            digest.update(name.encode() + b'\0' + contents[name].encode() + b'\0')
+        self.version = digest.hexdigest()[:16]
+        self.loaded = loaded or time.time()
+        self.sources = tuple(sorted(contents))
+        self.bulk_config = tuple(contents.get(BULK_CONFIG_FILE, '').splitlines())
+        self.stig_lines = _golden_lines(contents.get(STIG_FILE, ''))
+        acls = {}
+        acl_files = [(ACL_FILE_NAME.match(file_name).group(1), file_name) for file_name in contents if ACL_FILE_NAME.match(file_name)]
+        # Numbered ACLs in numeric order, then named ACLs
+        for acl_name, file_name in sorted(acl_files, key=lambda acl: (not acl[0].isdigit(), int(acl[0]) if acl[0].isdigit() else 0, acl[0])):
+            acls.update(parse_acl_text(contents[file_name], name=acl_name))
+        self.acls = MappingProxyType(acls)
+        self.golden_config = _freeze(json.loads(contents[GOLDEN_CONFIG_FILE])) if GOLDEN_CONFIG_FILE in contents else MappingProxyType({})
+
+        # Rules are compiled once per golden version so every audit only pays for the matching itself
+        if pack is None:
+            pack = compile_pack(contents.get(STIG_FILE, ''), contents.get(GOLDEN_CONFIG_FILE))
+        self.stig_matcher = ComplianceMatcher(pack.stig_rules)
+        self.section_matcher = ComplianceMatcher(pack.section_rules)
+
+    def __setattr__(self, name, value):
+        if hasattr(self, name):
+            raise AttributeError('GoldenBaseline is read-only')
+        object.__setattr__(self, name, value)
+
+    @property
+    def sections(self):
+        return self.golden_config.get('sections', MappingProxyType({}))
+
+
+class BaselineLoader:
+    """
+    Holds the current GoldenBaseline and swaps in a new one when a golden file changes.
+    """
+    def __init__(self, golden_dir=DEFAULT_GOLDEN_DIR, check_interval=2.0, pack_path=DEFAULT_PACK_PATH):
+        """
+        :param str golden_dir:          Directory containing the golden files
+        :param float check_interval:    Minimum seconds between checks of the files' mtimes
+        :param str pack_path:           Compiled rule pack shared by every worker, None to always compile
+        """
+        self.golden_dir = golden_dir
+        self.check_interval = check_interval
+        self.pack_path = pack_path
+        self._lock = threading.Lock()
+        self._stats = self._file_stats()
+        self._baseline = self._build()
+        self._checked = time.monotonic()
+
+    def _file_stats(self):
+        stats = {}
+        for name in golden_file_names(self.golden_dir):
+            try:
+                stat = os.stat(os.path.join(self.golden_dir, name))
+            except FileNotFoundError:
+                continue
+            stats[name] = (stat.st_mtime_ns, stat.st_size)
+        return stats
+
+    def _build(self):
+        contents = read_golden_files(self.golden_dir)
+        pack = cached_pack(contents.get(STIG_FILE, ''), contents.get(GOLDEN_CONFIG_FILE), self.pack_path)
+        return GoldenBaseline(contents, pack=pack)
+
+    def get(self):
+        """
+        Return the current baseline, rebuilding it first if a golden file changed.
+
+        Callers should take one baseline per audit and use it for every device so
+        a reload in the middle of a run can't mix two versions of the templates.
+        """
+        if time.monotonic() - self._checked < self.check_interval:
+            return self._baseline
+        with self._lock:
+            if time.monotonic() - self._checked < self.check_interval:
+                return self._baseline
+            self._checked = time.monotonic()
+            stats = self._file_stats()
+            if stats != self._stats:
+                try:
+                    baseline = self._build()
+                except (OSError, ValueError, re.error) as load_error:
+                    # Keep serving the previous baseline while a file is half written or invalid
+                    print('Golden baseline reload failed, keeping version ' + self._baseline.version + ': ' + str(load_error))
+                    return self._baseline
+                self._stats = stats
+                if baseline.version != self._baseline.version:
+                    print('Golden baseline reloaded, version ' + baseline.version)
+                    self._baseline = baseline
+            return self._baseline
@@ -0,0 +1,209 @@
+# Import required libraries
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+from device_audit import device_result, format_report, structured_result
+from device_compare import compare_device
+from acl_engine import config_access_lists
+from golden_baseline import DEFAULT_GOLDEN_DIR, GOLDEN_CONFIG_FILE, STIG_FILE, GoldenBaseline, read_golden_files
+from rule_pack import DEFAULT_PACK_PATH, cached_pack
+import argparse
+import gzip
+import json
+import mmap
+import os
+import sys
+import tarfile
+import time
+import zlib
+
+# Endings stripped from a saved config's file name to get the device name, e.g. 10.1.1.1.cfg or core-sw1-confg.gz
+CONFIG_SUFFIXES = ('.gz', '.txt', '.cfg', '.conf', '-confg')
+GZIP_MAGIC = b'\x1f\x8b'
+# Configs queued per worker process, so a tarball is never read much further ahead than the workers
+QUEUE_PER_PROCESS = 4
+
+# Baseline of this worker process, built once by _init_worker()
+_baseline = None
+
+
+def device_name(path):
+    """
+    Device a saved config belongs to, from its file name without the config endings.
+    """
+    name = os.path.basename(path)
+    stripped = True
+    while stripped:
+        stripped = False
+        for suffix in CONFIG_SUFFIXES:
+            if name.lower().endswith(suffix) and len(name) > len(suffix):
+                name = name[:-len(suffix)]
+                stripped = True
+    return name
+
+
+def iter_saved_configs(source):
+    """
+    Saved running configs in a directory (searched recursively) or a tarball, plain or gzipped.
+
+    Files in a directory are left for the worker to map; tar members are read here
+    one at a time from the stream, so a compressed tarball is never unpacked to disk.
+
+    :param str source:  Directory or tar file (.tar, .tar.gz, .tgz, ...)
+    :return iter:       (device name, path, bytes or None when the worker reads the file itself)
+    """
+    if os.path.isdir(source):
+        for directory, subdirectories, file_names in os.walk(source):
+            subdirectories[:] = sorted(name for name in subdirectories if not name.startswith('.'))
+            for file_name in sorted(file_names):
+                if not file_name.startswith('.'):
+                    path = os.path.join(directory, file_name)
+                    yield device_name(path), path, None
+        return
+    with tarfile.open(source, 'r|*') as archive:
+        for member in archive:
+            if member.isfile() and not os.path.basename(member.name).startswith('.'):
+                yield device_name(member.name), member.name, archive.extractfile(member).read()
+
+
+def read_saved_config(path, data=None):
+    """
+    Text of a saved config, gunzipped when compressed.
+
+    A file on disk is memory-mapped and decoded straight from the page cache,
+    without reading it into a separate buffer first.
+
+    :param str path:    File of the config
+    :param bytes data:  Content already read (a tar member), None to map path
+    """
+    if data is None:
+        with open(path, 'rb') as config_file:
+            if not os.fstat(config_file.fileno()).st_size:
+                return ''
+            with mmap.mmap(config_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                if mapped[:2] == GZIP_MAGIC:
+                    return gzip.decompress(mapped).decode('utf-8', 'replace')
+                return str(mapped, 'utf-8', 'replace')
+    if data[:2] == GZIP_MAGIC:
+        data = gzip.decompress(data)
+    return data.decode('utf-8', 'replace')
+
+
+def _init_worker(contents, pack):
+    # The baseline is built once per process from the parent's files and compiled rules, never read again
+    global _baseline
+    _baseline = GoldenBaseline(contents, pack=pack)
+
+
+def audit_saved_config(name, path, data=None, baseline=None):
+    """
+    Compare one saved running config with the golden templates, like a live audit of the device.
+
+    :param str name:                Device the config belongs to
+    :param str path:                File or tar member the config came from
+    :param bytes data:              Content of a tar member, None to read path
+    :param GoldenBaseline baseline: Golden templates, the worker's baseline when None
+    :return dict:                   device_result() for the device
+    """
+    started = time.perf_counter()
+    try:
+        running_config = read_saved_config(path, data)
+    except (OSError, EOFError, zlib.error, ValueError) as read_error:
+        return device_result(name, 'error', 'Could not read saved configuration ' + str(read_error))
+    if not running_config.strip():
+        return device_result(name, 'error', 'Saved configuration is empty')
+
+    collected = {
+        'running_config': running_config,
+        'acls': config_access_lists(running_config.splitlines()),
+        'stats': {'source': path, 'bytes_read': len(running_config)},
+    }
+    try:
+        result = compare_device(name, collected, baseline or _baseline)
+    except Exception as unknown_error:
+        return device_result(name, 'error', 'Some other error ' + str(unknown_error))
+    result['stats']['seconds'] = round(time.perf_counter() - started, 4)
+    return result
+
+
+def load_baseline(golden_dir=DEFAULT_GOLDEN_DIR, pack_path=DEFAULT_PACK_PATH):
+    """
+    Read the golden files once for an offline audit.
+
+    :return tuple:  (file contents, RulePack, GoldenBaseline) - contents and pack are what the workers are started with
+    """
+    contents = read_golden_files(golden_dir)
+    pack = cached_pack(contents.get(STIG_FILE, ''), contents.get(GOLDEN_CONFIG_FILE), pack_path)
+    return contents, pack, GoldenBaseline(contents, pack=pack)
+
+
+def audit_saved_configs(source, contents, pack, processes=None):
+    """
+    Audit every saved config of source across a pool of processes and yield results as they finish.
+
+    Every worker gets the golden files and compiled rules once, when it starts, so
+    a task only carries a path (or one tar member) and the device result back.
+
+    :param str source:      Directory or tarball of saved running configs
+    :param dict contents:   Golden file contents from load_baseline()
+    :param RulePack pack:   Compiled rules from load_baseline()
+    :param int processes:   Worker processes, one per CPU when None
+    """
+    processes = processes or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker, initargs=(contents, pack)) as pool:
+        pending = set()
+        for name, path, data in iter_saved_configs(source):
+            pending.add(pool.submit(audit_saved_config, name, path, data))
+            if len(pending) >= processes * QUEUE_PER_PROCESS:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        for future in as_completed(pending):
+            yield future.result()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Audit saved running configs against the golden templates, without touching a device')
+    parser.add_argument('source', help='directory or tarball of saved running configs, one device per file')
+    parser.add_argument('--golden-dir', default=DEFAULT_GOLDEN_DIR)
+    parser.add_argument('--processes', type=int, default=None, help='worker processes, one per CPU by default')
+    parser.add_argument('--format', choices=('text', 'ndjson'), default='text',
+                        help='text: the report of the results page, ndjson: one line per device as /api/audit streams them')
+    parser.add_argument('--output', default=None, help='file to write the report to instead of stdout')
+    parser.add_argument('--history', default=None, help='compliance history SQLite file to record the run in')
+    parser.add_argument('--network', default='', help='network the devices belong to, for the compliance history')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    contents, pack, baseline = load_baseline(args.golden_dir)
+    output = open(args.output, 'w') if args.output else sys.stdout
+    started = time.time()
+    results = []
+    counts = {}
+    try:
+        for result in audit_saved_configs(args.source, contents, pack, args.processes):
+            results.append(result)
+            counts[result['status']] = counts.get(result['status'], 0) + 1
+            if args.format == 'ndjson':
+                output.write(json.dumps(structured_result(result)) + '\n')
+        finished = time.time()
+        if args.format == 'ndjson':
+            output.write(json.dumps({'summary': {'source': args.source, 'baseline_version': baseline.version,
+                                                 'total': len(results), 'counts': counts,
+                                                 'started': started, 'finished': finished}}) + '\n')
+        else:
+            output.write(format_report(sorted(results, key=lambda device: device['ip'])) + '\n')
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    if args.history:
+        from compliance_history import ComplianceHistory
+        run_id = ComplianceHistory(args.history).record_run(results, baseline, args.network, None, started, finished)
+        print(f'Recorded as run {run_id} in {args.history}', file=sys.stderr)
+    print(f'{len(results)} saved configs audited in {finished - started:.1f}s against baseline {baseline.version}: {counts}',
+          file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+# Import required libraries
+from acl_analyzer import analyze_acl, equivalent
+from acl_engine import Acl, AclEntry, compare_acl, parse_access_lists
+
+# Numbered ACL ranges that are standard ACLs, every other number is extended
+_STANDARD_NUMBERS = (range(1, 100), range(1300, 2000))
+
+
+def _acl_kind(golden_acl, running_acl):
+    kind = golden_acl.kind or (running_acl.kind if running_acl is not None else '')
+    if kind:
+        return kind
+    if golden_acl.name.isdigit() and any(int(golden_acl.name) in numbers for numbers in _STANDARD_NUMBERS):
+        return 'standard'
+    return 'extended'
+
+
+def _replace_acl(header, golden_acl):
+    # Rewrite the whole ACL when the missing entries can't be slotted in between the existing ones
+    return ['no ' + header, header] + [' ' + entry.text for entry in golden_acl.entries] + [' exit']
+
+
+def acl_remediation(golden_acl, running_acl):
+    """
+    Commands that bring one device ACL in line with the golden ACL.
+
+    Missing entries are inserted with sequence numbers between the golden
+    entries the device already has, so the golden order is kept without
+    touching the rest of the ACL. The ACL is only rewritten as a whole when
+    there is no room between sequence numbers, the device's order differs from
+    the golden one, a golden entry is shadowed on the device, or the inserted
+    entries would not pass compare_acl() (e.g. a device entry without the log
+    keyword of its golden entry would still match first).
+
+    :param Acl golden_acl:  ACL from the golden file
+    :param Acl running_acl: ACL collected from the device, None if the device doesn't have it
+    :return lst:            Configuration commands, empty when nothing has to change
+    """
+    header = f'ip access-list {_acl_kind(golden_acl, running_acl)} {golden_acl.name}'
+    if running_acl is None:
+        return [header] + [' ' + entry.text for entry in golden_acl.entries] + [' exit']
+    if equivalent(golden_acl, running_acl):
+        return []
+    golden_entries = golden_acl.entry_set()
+    if any(item.text in golden_entries for item in analyze_acl(running_acl).unreachable):
+        return _replace_acl(header, golden_acl)
+    if not compare_acl(golden_acl, running_acl, semantic=False):
+        return []
+
+    present = {entry.text: entry.sequence for entry in running_acl.entries}
+    commands = [header]
+    planned = list(running_acl.entries)
+    pending = []
+    previous = 0
+    for entry in golden_acl.entries:
+        if entry.text not in present:
+            pending.append(entry.text)
+            continue
+        sequence = present[entry.text]
+        if sequence is None or sequence <= previous:
+            return _replace_acl(header, golden_acl)
+        if pending:
+            step = (sequence - previous) // (len(pending) + 1)
+            if step < 1:
+                return _replace_acl(header, golden_acl)
+            commands.extend(f' {previous + step * position} {text}' for position, text in enumerate(pending, 1))
+            planned.extend(AclEntry(previous + step * position, text) for position, text in enumerate(pending, 1))
+            pending = []
+        previous = sequence
+    # Missing entries after the last golden entry the device has go at the end
+    commands.extend(' ' + text for text in pending)
+    commands.append(' exit')
+    # Entries without a sequence number are appended by the device, after every numbered one
+    planned.sort(key=lambda entry: (entry.sequence is None, entry.sequence or 0))
+    planned.extend(AclEntry(None, text) for text in pending)
+    if compare_acl(golden_acl, Acl(running_acl.name, running_acl.kind, tuple(planned))):
+        return _replace_acl(header, golden_acl)
+    return commands
+
+
+def remediation_commands(baseline, collected):
+    """
+    The minimal ordered configuration that makes a device compliant with the baseline.
+
+    :param GoldenBaseline baseline: Golden templates to remediate against
+    :param dict collected:          Output of device_collection.collect_device()
+    :return lst:                    Configuration commands, empty for a compliant device
+    """
+    satisfied = baseline.stig_matcher.evaluate(collected['running_config'].splitlines())
+    commands = baseline.stig_matcher.remediation(satisfied)
+    running_acls = parse_access_lists(collected['acls'])
+    for name, golden_acl in baseline.acls.items():
+        commands.extend(acl_remediation(golden_acl, running_acls.get(name)))
+    return commands
@@ -0,0 +1,142 @@
+# Import required libraries
+from collections import namedtuple
+from compliance_matcher import Rule, check_pattern, section_rules, tree_rules
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+# Bump when the serialized rule layout or the rule checks change, packs written by older code are then recompiled
+PACK_FORMAT = 2
+# Compiled rules shared by every worker, next to the other local caches
+DEFAULT_PACK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'golden_rule_pack.json')
+
+
+class RulePack(namedtuple('RulePack', 'source tolerant stig_rules section_rules')):
+    """
+    Golden rules compiled from golden_stig_file.txt and golden_config.json.
+
+    :param str source:          Digest of the golden files the pack was compiled from
+    :param tuple tolerant:      Tolerant patterns from golden_config.json
+    :param tuple stig_rules:    Rules of the golden STIG file
+    :param tuple section_rules: Rules of the golden_config.json sections
+    """
+    __slots__ = ()
+
+
+def pack_source(stig_text, config_text):
+    """
+    Digest identifying the golden rule sources, a pack is only reused for the same digest.
+    """
+    digest = hashlib.sha256()
+    digest.update(str(PACK_FORMAT).encode() + b'\0' + stig_text.encode() + b'\0' + (config_text or '').encode())
+    return digest.hexdigest()[:16]
+
+
+def compile_pack(stig_text, config_text):
+    """
+    Compile the golden files into a RulePack, checking every rule and regular expression.
+
+    The tolerant patterns come from the "tolerant" list of golden_config.json, so
+    allowing another command to vary is a data change: the pattern becomes one more
+    alternative of the combined regex it is matched with. Patterns are checked with
+    check_pattern(), so one that would break its block's combined regex is
+    rejected here, naming the rule, instead of failing every audit.
+
+    :param str stig_text:   Text of golden_stig_file.txt
+    :param str config_text: Text of golden_config.json, None when there is no such file
+    :raises ValueError:     For an invalid golden_config.json, rule object or pattern
+    :raises re.error:       For an invalid regular expression
+    """
+    config = json.loads(config_text) if config_text else {}
+    tolerant = tuple(config.get('tolerant', ()))
+    for pattern in tolerant:
+        check_pattern(pattern, 'Tolerant pattern')
+    return RulePack(
+        pack_source(stig_text, config_text),
+        tolerant,
+        tuple(tree_rules('stig', stig_text.splitlines(), tolerant)),
+        tuple(section_rules(config.get('sections', {}), tolerant)),
+    )
+
+
+def _rule_from_json(fields):
+    rule = Rule(*fields)
+    text = tuple(rule.text) if rule.kind == 'any_of' else rule.text
+    return rule._replace(text=text, parents=tuple(rule.parents))
+
+
+def save_pack(pack, path):
+    """
+    Write a pack as versioned JSON, replacing the file atomically so other workers never read half of it.
+    """
+    data = {
+        'format': PACK_FORMAT,
+        'source': pack.source,
+        'compiled': time.time(),
+        'tolerant': pack.tolerant,
+        'stig_rules': pack.stig_rules,
+        'section_rules': pack.section_rules,
+    }
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.NamedTemporaryFile('w', dir=directory, suffix='.tmp', delete=False) as pack_file:
+        json.dump(data, pack_file)
+    os.replace(pack_file.name, path)
+
+
+def load_pack(path, source):
+    """
+    Read a pack written by save_pack(), or None when it is missing, unreadable or compiled from other files.
+    """
+    try:
+        with open(path, 'r') as pack_file:
+            data = json.load(pack_file)
+        if data.get('format') != PACK_FORMAT or data.get('source') != source:
+            return None
+        return RulePack(source, tuple(data['tolerant']),
+                        tuple(_rule_from_json(fields) for fields in data['stig_rules']),
+                        tuple(_rule_from_json(fields) for fields in data['section_rules']))
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def cached_pack(stig_text, config_text, path=DEFAULT_PACK_PATH):
+    """
+    Load the compiled pack for these golden files, compiling and saving it when there is none.
+
+    The first worker to see new golden files compiles them; the others load the
+    pack instead of parsing and checking every rule again.
+    """
+    source = pack_source(stig_text, config_text)
+    if path is not None:
+        pack = load_pack(path, source)
+        if pack is not None:
+            return pack
+    pack = compile_pack(stig_text, config_text)
+    if path is not None:
+        try:
+            save_pack(pack, path)
+        except OSError as save_error:
+            print('Could not save golden rule pack ' + path + ': ' + str(save_error))
+    return pack
+
+
+if __name__ == '__main__':
+    # Compile the golden files ahead of a deployment: python rule_pack.py [golden_dir] [pack_path]
+    from golden_baseline import DEFAULT_GOLDEN_DIR, GOLDEN_CONFIG_FILE, STIG_FILE
+    golden_dir = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_GOLDEN_DIR
+    pack_path = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_PACK_PATH
+    with open(os.path.join(golden_dir, STIG_FILE), 'r') as f:
+        stig_text = f.read()
+    config_path = os.path.join(golden_dir, GOLDEN_CONFIG_FILE)
+    config_text = None
+    if os.path.exists(config_path):
+        with open(config_path, 'r') as f:
+            config_text = f.read()
+    pack = compile_pack(stig_text, config_text)
+    save_pack(pack, pack_path)
+    print(f'Compiled {len(pack.stig_rules)} STIG and {len(pack.section_rules)} section rules '
+          f'({len(pack.tolerant)} tolerant patterns) into {pack_path}, source {pack.source}')
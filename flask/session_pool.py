@@ -0,0 +1,296 @@
+# Import required libraries
+from contextlib import contextmanager
+from netmiko import ConnectHandler, NetMikoTimeoutException
+import audit_metrics
+import hashlib
+import socket
+import threading
+import time
+
+
+def session_key(device):
+    """
+    Pool key for a Netmiko device dictionary: device and credentials, never the raw password.
+    """
+    secret = (device.get('password', '') + '\0' + device.get('secret', '')).encode()
+    return (device.get('device_type'), device.get('ip') or device.get('host'), device.get('port', 22),
+            device.get('username'), hashlib.sha256(secret).hexdigest())
+
+
+def open_session(device):
+    """
+    Open a Netmiko session and enter enable mode when an enable secret is given.
+
+    The TCP connection is opened here and handed to Netmiko, so the
+    'tcp_connect' phase is the TCP handshake alone and 'ssh_auth' the SSH
+    handshake, authentication and Netmiko's session setup.
+    """
+    address = (device.get('ip') or device.get('host'), device.get('port', 22))
+    with audit_metrics.phase('tcp_connect'):
+        try:
+            sock = socket.create_connection(address, timeout=device.get('conn_timeout', 10))
+        except OSError as socket_error:
+            # Same exception Netmiko raises when it opens the connection itself
+            raise NetMikoTimeoutException(f'TCP connection to {address[0]}:{address[1]} failed: {socket_error}')
+    try:
+        with audit_metrics.phase('ssh_auth'):
+            net_connect = ConnectHandler(sock=sock, **device)
+    except BaseException:
+        sock.close()
+        raise
+    if device.get('secret'):
+        with audit_metrics.phase('enable'):
+            net_connect.enable()
+    return net_connect
+
+
+class SessionPool:
+    """
+    Keeps warm, already-enabled Netmiko sessions so repeated audits skip the SSH handshake.
+
+    Sessions are keyed by device and credentials. A session is only handed to one
+    thread at a time; it is health-checked before reuse, kept alive with SSH
+    keepalives while idle and closed once it has been idle for idle_timeout.
+
+    With leases, every session holds its device's lease from connect to close,
+    idle time included, so the sessions of every pool sharing the lease store
+    stay within one per device and the fleet-wide budget. An idle session whose
+    lease another process or pool is waiting for is closed on the next poll of the lease store.
+    """
+    def __init__(self, max_size=50, max_per_device=2, idle_timeout=240, keepalive=30, connect=open_session,
+                 leases=None, purpose='audit', lease_timeout=None):
+        """
+        :param int max_size:        Maximum open sessions in the pool (idle and in use)
+        :param int max_per_device:  Maximum open sessions to one device with the same credentials
+        :param int idle_timeout:    Seconds an idle session is kept, keep this below the device exec-timeout
+        :param int keepalive:       SSH keepalive interval in seconds for idle sessions
+        :param func connect:        Callable taking a Netmiko device dict and returning an enabled session
+        :param DeviceLeases leases: Lease store shared with other processes, None for no cross-process limits
+        :param str purpose:         What this pool's leases are for, e.g. 'audit' or 'push'
+        :param float lease_timeout: Seconds to wait for a device's lease before DeviceBusy, None waits forever
+        """
+        self.max_size = max_size
+        self.max_per_device = max_per_device
+        self.idle_timeout = idle_timeout
+        self.keepalive = keepalive
+        self.connect = connect
+        self.leases = leases
+        self.purpose = purpose
+        self.lease_timeout = lease_timeout
+        self.stats = {'created': 0, 'reused': 0, 'discarded': 0, 'evicted': 0}
+        self._idle = {}
+        self._open = {}
+        self._total = 0
+        # id() of a session -> (device address, lease token)
+        self._leased = {}
+        self._closed = False
+        self._changed = threading.Condition()
+        # Seconds the thread's last acquire() spent opening a session, see connect_seconds()
+        self._local = threading.local()
+        self._reaper = threading.Thread(target=self._reap, name='session-pool-reaper', daemon=True)
+        self._reaper.start()
+
+    @contextmanager
+    def session(self, device, timeout=None):
+        """
+        Borrow a session for the device; it goes back to the pool unless the block raised.
+
+        :param dict device:     Netmiko device dictionary
+        :param float timeout:   Seconds to wait for a free slot, None waits forever
+        """
+        net_connect = self.acquire(device, timeout)
+        try:
+            yield net_connect
+        except BaseException:
+            self.discard(device, net_connect)
+            raise
+        self.release(device, net_connect)
+
+    def acquire(self, device, timeout=None):
+        """
+        Return a healthy session for the device, reusing an idle one when possible.
+        """
+        key = session_key(device)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        self._local.connect_seconds = None
+        while True:
+            with self._changed:
+                if self._closed:
+                    raise RuntimeError('Session pool is closed')
+                idle = self._idle.get(key)
+                if idle:
+                    net_connect, _ = idle.pop()
+                    reserved = False
+                elif self._open.get(key, 0) < self.max_per_device and (self._total < self.max_size or self._evict_one()):
+                    self._open[key] = self._open.get(key, 0) + 1
+                    self._total += 1
+                    net_connect = None
+                    reserved = True
+                else:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise TimeoutError('No free session for ' + str(key[1]))
+                    self._changed.wait(remaining)
+                    continue
+
+            if reserved:
+                token = None
+                try:
+                    if self.leases is not None:
+                        token = self.leases.acquire(key[1], self.purpose, self.lease_timeout)
+                    started = time.monotonic()
+                    net_connect = self.connect(dict(device, keepalive=self.keepalive))
+                    self._local.connect_seconds = time.monotonic() - started
+                except BaseException:
+                    if token is not None:
+                        self.leases.release(key[1], token)
+                    self._forget(key)
+                    raise
+                if token is not None:
+                    with self._changed:
+                        self._leased[id(net_connect)] = (key[1], token)
+                self._count('created')
+                return net_connect
+
+            # Health check outside the lock, a dead session gives its slot back and we try again
+            if self._unpark(net_connect) and self._healthy(net_connect):
+                self._count('reused')
+                return net_connect
+            self._close(net_connect)
+            self._forget(key)
+            self._count('discarded')
+
+    def connect_seconds(self):
+        """
+        Seconds the calling thread's last acquire() spent opening a new session, waits for a slot or
+        lease excluded; None when it reused an idle session.
+        """
+        return getattr(self._local, 'connect_seconds', None)
+
+    def release(self, device, net_connect):
+        """
+        Return a session to the pool for the next caller.
+        """
+        key = session_key(device)
+        with self._changed:
+            leased = self._leased.get(id(net_connect))
+        if leased is not None:
+            # Parked before another thread can take the session from the idle list and unpark it
+            self.leases.park(*leased)
+        with self._changed:
+            if self._closed:
+                self._forget_locked(key)
+                close = True
+            else:
+                self._idle.setdefault(key, []).append((net_connect, time.monotonic()))
+                close = False
+            self._changed.notify_all()
+        if close:
+            self._close(net_connect)
+
+    def discard(self, device, net_connect):
+        """
+        Close a session that failed instead of returning it to the pool.
+        """
+        self._close(net_connect)
+        self._forget(session_key(device))
+        self._count('discarded')
+
+    def counts(self):
+        """
+        Open sessions (idle and in use) and idle sessions right now.
+        """
+        with self._changed:
+            return {'open': self._total, 'idle': sum(len(sessions) for sessions in self._idle.values())}
+
+    def close_all(self):
+        """
+        Close every idle session and stop handing out new ones.
+        """
+        with self._changed:
+            self._closed = True
+            idle = [(key, net_connect) for key, sessions in self._idle.items() for net_connect, _ in sessions]
+            self._idle = {}
+            for key, _ in idle:
+                self._forget_locked(key)
+            self._changed.notify_all()
+        for _, net_connect in idle:
+            self._close(net_connect)
+
+    def _count(self, name):
+        with self._changed:
+            self.stats[name] += 1
+
+    def _healthy(self, net_connect):
+        try:
+            return net_connect.is_alive()
+        except Exception:
+            return False
+
+    def _close(self, net_connect):
+        try:
+            net_connect.disconnect()
+        except Exception:
+            pass
+        with self._changed:
+            leased = self._leased.pop(id(net_connect), None)
+        if leased is not None:
+            self.leases.release(*leased)
+
+    def _unpark(self, net_connect):
+        # An idle session whose lease was taken over or is wanted elsewhere can't be reused
+        with self._changed:
+            leased = self._leased.get(id(net_connect))
+        return leased is None or self.leases.unpark(*leased)
+
+    def _forget(self, key):
+        with self._changed:
+            self._forget_locked(key)
+            self._changed.notify_all()
+
+    def _forget_locked(self, key):
+        self._open[key] -= 1
+        if not self._open[key]:
+            del self._open[key]
+        self._total -= 1
+
+    def _evict_one(self):
+        # Make room when the pool is full by closing the least recently used idle session
+        oldest = None
+        for key, sessions in self._idle.items():
+            if sessions and (oldest is None or sessions[0][1] < oldest[1]):
+                oldest = (key, sessions[0][1])
+        if oldest is None:
+            return False
+        net_connect, _ = self._idle[oldest[0]].pop(0)
+        self._forget_locked(oldest[0])
+        self.stats['evicted'] += 1
+        threading.Thread(target=self._close, args=(net_connect,), daemon=True).start()
+        return True
+
+    def _reap(self):
+        # Close sessions that have been idle too long, before the device's exec-timeout does, and
+        # idle sessions whose lease someone else is waiting for
+        interval = min(self.keepalive, self.idle_timeout) or 1
+        while not self._closed:
+            time.sleep(min(interval, self.leases.poll_interval) if self.leases is not None else interval)
+            cutoff = time.monotonic() - self.idle_timeout
+            wanted = self.leases.wanted() if self.leases is not None else ()
+            expired = []
+            with self._changed:
+                for key, sessions in self._idle.items():
+                    while sessions and sessions[0][1] < cutoff:
+                        expired.append(sessions.pop(0)[0])
+                        self._forget_locked(key)
+                        self.stats['evicted'] += 1
+                    if wanted:
+                        for position in range(len(sessions) - 1, -1, -1):
+                            leased = self._leased.get(id(sessions[position][0]))
+                            if leased is not None and leased[1] in wanted:
+                                expired.append(sessions.pop(position)[0])
+                                self._forget_locked(key)
+                                self.stats['evicted'] += 1
+                if expired:
+                    self._changed.notify_all()
+            for net_connect in expired:
+                self._close(net_connect)
@@ -1,207 +1,411 @@
-# Import required libraries
-from netmiko import ConnectHandler
-from netmiko import NetMikoTimeoutException
-from paramiko.ssh_exception import SSHException
-from paramiko.ssh_exception import AuthenticationException
-from flask import Flask, render_template, request
-import logging
-
-# Enable debugging logs for Netmiko
-#logging.basicConfig(filename='netmiko_debug.log', level=logging.DEBUG)
-
-# Initialize Flask application
-app = Flask(__name__)
-
-# Route: Home page
-@app.route('/')
-def index():
-    # Render the initial HTML form for user input
-    return render_template('index.html', name='SOCOM SPECTER')
-
-# Route: Form submission handler
-@app.route('/submit', methods=['POST'])
-def submit():
-    # Lists to hold golden (expected) configurations and ACLs
-    golden_standard = []
-    golden_acl1_standard = []
-    golden_acl2_standard = []
-    golden_acl5_standard = []
-    golden_acl55_standard = []
-
-    # Read bulk configuration commands to push to devices (show commands)
-    with open('golden/bulk_config_file.txt') as f:
-        bulk_config = f.read().splitlines()
-
-    # Read golden STIG and ACL configuration templates
-    with open('golden/golden_stig_file.txt', 'r') as f:
-        for line in f.readlines():
-            golden_standard.append([line.strip(), 'false'])
-
-    with open('golden/golden_acl1_file.txt') as f:
-        for line in f.readlines():
-            golden_acl1_standard.append([line.strip(), 'false'])
-
-    with open('golden/golden_acl2_file.txt') as f:
-        for line in f.readlines():
-            golden_acl2_standard.append([line.strip(), 'false'])
-
-    with open('golden/golden_acl5_file.txt') as f:
-        for line in f.readlines():
-            golden_acl5_standard.append([line.strip(), 'false'])
-
-    with open('golden/golden_acl55_file.txt') as f:
-        for line in f.readlines():
-            golden_acl55_standard.append([line.strip(), 'false'])
-
-    # Get form input: list of IPs, credentials, enable secret from html document
-    ip_addrs = request.form.getlist('ip_addrs')
-    username = request.form['username']
-    password = request.form['password']
-    en_secret = request.form['en_secret']
-
-    # Loop through each IP address to connect and validate config
-    for devices in ip_addrs:
-        print('Connecting to ' + devices)
-        ios_device = {
-            'device_type': 'cisco_ios',
-            'ip': devices,
-            'username': username,
-            'password': password,
-            'secret': en_secret,
-            'read_timeout_override': 120,
-        }
-
-        # Connecting to the device and then goes into global configuration, sends the commands from the file and then prints the output
-        try:
-            # Establish connection to the device
-            net_connect = ConnectHandler(**ios_device, verbose=True)
-            net_connect.enable()    
-            # Send show commands and capture ACL outputs       
-            running_config = net_connect.send_config_set(bulk_config)
-            running_acl1 = net_connect.send_command("show access-list 1")
-            running_acl2 = net_connect.send_command("show access-list 2")
-            running_acl5 = net_connect.send_command("show access-list 5")
-            running_acl55 = net_connect.send_command("show access-list 55")
-        # Handle possible connection/authentication exceptions ///// NEED to replace print with return expression or append error to error list
-        except (AuthenticationException):
-            print('Authentication failure ' + devices)
-            continue
-        except (NetMikoTimeoutException):
-            print('Timeout to device ' + devices)
-            continue
-        except (EOFError):
-            print('End of file while attempting device ' + devices)
-            continue
-        except (SSHException):
-            print('SSH Issue. Are you sure SSH is enabled? ' + devices)
-            continue
-        except Exception as unknown_error:
-            print('Some other error ' + str(unknown_error))
-            continue
-
-        print("\n\n\n")
-        #print(running_acl1)
-        #print("\n\n\n")
-        
-        # Validate STIG configuration commands
-        missing_commands = []
-
-        for output in golden_standard:
-            if output[0] == r"path flash:/archived_configs" or output[0] == r"path bootflash:/archived_configs":
-                output[1] = 'true'
-            elif output[0] in running_config:
-                output[1] = 'true'
-            else:
-                missing_commands.append(output[0])
-
-        if missing_commands:
-            missing_commands.insert(0, "//////// Missing the following commands \\\\\\\\\\\\\\\\")
-            for command in missing_commands:
-                print(command)
-
-        # Functionality repeated for each ACL: clean up output and compare
-        print("\n")
-        missing_acl1 = []
-        replace_acl1 = running_acl1.replace(", wildcard bits", "")
-
-        for output in golden_acl1_standard:
-            if output[0] == r"ip access-list standard 1" or output[0] == r"Standard IP access list 1":
-                output[1] = 'true'
-            elif output[0] in replace_acl1:
-                output[1] = 'true'
-            else:
-                missing_acl1.append(output[0])
-
-        if missing_acl1:
-            missing_acl1.insert(0, "\n\n//////// Missing the following from ACL 1 \\\\\\\\\\\\\\\\")
-            for command in missing_acl1:
-                print(command)
-
-        print("\n")
-        missing_acl2 =[]
-        replace_acl2 = running_acl2.replace(", wildcard bits", "")
-
-        for output in golden_acl2_standard:
-            if output[0] == r"ip access-list standard 2" or output[0] == r"Standard IP access list 2":
-                output[1] = 'true'
-            elif output[0] in replace_acl2:
-                output[1] = 'true'
-            else:
-                missing_acl2.append(output[0])
-
-        if missing_acl2:
-            missing_acl2.insert(0, "\n\n//////// Missing the following from ACL 2 \\\\\\\\\\\\\\\\")
-            for commnad in missing_acl2:
-                print(commnad)
-
-        print("\n")
-        missing_acl5 = []
-        replace_acl5 = running_acl5.replace(", wildcard bits", "")
-
-        for output in golden_acl5_standard:
-            if output[0] == r"ip access-list standard 5" or output[0] == r"Standard IP access list 5":
-                output[1] = 'true'
-            elif output[0] in replace_acl5:
-                output[1] = 'true'
-            else:
-                missing_acl5.append(output[0])
-
-        if missing_acl5:
-            missing_acl5.insert(0, "\n\n//////// Missing the following from ACL 5 \\\\\\\\\\\\\\\\")
-            for command in missing_acl5:
-                print(command)
-
-
-        print("\n")
-        missing_acl55 = []
-        replace_acl55 = running_acl55.replace(", wildcard bits", "")
-
-        for output in golden_acl55_standard:
-            if output[0] == r"ip access-list standard 55" or output[0] == r"Standard IP access list 55":
-                output[1] = 'true'
-            elif output[0] in replace_acl55:
-                output[1] = 'true'
-            else:
-                missing_acl55.append(output[0])
-
-        if missing_acl55:    
-            missing_acl55.insert(0, "\n\n//////// Missing the following from ACL 55 \\\\\\\\\\\\\\\\")        
-            for command in missing_acl55:
-                print(command)
-
-        # Combines all outputs into a single variable
-        stig_compliant_check = missing_commands + missing_acl1 + missing_acl2 + missing_acl5 + missing_acl55
-
-        # Determine STIG compliance
-        if not stig_compliant_check:
-            result = "Device is STIG compliant"
-        else:
-            result = "Device is not STIG compliant, revisit the IOS_Template and check again\nThe device is missing the following commands\n\n"
-            result += "\n".join(stig_compliant_check)
-    
-        # Return results to web interface
-        return render_template('specter_post.html', name='SPECTER', result=result)
-    
-            
-if __name__ == '__main__':
-    app.run(host='192.168.10.1', debug=True)
\ No newline at end of file
+# Import required libraries
+from netmiko import NetMikoTimeoutException
+from paramiko.ssh_exception import SSHException
+from paramiko.ssh_exception import AuthenticationException
+from flask import Flask, Response, abort, jsonify, redirect, render_template, request, send_from_directory, url_for
+from device_audit import parse_ip_addrs, parse_device_csv, device_result, audit_devices, format_report, structured_result
+from device_collection import collect_device, stream_device
+from session_pool import SessionPool, session_key
+from config_cache import ConfigCache, FINGERPRINT_COMMAND, probe_fingerprint
+from audit_jobs import JobManager, ndjson_stream, sse_stream
+from golden_baseline import BaselineLoader
+from compliance_history import ComplianceHistory
+from device_compare import DeviceEvaluation, compare_device
+from audit_trace import AuditTrace
+from device_leases import DEFAULT_LEASE_PATH, DeviceBusy, DeviceLeases
+import audit_metrics
+import audit_trace
+import hashlib
+import io
+import logging
+import os
+import time
+
+# Enable debugging logs for Netmiko
+#logging.basicConfig(filename='netmiko_debug.log', level=logging.DEBUG)
+
+# Initialize Flask application
+app = Flask(__name__)
+
+# Audit pool settings: how many devices are audited at once and how long one device may take (seconds)
+app.config['AUDIT_MAX_WORKERS'] = int(os.environ.get('SPECTER_AUDIT_MAX_WORKERS', 25))
+app.config['AUDIT_DEVICE_TIMEOUT'] = int(os.environ.get('SPECTER_AUDIT_DEVICE_TIMEOUT', 300))
+# Warm SSH sessions kept between audits: pool size and seconds a session may sit idle (below the device exec-timeout)
+app.config['SESSION_POOL_SIZE'] = int(os.environ.get('SPECTER_SESSION_POOL_SIZE', 50))
+app.config['SESSION_IDLE_TIMEOUT'] = int(os.environ.get('SPECTER_SESSION_IDLE_TIMEOUT', 240))
+# SSH port of the audited devices
+app.config['SSH_PORT'] = int(os.environ.get('SPECTER_SSH_PORT', 22))
+# Background audit jobs allowed to run at the same time in this worker process
+app.config['AUDIT_MAX_JOBS'] = int(os.environ.get('SPECTER_AUDIT_MAX_JOBS', 4))
+# Collected output cache: file, seconds an entry stays valid and how many devices are kept
+app.config['CONFIG_CACHE_PATH'] = os.environ.get('SPECTER_CONFIG_CACHE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'config_cache.sqlite3'))
+app.config['CONFIG_CACHE_TTL'] = int(os.environ.get('SPECTER_CONFIG_CACHE_TTL', 86400))
+app.config['CONFIG_CACHE_MAX_ENTRIES'] = int(os.environ.get('SPECTER_CONFIG_CACHE_MAX_ENTRIES', 10000))
+# 1 compares device output line by line as it arrives instead of holding it whole; with raw capture the
+# compressed transcript is kept in the config cache so a new baseline can be compared without a full pull
+app.config['STREAM_COMPARE'] = int(os.environ.get('SPECTER_STREAM_COMPARE', 1))
+app.config['RAW_CAPTURE'] = int(os.environ.get('SPECTER_RAW_CAPTURE', 1))
+# Device leases shared with every other worker and stig_push run: one session per device and at most
+# FLEET_MAX_SESSIONS sessions open at once (idle pooled sessions included) across all of them
+app.config['LEASE_PATH'] = os.environ.get('SPECTER_LEASE_PATH', DEFAULT_LEASE_PATH)
+app.config['FLEET_MAX_SESSIONS'] = int(os.environ.get('SPECTER_FLEET_MAX_SESSIONS', 100))
+# Most devices one /api/audit call may submit
+app.config['API_MAX_DEVICES'] = int(os.environ.get('SPECTER_API_MAX_DEVICES', 10000))
+# Compliance history of every audit, queried by the /history endpoints
+app.config['HISTORY_PATH'] = os.environ.get('SPECTER_HISTORY_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'compliance_history.sqlite3'))
+# Largest page the /history endpoints return
+app.config['HISTORY_MAX_PAGE'] = int(os.environ.get('SPECTER_HISTORY_MAX_PAGE', 1000))
+# Chrome trace files of audits submitted with trace enabled, one per job
+app.config['TRACE_DIR'] = os.environ.get('SPECTER_TRACE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'traces'))
+# Networks that get their own metrics series (comma separated), otherwise the first METRICS_MAX_NETWORKS
+# submitted; the rest are labelled 'other'
+app.config['METRICS_NETWORKS'] = os.environ.get('SPECTER_METRICS_NETWORKS', '')
+app.config['METRICS_MAX_NETWORKS'] = int(os.environ.get('SPECTER_METRICS_MAX_NETWORKS', audit_metrics.MAX_NETWORKS))
+# Metrics of every worker are published here, so /metrics on any of them reports the sum
+app.config['METRICS_PATH'] = os.environ.get('SPECTER_METRICS_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'metrics.sqlite3'))
+
+# Golden templates are compiled once here and reloaded only when a file changes
+golden = BaselineLoader()
+
+# Every session holds its device's lease until it is closed; an audit of a device another worker is already
+# auditing waits for that audit and reuses its result
+device_leases = DeviceLeases(app.config['LEASE_PATH'], max_sessions=app.config['FLEET_MAX_SESSIONS'])
+audit_metrics.watch_device_leases(device_leases)
+audit_metrics.REGISTRY.share(app.config['METRICS_PATH'])
+metrics_networks = [network.strip() for network in app.config['METRICS_NETWORKS'].split(',') if network.strip()]
+audit_metrics.limit_networks(metrics_networks or None, app.config['METRICS_MAX_NETWORKS'])
+
+# Already-enabled sessions are reused by later audits of the same device and credentials
+session_pool = SessionPool(max_size=app.config['SESSION_POOL_SIZE'], max_per_device=1,
+                           idle_timeout=app.config['SESSION_IDLE_TIMEOUT'], leases=device_leases,
+                           purpose='audit', lease_timeout=app.config['AUDIT_DEVICE_TIMEOUT'])
+audit_metrics.watch_session_pool('audit', session_pool)
+
+# Devices whose change fingerprint hasn't moved are answered from this cache instead of a full pull
+config_cache = ConfigCache(app.config['CONFIG_CACHE_PATH'], ttl=app.config['CONFIG_CACHE_TTL'],
+                           max_entries=app.config['CONFIG_CACHE_MAX_ENTRIES'])
+
+# Background job engine used by the /jobs endpoints
+job_manager = JobManager(max_jobs=app.config['AUDIT_MAX_JOBS'],
+                         max_workers=app.config['AUDIT_MAX_WORKERS'],
+                         device_timeout=app.config['AUDIT_DEVICE_TIMEOUT'])
+
+# Every finished audit is recorded here so fleet questions don't need a new live audit
+history = ComplianceHistory(app.config['HISTORY_PATH'])
+
+# Route: Home page
+@app.route('/')
+def index():
+    # Render the initial HTML form for user input
+    return render_template('index.html', name='SOCOM SPECTER')
+
+def audit_device(devices, username, password, en_secret, baseline):
+    """
+    Connect to a single device, collect its configuration and compare it to the golden templates.
+
+    Its session holds the device's lease, so no other worker or push talks to it at
+    the same time; if another audit of the device with the same baseline and
+    credentials is already running, its result is returned instead of connecting again.
+
+    :param str devices:             IP address of the device to audit
+    :param GoldenBaseline baseline: Read-only golden templates shared by every device in the audit
+    :return dict:                   device_result() for the device
+    """
+    print('Connecting to ' + devices)
+    ios_device = {
+        'device_type': 'cisco_ios',
+        'ip': devices,
+        'port': app.config['SSH_PORT'],
+        'username': username,
+        'password': password,
+        'secret': en_secret,
+        'read_timeout_override': 120,
+        'verbose': True,
+    }
+    audit_key = hashlib.sha256(repr((baseline.version, session_key(ios_device))).encode()).hexdigest()[:32]
+    try:
+        result, shared = device_leases.shared_audit(devices, audit_key, lambda: collect_and_compare(ios_device, baseline),
+                                                    timeout=app.config['AUDIT_DEVICE_TIMEOUT'])
+    except DeviceBusy as busy_error:
+        audit_metrics.count_error(busy_error)
+        print(str(busy_error))
+        return device_result(devices, 'error', str(busy_error))
+    if shared:
+        print(f"{devices}: audited by another request at the same time, using its result")
+        if 'stats' in result:
+            result['stats'] = dict(result['stats'], shared=True)
+    return result
+
+def collect_and_compare(ios_device, baseline):
+    """
+    Audit a device the caller holds the lease of: probe, collect and compare, or answer from the config cache.
+
+    :param dict ios_device:         Netmiko device dictionary
+    :param GoldenBaseline baseline: Read-only golden templates shared by every device in the audit
+    :return dict:                   device_result() for the device
+    """
+    devices = ios_device['ip']
+    # Connecting to the device, checking whether its configuration changed since the cached audit and
+    # only then running the show commands from the file and show access-lists from the enable prompt
+    try:
+        # Borrow a warm, enabled session from the pool (a new one is opened if none is idle)
+        with session_pool.session(ios_device) as net_connect:
+            with audit_metrics.phase('fingerprint'):
+                fingerprint, probe = probe_fingerprint(net_connect)
+            cached = config_cache.get(devices, fingerprint)
+            if cached is not None and cached['baseline_version'] != baseline.version and cached['collected'] is None:
+                # New baseline but no output kept to compare it with
+                cached = None
+            if cached is None:
+                # Collect the show commands and all ACLs in as few prompt round trips as possible
+                if app.config['STREAM_COMPARE']:
+                    collected = stream_device(net_connect, baseline.bulk_config, lambda: DeviceEvaluation(baseline),
+                                              capture=bool(app.config['RAW_CAPTURE']))
+                else:
+                    collected = collect_device(net_connect, baseline.bulk_config)
+                stats = collected['stats']
+                audit_metrics.record_collection(stats)
+                print(f"{devices}: {stats['round_trips']} round trips, {stats['bytes_received']} bytes received in {stats['seconds']}s")
+    # Handle possible connection/authentication exceptions and report them with the device
+    except (DeviceBusy) as busy_error:
+        audit_metrics.count_error(busy_error)
+        print(str(busy_error))
+        return device_result(devices, 'error', str(busy_error))
+    except (AuthenticationException) as auth_error:
+        audit_metrics.count_error(auth_error)
+        print('Authentication failure ' + devices)
+        return device_result(devices, 'error', 'Authentication failure')
+    except (NetMikoTimeoutException) as timeout_error:
+        audit_metrics.count_error(timeout_error)
+        print('Timeout to device ' + devices)
+        return device_result(devices, 'error', 'Timeout to device')
+    except (EOFError) as eof_error:
+        audit_metrics.count_error(eof_error)
+        print('End of file while attempting device ' + devices)
+        return device_result(devices, 'error', 'End of file while attempting device')
+    except (SSHException) as ssh_error:
+        audit_metrics.count_error(ssh_error)
+        print('SSH Issue. Are you sure SSH is enabled? ' + devices)
+        return device_result(devices, 'error', 'SSH Issue. Are you sure SSH is enabled?')
+    except Exception as unknown_error:
+        audit_metrics.count_error(unknown_error)
+        print('Some other error ' + str(unknown_error))
+        return device_result(devices, 'error', 'Some other error ' + str(unknown_error))
+
+    if cached is not None:
+        probe_stats = {'commands': 1, 'round_trips': 1, 'bytes_sent': len(FINGERPRINT_COMMAND) + 1,
+                       'bytes_received': len(probe), 'cached': True}
+        if cached['baseline_version'] == baseline.version:
+            # Unchanged device and baseline: the earlier result still stands
+            print(f"{devices}: configuration unchanged, using cached result")
+            return dict(cached['result'], stats=probe_stats)
+        # Unchanged device, new baseline: compare the cached output again without a full pull
+        collected = dict(cached['collected'], stats=probe_stats)
+
+    result = compare_device(devices, collected, baseline)
+    config_cache.put(devices, fingerprint, baseline.version, collected, result)
+    return result
+
+def requested(form, field):
+    # Opt-in switches such as trace and profile, from a checkbox, query string value or JSON boolean
+    value = form.get(field)
+    if isinstance(value, str):
+        return value.strip().lower() not in ('', '0', 'false', 'no', 'off')
+    return bool(value)
+
+def build_audit(form):
+    """
+    Take the current golden baseline and read the submitted devices/credentials.
+
+    With trace set, every device audit records nested spans (connect, enable, each
+    show command, parse and compare) into one trace written when the results are
+    recorded; profile additionally runs the compare engine under cProfile.
+
+    :param dict form:   request.form or a JSON body with ip_addrs, username, password, en_secret
+                        and optionally the network the devices belong to, trace and profile
+    :return tuple:      (list of IP addresses, callable auditing one IP, callable recording the results)
+    """
+    # Every device in this audit is checked against the same baseline version
+    baseline = golden.get()
+
+    # Get input: list of IPs, credentials, enable secret from the html document or JSON body
+    ip_addrs = form.getlist('ip_addrs') if hasattr(form, 'getlist') else form['ip_addrs']
+    if isinstance(ip_addrs, str):
+        ip_addrs = [ip_addrs]
+    ip_addrs = parse_ip_addrs(ip_addrs)
+    username = form['username']
+    password = form['password']
+    en_secret = form['en_secret']
+    network = form.get('network') or ''
+    trace = AuditTrace('audit', profile=requested(form, 'profile')) if requested(form, 'trace') else None
+
+    def audit_func(devices):
+        # Spans go to this audit's trace, if any, and metrics are labelled with the device's network
+        with audit_trace.activate(trace), audit_trace.span('audit', ip=devices):
+            with audit_metrics.device_context('audit', network):
+                result = audit_device(devices, username, password, en_secret, baseline)
+                audit_metrics.count_device(result['status'])
+        return result
+
+    def record_results(results, job_id=None, started=None, finished=None):
+        run_id = history.record_run(results, baseline, network, job_id, started, finished)
+        if trace is not None:
+            trace_path = os.path.join(app.config['TRACE_DIR'], (job_id or f'run-{run_id}') + '.json')
+            trace.write(trace_path)
+            print('Audit trace written to ' + trace_path)
+        return run_id
+
+    return ip_addrs, audit_func, record_results
+
+# Route: Form submission handler
+@app.route('/submit', methods=['POST'])
+def submit():
+    ip_addrs, audit_func, record_results = build_audit(request.form)
+
+    # Audit every device in parallel, bounded by the configured pool size and per-device deadline
+    started = time.time()
+    results = audit_devices(ip_addrs, audit_func,
+                            max_workers=app.config['AUDIT_MAX_WORKERS'],
+                            device_timeout=app.config['AUDIT_DEVICE_TIMEOUT'])
+    record_results(results, started=started)
+
+    # Return the combined report to web interface
+    return render_template('specter_post.html', name='SPECTER', result=format_report(results))
+
+# Route: Queue a background audit and return its job id right away
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    form = request.get_json(silent=True) if request.is_json else request.form
+    try:
+        ip_addrs, audit_func, record_results = build_audit(form or {})
+    except KeyError as missing_field:
+        return jsonify({'error': 'Missing field ' + str(missing_field)}), 400
+    if not ip_addrs:
+        return jsonify({'error': 'No device IP addresses submitted'}), 400
+
+    job = job_manager.submit(ip_addrs, audit_func,
+                             on_finished=lambda job: record_results(job.results, job.job_id, job.started, job.finished))
+    if not request.is_json:
+        # Browser form: watch the results arrive on the job page
+        return redirect(url_for('job_page', job_id=job.job_id))
+    urls = {
+        'job_id': job.job_id,
+        'status_url': url_for('job_status', job_id=job.job_id),
+        'stream_url': url_for('job_stream', job_id=job.job_id),
+    }
+    if requested(form, 'trace'):
+        urls['trace_url'] = url_for('job_trace', job_id=job.job_id)
+    return jsonify(urls), 202
+
+# Route: Batch audit API, streams structured per-device results as NDJSON while the audit runs
+@app.route('/api/audit', methods=['POST'])
+def api_audit():
+    # Devices come as a JSON list (addresses or objects with ip/DeviceIPDotted) or an uploaded CSV/NetMRI export
+    if request.is_json:
+        form = request.get_json(silent=True)
+        if not isinstance(form, dict):
+            return jsonify({'error': 'Expected a JSON object with devices, username, password and en_secret'}), 400
+        devices = form.get('devices', form.get('ip_addrs', []))
+        if isinstance(devices, str):
+            devices = [devices]
+        ip_addrs = [str(device.get('ip') or device.get('DeviceIPDotted') or '') if isinstance(device, dict) else str(device)
+                    for device in devices]
+    else:
+        form = request.form
+        upload = request.files.get('devices')
+        if upload is not None:
+            ip_addrs = parse_device_csv(io.TextIOWrapper(upload.stream, encoding='utf-8-sig'))
+        else:
+            ip_addrs = form.getlist('ip_addrs')
+
+    audit_form = {key: form[key] for key in ('username', 'password', 'en_secret', 'network', 'trace', 'profile') if key in form}
+    audit_form['ip_addrs'] = ip_addrs
+    try:
+        ip_addrs, audit_func, record_results = build_audit(audit_form)
+    except KeyError as missing_field:
+        return jsonify({'error': 'Missing field ' + str(missing_field)}), 400
+    if not ip_addrs:
+        return jsonify({'error': 'No device IP addresses submitted'}), 400
+    if len(ip_addrs) > app.config['API_MAX_DEVICES']:
+        return jsonify({'error': f"At most {app.config['API_MAX_DEVICES']} devices per call"}), 413
+
+    job = job_manager.submit(ip_addrs, audit_func,
+                             on_finished=lambda job: record_results(job.results, job.job_id, job.started, job.finished))
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no', 'X-Job-Id': job.job_id,
+               'Location': url_for('job_status', job_id=job.job_id)}
+    if requested(audit_form, 'trace'):
+        headers['X-Trace-Url'] = url_for('job_trace', job_id=job.job_id)
+    return Response(ndjson_stream(job, transform=structured_result), mimetype='application/x-ndjson', headers=headers)
+
+# Route: Job status, with the results collected so far when ?results=1
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = job_manager.get(job_id) or abort(404)
+    status = job.summary()
+    if request.args.get('results'):
+        status['results'] = list(job.results)
+    return jsonify(status)
+
+# Route: Stream per-device results as they complete (NDJSON, or SSE for EventSource clients)
+@app.route('/jobs/<job_id>/stream')
+def job_stream(job_id):
+    job = job_manager.get(job_id) or abort(404)
+    start = request.args.get('start', 0, type=int)
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    if request.args.get('format') == 'sse' or request.accept_mimetypes.best == 'text/event-stream':
+        start = request.headers.get('Last-Event-ID', start, type=int)
+        return Response(sse_stream(job, start), mimetype='text/event-stream', headers=headers)
+    return Response(ndjson_stream(job, start), mimetype='application/x-ndjson', headers=headers)
+
+# Route: Chrome trace (chrome://tracing, Perfetto) of a job submitted with trace enabled, once it has finished
+@app.route('/jobs/<job_id>/trace')
+def job_trace(job_id):
+    return send_from_directory(app.config['TRACE_DIR'], job_id + '.json', mimetype='application/json')
+
+# Route: Results page that follows a job while it runs
+@app.route('/jobs/<job_id>/view')
+def job_page(job_id):
+    job = job_manager.get(job_id) or abort(404)
+    return render_template('specter_job.html', name='SPECTER', job=job.summary())
+
+def page_args():
+    # limit/offset query arguments shared by the /history endpoints
+    limit = min(max(request.args.get('limit', 100, type=int), 1), app.config['HISTORY_MAX_PAGE'])
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    return limit, offset
+
+# Route: Latest status of every recorded device, optionally for one network
+@app.route('/history/summary')
+def history_summary():
+    limit, offset = page_args()
+    return jsonify(history.fleet_summary(request.args.get('network'), limit, offset))
+
+# Route: Rules ordered by how many devices currently fail them
+@app.route('/history/rules')
+def history_rules():
+    limit, offset = page_args()
+    return jsonify(history.rule_summary(request.args.get('network'), request.args.get('section'), limit, offset))
+
+# Route: Devices whose latest audit fails one rule
+@app.route('/history/rules/<int:rule_id>/failures')
+def history_rule_failures(rule_id):
+    limit, offset = page_args()
+    failures = history.rule_failures(rule_id, request.args.get('network'), limit, offset)
+    if failures is None:
+        abort(404)
+    return jsonify(failures)
+
+# Route: Compliance of one network run by run
+@app.route('/history/networks/<network>/trend')
+def history_network_trend(network):
+    limit, offset = page_args()
+    return jsonify(history.network_trend(network, limit, offset))
+
+# Route: Per-phase latency, bytes, error and session metrics in Prometheus text format
+@app.route('/metrics')
+def metrics():
+    return Response(audit_metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+
+if __name__ == '__main__':
+    app.run(host='192.168.10.1', debug=True)
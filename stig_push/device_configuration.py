@@ -6,10 +6,39 @@ from netmiko import NetMikoTimeoutException
 from paramiko.ssh_exception import SSHException
 from paramiko.ssh_exception import AuthenticationException
 from netmri_device_list import NetMRIHandler
-from netmiko_connection import NetmikoHandler
+from netmiko_connection import NetmikoHandler, DEFAULT_LEASE_PATH
+import argparse
+import os
 import re
 
+# Push journals default to one per network and device type, so --resume finds the interrupted run
+JOURNAL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'journal')
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Push the STIG configuration to every device of one type in a network')
+    parser.add_argument('--resume', action='store_true',
+                        help='skip devices the journal already records as configured and append to it')
+    parser.add_argument('--journal', help='NDJSON journal of per-device outcomes (default: journal/push_<network>_<type>.ndjson)')
+    parser.add_argument('--push-mode', choices=['scp', 'interactive'], default='scp',
+                        help='copy the commands to the device as one file and merge them (default), or send them line by line')
+    parser.add_argument('--delta', action='store_true',
+                        help='audit each device against the golden baseline and push only the missing lines, skipping compliant devices')
+    parser.add_argument('--metrics-file',
+                        help='write per-phase timings, bytes and errors as a Prometheus textfile (e.g. for the node_exporter textfile collector)')
+    parser.add_argument('--trace', metavar='FILE',
+                        help='record per-device spans (connect, each command, compare, push) as a Chrome trace JSON file')
+    parser.add_argument('--profile', action='store_true',
+                        help='with --trace, also profile the delta compare with cProfile')
+    parser.add_argument('--lease-db', default=os.environ.get('SPECTER_LEASE_PATH', DEFAULT_LEASE_PATH),
+                        help='device lease store shared with the Flask checker, so a device being audited is not pushed to at the same time')
+    parser.add_argument('--fleet-sessions', type=int, default=int(os.environ.get('SPECTER_FLEET_MAX_SESSIONS', 100)),
+                        help='most devices connected at once across this run, other runs and the checker (default: SPECTER_FLEET_MAX_SESSIONS or 100)')
+    parser.add_argument('--no-leases', action='store_true',
+                        help='push without taking device leases, e.g. in a maintenance window with nothing else running')
+    return parser.parse_args()
+
 def main():
+    args = parse_args()
     tacacs_username = input('Enter your TACACS username: ')
     tacacs_password = getpass()
     device_type = input("A: Router\nB: Switch-Router\nC: Switch\n\nChoose an option: ")
@@ -24,11 +53,21 @@ def main():
     
     get_ip = NetMRIHandler(tacacs_username, tacacs_password)
     #test_ip = ['', '']
-    device_configuration = NetmikoHandler(tacacs_username, tacacs_password, get_ip.enterprise_devices(selected_device_type, network))
+    device_list = get_ip.enterprise_devices(selected_device_type, network)
+    journal_path = args.journal or os.path.join(JOURNAL_DIR, f'push_{network}_{selected_device_type}.ndjson')
+    # Devices are grouped by network so one network's management links aren't overrun
+    device_configuration = NetmikoHandler(tacacs_username, tacacs_password, device_list,
+                                          device_groups={ip: network for ip in device_list},
+                                          journal_path=journal_path, resume=args.resume, push_mode=args.push_mode,
+                                          delta=args.delta, metrics_path=args.metrics_file,
+                                          trace_path=args.trace, profile=args.profile,
+                                          lease_path=None if args.no_leases else args.lease_db,
+                                          fleet_sessions=args.fleet_sessions)
     
     #device_configuration = NetmikoHandler(tacacs_username, tacacs_password, test_ip)
     
     device_configuration.config_device()
+    device_configuration.close()
     
 if __name__ == "__main__":
     main()
\ No newline at end of file
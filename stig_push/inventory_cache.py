@@ -0,0 +1,131 @@
+# Import required libraries
+import os
+import sqlite3
+import threading
+import time
+
+# Rows written per transaction while a NetMRI pull is streamed into the cache
+BATCH_SIZE = 500
+
+
+class InventoryCache:
+    """
+    Local SQLite copy of the NetMRI enterprise device inventory.
+
+    Devices are cached per (network, device type) scope. A scope is served from
+    the cache while it is younger than refresh_interval, refreshed incrementally
+    (only devices whose DeviceTimestamp moved past the last pull) until it is
+    older than max_age, and pulled in full after that so devices removed from
+    NetMRI drop out of the cache too.
+    """
+    def __init__(self, path, refresh_interval=900, max_age=86400):
+        """
+        :param str path:                SQLite file holding the inventory
+        :param int refresh_interval:    Seconds a scope is used without asking NetMRI at all
+        :param int max_age:             Seconds before a scope is pulled in full instead of incrementally
+        """
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('''CREATE TABLE IF NOT EXISTS devices (
+                                device_id TEXT PRIMARY KEY,
+                                name TEXT NOT NULL,
+                                ip TEXT NOT NULL,
+                                device_type TEXT NOT NULL,
+                                network TEXT NOT NULL,
+                                timestamp TEXT NOT NULL,
+                                generation INTEGER NOT NULL)''')
+        self._db.execute('CREATE INDEX IF NOT EXISTS devices_scope ON devices (network, device_type)')
+        self._db.execute('''CREATE TABLE IF NOT EXISTS scopes (
+                                network TEXT NOT NULL,
+                                device_type TEXT NOT NULL,
+                                full_sync REAL NOT NULL,
+                                last_sync REAL NOT NULL,
+                                high_water TEXT NOT NULL,
+                                generation INTEGER NOT NULL,
+                                PRIMARY KEY (network, device_type))''')
+        self._db.commit()
+
+    def state(self, network, device_type):
+        """
+        What the cache should do for a scope: 'fresh', 'incremental' or 'full', plus the high-water timestamp.
+        """
+        with self._lock:
+            row = self._db.execute('SELECT full_sync, last_sync, high_water FROM scopes '
+                                   'WHERE network = ? AND device_type = ?', (network, device_type)).fetchone()
+        now = time.time()
+        if row is None or now - row[0] > self.max_age:
+            return 'full', None
+        if now - row[1] > self.refresh_interval:
+            return 'incremental', row[2]
+        return 'fresh', row[2]
+
+    def store(self, network, device_type, devices, full):
+        """
+        Stream devices from NetMRI into the cache.
+
+        :param iter devices:    Dicts with device_id, name, ip, device_type, network and timestamp
+        :param bool full:       The devices are the whole scope, cached devices not among them are dropped
+        :return int:            Number of devices stored
+        """
+        with self._lock:
+            row = self._db.execute('SELECT full_sync, high_water, generation FROM scopes '
+                                   'WHERE network = ? AND device_type = ?', (network, device_type)).fetchone()
+            full_sync, high_water, generation = row if row is not None else (0, '', 0)
+        generation += 1
+
+        stored = 0
+        batch = []
+        for device in devices:
+            batch.append((device['device_id'], device['name'], device['ip'], device['device_type'],
+                          device['network'], device['timestamp'], generation))
+            high_water = max(high_water, device['timestamp'])
+            if len(batch) >= BATCH_SIZE:
+                stored += self._write(batch)
+                batch = []
+        stored += self._write(batch)
+
+        now = time.time()
+        with self._lock:
+            if full:
+                self._db.execute('DELETE FROM devices WHERE network = ? AND device_type = ? AND generation < ?',
+                                 (network, device_type, generation))
+                full_sync = now
+            self._db.execute('INSERT OR REPLACE INTO scopes VALUES (?, ?, ?, ?, ?, ?)',
+                             (network, device_type, full_sync, now, high_water, generation))
+            self._db.commit()
+        return stored
+
+    def select(self, network, device_type, exclude=None):
+        """
+        Management IPs of the cached devices in a scope, ordered by name.
+
+        :param re.Pattern exclude:  Devices whose name matches are left out
+        """
+        with self._lock:
+            rows = self._db.execute('SELECT name, ip FROM devices WHERE network = ? AND device_type = ? ORDER BY name',
+                                    (network, device_type)).fetchall()
+        return [ip for name, ip in rows if exclude is None or not exclude.search(name)]
+
+    def invalidate(self, network=None, device_type=None):
+        """
+        Force the next lookup of a scope, or of every scope when network is None, to pull in full.
+        """
+        with self._lock:
+            if network is None:
+                self._db.execute('DELETE FROM scopes')
+            else:
+                self._db.execute('DELETE FROM scopes WHERE network = ? AND device_type = ?', (network, device_type))
+            self._db.commit()
+
+    def _write(self, batch):
+        if not batch:
+            return 0
+        with self._lock:
+            self._db.executemany('INSERT OR REPLACE INTO devices VALUES (?, ?, ?, ?, ?, ?, ?)', batch)
+            self._db.commit()
+        return len(batch)
@@ -1,79 +1,352 @@
-from netmiko import ConnectHandler
 from getpass import getpass
-from netmiko import NetMikoTimeoutException
+from netmiko import NetMikoTimeoutException, file_transfer
 from paramiko.ssh_exception import SSHException
 from paramiko.ssh_exception import AuthenticationException
-from betterconcurrent import ThreadPoolExecutor
+from push_scheduler import AdaptiveLimiter, PushScheduler, SUCCESS, TIMEOUT, FAILED, BUSY
+from push_journal import PushJournal
+import hashlib
+import os
+import re
+import sys
+import tempfile
+import time
+
+# The SSH session pool is shared with the Flask checker
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'flask'))
+from session_pool import SessionPool
+from golden_baseline import BaselineLoader
+from device_collection import collect_device
+from remediation import remediation_commands
+from audit_trace import AuditTrace
+from device_leases import DEFAULT_LEASE_PATH, DeviceBusy, DeviceLeases
+import audit_metrics
+import audit_trace
+
+# File the rendered commands are copied to on the device before being merged into the running config
+PUSH_FILE_NAME = 'stig_push.cfg'
+# Lines IOS prints when a pushed command was rejected
+CONFIG_ERROR = re.compile(r'%\s*(Invalid|Incomplete|Ambiguous|Error)', re.IGNORECASE)
+# Configuration prompt in front of a command echoed by an interactive push
+CONFIG_PROMPT = re.compile(r'^\S*\(config[^)]*\)#\s*')
+
+
+class ConfigRejected(Exception):
+    """
+    The device rejected some of the pushed commands; the others were applied.
+    """
+    def __init__(self, commands):
+        super().__init__(f'{len(commands)} commands rejected: ' + '; '.join(commands))
+        self.commands = commands
+
+
+def rejected_commands(output):
+    """
+    Commands a merge or interactive push was refused, each taken from the line echoed before its % error.
+
+    :param str output:  Output of the merge or of send_config_set()
+    :return lst:        Rejected commands in push order, empty when everything was accepted
+    """
+    rejected = []
+    previous = None
+    for line in output.splitlines():
+        stripped = line.strip()
+        if CONFIG_ERROR.match(stripped):
+            # Fall back to the message itself when IOS didn't echo the command
+            rejected.append(previous or stripped)
+            previous = None
+        elif stripped.strip('^ '):
+            previous = CONFIG_PROMPT.sub('', stripped)
+    return rejected
  
 class NetmikoHandler:
     """
     This class is designed to connect to a Cisco IOS appliance and issue configuration commands.
     """
-    def __init__(self, tacacs_username, tacacs_password, device_list):
+    def __init__(self, tacacs_username, tacacs_password, device_list, max_workers=25, device_groups=None,
+                 group_limit=None, retries=2, journal_path=None, resume=False, push_mode='scp', file_system='flash:',
+                 delta=False, metrics_path=None, trace_path=None, profile=False, ssh_port=22,
+                 lease_path=DEFAULT_LEASE_PATH, fleet_sessions=100, lease_timeout=300):
         """
         Establishes connection to device
  
         :param str miko_username:   TACACS Username
         :param str miko_password:   TACACS Password
         :param lst device_list:     List of IPs to connect to
+        :param int max_workers:     Most devices configured at the same time, the scheduler adapts below it
+        :param dict device_groups:  IP -> site or network (VirtualNetworkID) for per-group session caps
+        :param int group_limit:     Most devices configured at the same time within one group
+        :param int retries:         Retries for devices that timed out
+        :param str journal_path:    NDJSON journal each device's outcome is appended to, None for no journal
+        :param bool resume:         Skip devices the journal already records as successful and append to it
+        :param str push_mode:       'scp' copies the commands as one file and merges it, 'interactive' sends them line by line
+        :param str file_system:     Device file system the command file is copied to in scp mode
+        :param bool delta:          Audit each device against the golden baseline first and push only the missing
+                                    lines, instead of the whole commands file; compliant devices are skipped
+        :param str metrics_path:    Prometheus textfile the run's per-phase metrics are written to, None for no file
+        :param str trace_path:      Chrome trace JSON of every device's spans (connect, each command, compare, push),
+                                    None to record no trace
+        :param bool profile:        Also run the delta compare under cProfile, recorded in the trace
+        :param int ssh_port:        SSH port of the devices
+        :param str lease_path:      Device lease store shared with the Flask checker, so a device is never pushed to
+                                    while it is audited or pushed by another run; None to push without leases
+        :param int fleet_sessions:  Most sessions open at once across every run and checker worker using lease_path
+        :param int lease_timeout:   Seconds to wait for a busy device before it is put back in the queue for later
         """    
         self.username_netmiko = tacacs_username
         self.password_netmiko = tacacs_password 
         self.device_list = device_list
-        self.countdown = len(self.device_list)
+        self.max_workers = max_workers
+        self.device_groups = device_groups or {}
+        self.group_limit = group_limit
+        self.retries = retries
         self.timeouts = []
-        with open('/path/to/commands_file') as f: # Update this line to the path where the commands are
-            self.commands_list = f.read().splitlines()
+        self.busy = []
+        self.journal_path = journal_path
+        self.resume = resume
+        self.push_mode = push_mode
+        self.file_system = file_system
+        self.delta = delta
+        self.ssh_port = ssh_port
+        self.metrics_path = metrics_path
+        self.trace_path = trace_path
+        self.trace = AuditTrace('push', profile=profile) if trace_path is not None else None
+        # Golden baseline shared with the Flask checker, snapshotted once per run in delta mode
+        self.golden = BaselineLoader() if delta else None
+        self.baseline = None
+        # Every session holds its device's lease, shared with the checker, until the session is closed
+        self.device_leases = DeviceLeases(lease_path, max_sessions=fleet_sessions) if lease_path is not None else None
+        if self.device_leases is not None:
+            audit_metrics.watch_device_leases(self.device_leases)
+        # Sessions stay open between runs of config_device() so repeat pushes skip the SSH handshake
+        self.session_pool = SessionPool(max_size=max_workers, max_per_device=1, leases=self.device_leases,
+                                        purpose='push', lease_timeout=lease_timeout)
+        audit_metrics.watch_session_pool('push', self.session_pool)
+        self.commands_list = []
+        self.commands_file = None
+        if not self.delta:
+            with open('/path/to/commands_file') as f: # Update this line to the path where the commands are
+                self.commands_list = f.read().splitlines()
+            if self.push_mode == 'scp':
+                # Rendered once, every device gets the same file
+                self.commands_file = self.render_commands(self.commands_list)
  
     def connect_and_configure(self, ip_address_of_device):
         """
         Connect to a device and send configuration commands.
  
         :param str ip_address_of_device: IP address of the device to connect to
+        :return tuple:                   (SUCCESS, TIMEOUT, BUSY or FAILED, seconds to open a new session or None,
+                                          dict of timings, error class and output hash)
         """
         archive_create = "mkdir archived_configs"
-        print("Connecting to " + ip_address_of_device + f": {self.countdown} devices remaining")
-        self.countdown -= 1
         cisco_ios = {
             'device_type': 'cisco_ios',
             'ip': ip_address_of_device,
+            'port': self.ssh_port,
             'username': self.username_netmiko,
             'password': self.password_netmiko
         }
  
         # Error Handling
+        connect_seconds = None
+        delta_commands = None
+        push_mode = self.push_mode
+        outcome = SUCCESS
+        error = None
+        output_hash = None
+        rejected = None
+        started = time.monotonic()
+        # Spans go to the run's trace, if any, and metrics are labelled with the device's network
+        with audit_trace.activate(self.trace), audit_trace.span('push', ip=ip_address_of_device), \
+                audit_metrics.device_context('push', self.device_groups.get(ip_address_of_device, '')):
+            try:
+                with self.session_pool.session(cisco_ios) as net_connect:
+                    # Fresh connects only: lease and pool waits or a warm session say nothing about the network
+                    connect_seconds = self.session_pool.connect_seconds()
+                    commands = self.commands_list
+                    commands_file = self.commands_file
+                    if self.delta:
+                        collected = collect_device(net_connect, self.baseline.bulk_config)
+                        audit_metrics.record_collection(collected['stats'])
+                        with audit_metrics.phase('compare'), audit_trace.profiled('compare'):
+                            commands = remediation_commands(self.baseline, collected)
+                        commands_file = self.render_commands(commands) if commands and self.push_mode == 'scp' else None
+                        delta_commands = len(commands)
+                    if not commands:
+                        push_mode = 'skipped'
+                    else:
+                        try:
+                            with audit_metrics.phase('archive'):
+                                archive_output = net_connect.send_command(
+                                    command_string=archive_create,
+                                    expect_string=r"Create directory filename|#",
+                                    strip_prompt=False,
+                                    strip_command=False
+                                )
+                                archive_output += net_connect.send_command(
+                                    command_string="\n",
+                                    expect_string=r"#",
+                                    strip_prompt=False,
+                                    strip_command=False
+                                )        
+                            output = self.push_file(net_connect, ip_address_of_device, commands_file) if commands_file else None
+                            if output is None:
+                                push_mode = 'interactive'
+                                with audit_metrics.phase('config'):
+                                    output = net_connect.send_config_set(commands, read_timeout=0)
+                            output_hash = hashlib.sha256((archive_output + output).encode()).hexdigest()[:16]
+                            rejected = rejected_commands(output)
+                        finally:
+                            if commands_file is not None and commands_file != self.commands_file:
+                                os.remove(commands_file)
+                # Raised once the session is back in the pool, nothing is wrong with it
+                if rejected:
+                    raise ConfigRejected(rejected)
+            except (AuthenticationException) as auth_error:
+                print('Authentication failure ' + ip_address_of_device)
+                outcome, error = FAILED, auth_error
+            except (NetMikoTimeoutException) as timeout_error:
+                print('Timeout to device ' + ip_address_of_device)
+                outcome, error = TIMEOUT, timeout_error
+            except (EOFError) as eof_error:
+                print('End of file while attempting device ' + ip_address_of_device)
+                outcome, error = FAILED, eof_error
+            except (SSHException) as ssh_error:
+                print('SSH Issue. Are you sure SSH is enabled? ' + ip_address_of_device)
+                outcome, error = FAILED, ssh_error
+            except (ConfigRejected) as rejected_error:
+                # Sending everything again would only be refused again, so the lines are reported instead
+                print('Commands rejected by ' + ip_address_of_device + ': ' + '; '.join(rejected_error.commands))
+                outcome, error = FAILED, rejected_error
+            except (DeviceBusy) as busy_error:
+                # Busy with an audit or another push, or the fleet session budget is used up: deferred, not congestion
+                print(str(busy_error))
+                outcome, error = BUSY, busy_error
+            except Exception as unknown_error:
+                print('Some other error ' + str(unknown_error))
+                outcome, error = FAILED, unknown_error
+            if error is not None:
+                audit_metrics.count_error(error)
+            audit_metrics.count_device(outcome)
+        details = {
+            'connect_seconds': None if connect_seconds is None else round(connect_seconds, 3),
+            'seconds': round(time.monotonic() - started, 3),
+            'error': None if error is None else type(error).__name__,
+            'output_sha256': output_hash,
+            'push_mode': push_mode,
+            'delta_commands': delta_commands,
+            'rejected_commands': rejected,
+        }
+        return outcome, connect_seconds, details
+ 
+    def render_commands(self, commands):
+        """
+        Write commands to a local file for push_file() and return its path.
+        """
+        with tempfile.NamedTemporaryFile('w', suffix='.cfg', delete=False) as rendered:
+            rendered.write('\n'.join(commands) + '\nend\n')
+        return rendered.name
+
+    def push_file(self, net_connect, ip_address_of_device, commands_file):
+        """
+        Copy the rendered commands to the device and merge them into the running config in one operation.
+
+        The file is sent over SCP (skipped when the device already has an identical
+        copy) and applied with 'copy <file> running-config', so the commands don't
+        go through per-line echo handling on the interactive channel.
+
+        :return str:    Output of the copy, or None when the transfer or merge failed and the
+                        commands should be sent interactively instead. Commands the device
+                        rejected during the merge are left in the output for rejected_commands().
+        """
         try:
-            net_connect = ConnectHandler(**cisco_ios)
-            archive_output = net_connect.send_command(
-                command_string=archive_create,
-                expect_string=r"Create directory filename|#",
+            with audit_metrics.phase('transfer'):
+                transfer = file_transfer(
+                    net_connect,
+                    source_file=commands_file,
+                    dest_file=PUSH_FILE_NAME,
+                    file_system=self.file_system,
+                    direction='put',
+                    overwrite_file=True
+                )
+        except Exception as transfer_error:
+            print('SCP transfer failed, pushing interactively to ' + ip_address_of_device + ': ' + str(transfer_error))
+            return None
+        if not transfer['file_verified']:
+            print('Pushed file did not verify, pushing interactively to ' + ip_address_of_device)
+            return None
+
+        source = self.file_system + PUSH_FILE_NAME
+        with audit_metrics.phase('merge'):
+            output = net_connect.send_command(
+                command_string='copy ' + source + ' running-config',
+                expect_string=r'Destination filename|#',
                 strip_prompt=False,
                 strip_command=False
             )
-            archive_output += net_connect.send_command(
-                command_string="\n",
-                expect_string=r"#",
-                strip_prompt=False,
-                strip_command=False
-            )        
-            output = net_connect.send_config_set(self.commands_list, read_timeout=0)
-            net_connect.disconnect()  # Ensure the connection is closed
-        except (AuthenticationException):
-            print('Authentication failure ' + ip_address_of_device)
-        except (NetMikoTimeoutException):
-            print('Timeout to device ' + ip_address_of_device)
-            self.timeouts.append(ip_address_of_device)
-        except (EOFError):
-            print('End of file while attempting device ' + ip_address_of_device)
-        except (SSHException):
-            print('SSH Issue. Are you sure SSH is enabled? ' + ip_address_of_device)
-        except Exception as unknown_error:
-            print('Some other error ' + str(unknown_error))
- 
+            if 'Destination filename' in output:
+                output += net_connect.send_command(
+                    command_string="\n",
+                    expect_string=r"#",
+                    strip_prompt=False,
+                    strip_command=False,
+                    read_timeout=120
+                )
+        net_connect.send_command('delete /force ' + source, expect_string=r'#')
+
+        # Verify the merge ran: IOS reports the bytes copied, even when it rejected some of the commands
+        if 'bytes copied' not in output:
+            print('Merge of pushed file failed, pushing interactively to ' + ip_address_of_device)
+            return None
+        return output
+
     def config_device(self):
         """
         Send Commands to Device
+
+        Concurrency starts low and adapts to connect times and timeouts up to
+        max_workers; timed-out devices are retried with jittered backoff and busy
+        devices are deferred until their lease is free.
+        """
+        device_list = self.device_list
+        if self.delta:
+            self.baseline = self.golden.get()
+        journal = None
+        if self.journal_path is not None:
+            if self.resume:
+                done = PushJournal.completed(self.journal_path)
+                device_list = [device for device in device_list if device not in done]
+                print(f"Resuming: {len(self.device_list) - len(device_list)} devices already configured")
+            journal = PushJournal(self.journal_path, resume=self.resume)
+
+        limiter = AdaptiveLimiter(initial=min(10, self.max_workers), minimum=min(2, self.max_workers),
+                                  maximum=self.max_workers)
+        scheduler = PushScheduler(self.connect_and_configure, limiter, group_of=self.device_groups.get,
+                                  group_limit=self.group_limit, retries=self.retries,
+                                  on_finished=journal.record if journal is not None else None)
+        try:
+            progress = scheduler.run(device_list)
+        finally:
+            if journal is not None:
+                journal.close()
+            if self.metrics_path is not None:
+                # Picked up by the node_exporter textfile collector
+                audit_metrics.REGISTRY.write_textfile(self.metrics_path)
+            if self.trace is not None:
+                self.trace.write(self.trace_path)
+                print('Push trace written to ' + self.trace_path)
+        self.timeouts = progress.devices(TIMEOUT)
+        self.busy = progress.devices(BUSY)
+        print(f"Configured {progress.counts.get(SUCCESS, 0)} of {len(device_list)} devices, "
+              f"final concurrency {limiter.limit}")
+        print("Devices that timed out: " + str(self.timeouts))
+        print("Devices still busy with another audit or push: " + str(self.busy))
+        print("SSH sessions opened: {created}, reused: {reused}".format(**self.session_pool.stats))
+
+    def close(self):
+        """
+        Close the SSH sessions kept open between runs and remove the rendered command file
         """
-        with ThreadPoolExecutor(max_workers=25) as pool:  # Adjust max_workers as needed
-            pool.map(self.connect_and_configure, self.device_list)
-        print("Devices that timed out: " + str(self.timeouts))
\ No newline at end of file
+        self.session_pool.close_all()
+        if self.commands_file is not None and os.path.exists(self.commands_file):
+            os.remove(self.commands_file)
\ No newline at end of file
@@ -4,14 +4,26 @@ import requests
 from netmiko import ConnectHandler
 from getpass import getpass
 from infoblox_netmri.client import InfobloxNetMRI
+from inventory_cache import InventoryCache
+import os
 import re
 
+# Devices requested from NetMRI per API call
+PAGE_SIZE = 1000
+# Device fields the inventory needs, everything else stays on the server
+DEVICE_FIELDS = ['DeviceID', 'DeviceName', 'DeviceIPDotted', 'DeviceType', 'VirtualNetworkID', 'DeviceTimestamp']
+# Devices that are never pushed to, matched against the device name
+EXCLUDED_DEVICES = re.compile(r'(sdwan|vpn|cube|VOICE|unknown|dnac)', re.IGNORECASE)
+DEFAULT_INVENTORY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'inventory.sqlite3')
+
 class NetMRIHandler:
-    def __init__(self, tacacs_username, tacacs_password):
+    def __init__(self, tacacs_username, tacacs_password, inventory_path=DEFAULT_INVENTORY_PATH):
         # NetMRI login variables
         self.netmri_server = "netmri.socom.mil"
         self.username_netmri = tacacs_username
         self.password_netmri = tacacs_password
+        # Local copy of the inventory so device selection doesn't re-pull NetMRI every run
+        self.inventory = InventoryCache(inventory_path)
     
     def __authenticate(self):
         # Create a client instance
@@ -22,32 +34,55 @@ class NetMRIHandler:
         )
         return client
 
-    def __sort_devices(self, client):
-        # Get the broker for Device
+    def __iter_devices(self, client, selected_device_type, network, since=None):
+        # Page through the enterprise devices of one network and type, filtered by NetMRI itself.
+        # With since only devices whose DeviceTimestamp moved past it are returned.
         broker = client.get_broker('Device')  # Only pass the object type
-        # Fetch enterprise asset devices
-        devices = broker.search(custom_enterprise_asset=['1'], limit=9001)
-
-        return devices
-
-    def enterprise_devices(self, selected_device_type, network):
-        # Authenticate and get the client
-        client = self.__authenticate()
-        # Get device information
-        devices = self.__sort_devices(client)  
-
-        device_list = []
-        regex_pattern = re.compile(r'(sdwan|vpn|cube|VOICE|unknown|dnac)', re.IGNORECASE)
-
-        # Iterate through the enterprise devices
-        for device in devices:
-            if device.VirtualNetworkID == network:
-                if regex_pattern.search(device.DeviceName):
-                    continue
-                elif device.DeviceType == selected_device_type:
-                    device_list.append(device.DeviceIPDotted)
-                    #print(device.DeviceName, device.DeviceType)
-        return device_list
+        filters = {
+            'custom_enterprise_asset': ['1'],
+            'op_VirtualNetworkID': '=', 'val_c_VirtualNetworkID': str(network),
+            'op_DeviceType': '=', 'val_c_DeviceType': selected_device_type,
+        }
+        if since:
+            filters.update(op_DeviceTimestamp='>', val_c_DeviceTimestamp=since)
+
+        start = 0
+        while True:
+            page = broker.find(start=start, limit=PAGE_SIZE, select=DEVICE_FIELDS, **filters)
+            for device in page:
+                yield {
+                    'device_id': str(device.DeviceID),
+                    'name': device.DeviceName or '',
+                    'ip': device.DeviceIPDotted,
+                    'device_type': device.DeviceType,
+                    'network': str(device.VirtualNetworkID),
+                    'timestamp': str(device.DeviceTimestamp or ''),
+                }
+            if len(page) < PAGE_SIZE:
+                break
+            start += PAGE_SIZE
+
+    def enterprise_devices(self, selected_device_type, network, refresh=False):
+        """
+        Management IPs of the enterprise devices of one type in one network.
+
+        Served from the local inventory cache, which is brought up to date from
+        NetMRI only when it is stale: incrementally for recent changes, in full
+        once max_age has passed or when refresh is True.
+        """
+        network = str(network)
+        state, high_water = self.inventory.state(network, selected_device_type)
+        if refresh:
+            state = 'full'
+        if state != 'fresh':
+            # Authenticate and get the client
+            client = self.__authenticate()
+            since = high_water if state == 'incremental' else None
+            devices = self.__iter_devices(client, selected_device_type, network, since)
+            stored = self.inventory.store(network, selected_device_type, devices, full=(state == 'full'))
+            print(f'Inventory {state} refresh: {stored} devices from NetMRI')
+
+        return self.inventory.select(network, selected_device_type, exclude=EXCLUDED_DEVICES)
 
 if __name__ == "__main__":
     netmri_instance = NetMRIHandler()
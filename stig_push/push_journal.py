@@ -0,0 +1,75 @@
+# Import required libraries
+import json
+import os
+import threading
+import time
+
+
+class PushJournal:
+    """
+    Append-only NDJSON record of every device's final push outcome.
+
+    One line is written and flushed as soon as a device finishes, so after a
+    crash the journal says exactly which devices got the config. A resumed run
+    appends to the same journal and skips the devices already recorded as
+    successful.
+    """
+    def __init__(self, path, resume=False):
+        """
+        :param str path:        Journal file
+        :param bool resume:     Keep the existing journal and append to it instead of starting a new one
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        torn = False
+        if resume and os.path.exists(path) and os.path.getsize(path):
+            with open(path, 'rb') as journal:
+                journal.seek(-1, os.SEEK_END)
+                torn = journal.read(1) != b'\n'
+        self._file = open(path, 'a' if resume else 'w', encoding='utf-8')
+        if torn:
+            # Finish the line a crash cut short so the next record starts on its own line
+            self._file.write('\n')
+        self._write({'event': 'run', 'resume': resume, 'time': time.time()})
+
+    @staticmethod
+    def completed(path, status='success'):
+        """
+        Devices whose last journal record has the given status, read one line at a time.
+        """
+        last = {}
+        if not os.path.exists(path):
+            return set()
+        with open(path, encoding='utf-8') as journal:
+            for line in journal:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A line cut short by a crash
+                    continue
+                if record.get('event') == 'device':
+                    last[record['device']] = record['status'] == status
+        return {device for device, done in last.items() if done}
+
+    def record(self, device, status, attempts, details=None):
+        """
+        Append the final outcome of one device.
+
+        :param str device:      Device IP
+        :param str status:      success, timeout, busy or failed
+        :param int attempts:    Attempts made, retries included
+        :param dict details:    Timings, error class and output hash from the push
+        """
+        record = {'event': 'device', 'device': device, 'status': status, 'attempts': attempts, 'time': time.time()}
+        record.update(details or {})
+        self._write(record)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def _write(self, record):
+        with self._lock:
+            self._file.write(json.dumps(record) + '\n')
+            self._file.flush()
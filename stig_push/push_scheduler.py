@@ -0,0 +1,221 @@
+# Import required libraries
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from collections import deque
+import heapq
+import random
+import threading
+import time
+
+# Outcomes of one device attempt
+SUCCESS = 'success'
+TIMEOUT = 'timeout'
+FAILED = 'failed'
+# The device or a session slot is held by another audit or push, nothing wrong with the network
+BUSY = 'busy'
+# Outcomes that mean the network, the devices or TACACS are struggling
+CONGESTION = {TIMEOUT}
+# Marker for "no group can start a device", None is a valid group
+_NO_GROUP = object()
+
+
+class ProgressReporter:
+    """
+    Thread-safe progress counter for a push run.
+
+    Only counts are kept for successful devices, so memory doesn't grow with
+    the fleet; the devices that didn't succeed are kept for the summary.
+    """
+    def __init__(self, total):
+        self.total = total
+        self.counts = {}
+        self.unsuccessful = {}
+        self._finished = 0
+        self._lock = threading.Lock()
+
+    def started(self, device, attempt):
+        with self._lock:
+            remaining = self.total - self._finished
+            retry = f' (retry {attempt})' if attempt else ''
+            print(f'Connecting to {device}{retry}: {remaining} devices remaining')
+
+    def finished(self, device, outcome):
+        with self._lock:
+            self._finished += 1
+            self.counts[outcome] = self.counts.get(outcome, 0) + 1
+            if outcome != SUCCESS:
+                self.unsuccessful[device] = outcome
+
+    def devices(self, outcome):
+        # Devices that finished with an outcome other than SUCCESS
+        with self._lock:
+            return [device for device, result in self.unsuccessful.items() if result == outcome]
+
+
+class AdaptiveLimiter:
+    """
+    Additive-increase, multiplicative-decrease limit on concurrent sessions.
+
+    Every window completions the limit grows by one while connects stay fast and
+    error-free, and is halved when timeouts exceed error_threshold or the median
+    connect time grows past slowdown times the baseline. The baseline is the
+    fastest median of the last baseline_windows windows, so it follows the
+    network back up after a fast spell instead of staying at its lowest.
+
+    Only fresh connects give a connect time; completions without one (a reused
+    session) count towards the window and the error rate but not the median.
+    """
+    def __init__(self, initial=10, minimum=2, maximum=50, window=10, error_threshold=0.1, slowdown=2.0,
+                 baseline_windows=10):
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.window = window
+        self.error_threshold = error_threshold
+        self.slowdown = slowdown
+        self._medians = deque(maxlen=baseline_windows)
+        self._latencies = []
+        self._completed = 0
+        self._errors = 0
+
+    @property
+    def baseline(self):
+        return min(self._medians) if self._medians else None
+
+    def record(self, connect_seconds, congested):
+        """
+        :param float connect_seconds:   Seconds to open a new session, None when none was opened
+        :param bool congested:          The attempt failed in a way that points at congestion
+        """
+        self._completed += 1
+        if congested:
+            self._errors += 1
+        elif connect_seconds is not None:
+            self._latencies.append(connect_seconds)
+        if self._completed < self.window:
+            return
+
+        median = sorted(self._latencies)[len(self._latencies) // 2] if self._latencies else None
+        error_rate = self._errors / self._completed
+        # Compared with the windows before this one, so a slow window can't hide in its own baseline
+        slow = median is not None and self.baseline is not None and median > self.baseline * self.slowdown
+        if median is not None:
+            self._medians.append(median)
+        if error_rate > self.error_threshold or slow:
+            self.limit = max(self.minimum, self.limit // 2)
+        else:
+            self.limit = min(self.maximum, self.limit + 1)
+        self._latencies = []
+        self._completed = 0
+        self._errors = 0
+
+
+class PushScheduler:
+    """
+    Runs a per-device task with adaptive concurrency, per-group caps and retries.
+
+    The task is called as task(device) and returns (outcome, connect_seconds,
+    details), outcome being SUCCESS, TIMEOUT, BUSY or FAILED. Timed-out devices
+    are retried with exponential backoff and full jitter, so a struggling site
+    isn't hit again by every retry at the same moment. Busy devices are deferred
+    the same way but neither use up a retry nor count against the limiter, since
+    waiting for another audit or push says nothing about the network.
+    on_finished is called from the dispatcher thread as soon as a device has
+    its final outcome.
+    """
+    def __init__(self, task, limiter=None, group_of=None, group_limit=None, retries=2, backoff=5.0, max_backoff=120.0,
+                 on_finished=None, deferrals=10):
+        """
+        :param func task:           Callable taking a device and returning (outcome, connect seconds, details dict)
+        :param limiter:             AdaptiveLimiter, its maximum is also the thread count
+        :param func group_of:       Callable mapping a device to its site or network, None puts all in one group
+        :param int group_limit:     Maximum concurrent sessions within one group, None for no cap
+        :param int retries:         Retries for a device that timed out
+        :param float backoff:       Base delay in seconds before the first retry
+        :param float max_backoff:   Longest delay before a retry
+        :param func on_finished:    Called as on_finished(device, outcome, attempts, details)
+        :param int deferrals:       Times a busy device is put back in the queue before it is given up as BUSY
+        """
+        self.task = task
+        self.limiter = limiter or AdaptiveLimiter()
+        self.group_of = group_of or (lambda device: None)
+        self.group_limit = group_limit
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.on_finished = on_finished
+        self.deferrals = deferrals
+
+    def run(self, devices):
+        """
+        Run the task for every device and return the ProgressReporter with the outcome counts.
+        """
+        progress = ProgressReporter(len(devices))
+        queues = {}
+        for device in devices:
+            queues.setdefault(self.group_of(device), deque()).append((device, 0))
+        delayed = []
+        deferred = {}
+        active = {}
+        group_active = {}
+        sequence = 0
+
+        with ThreadPoolExecutor(max_workers=self.limiter.maximum) as pool:
+            while any(queues.values()) or delayed or active:
+                now = time.monotonic()
+                while delayed and delayed[0][0] <= now:
+                    _, _, device, attempt = heapq.heappop(delayed)
+                    queues.setdefault(self.group_of(device), deque()).append((device, attempt))
+
+                # Start devices up to the current limit, groups taking turns and never past their cap
+                while len(active) < self.limiter.limit:
+                    group = self._next_group(queues, group_active)
+                    if group is _NO_GROUP:
+                        break
+                    device, attempt = queues[group].popleft()
+                    group_active[group] = group_active.get(group, 0) + 1
+                    progress.started(device, attempt)
+                    active[pool.submit(self.task, device)] = (device, attempt, group)
+
+                timeout = 0.5
+                if delayed:
+                    timeout = min(timeout, max(delayed[0][0] - time.monotonic(), 0))
+                if not active:
+                    time.sleep(timeout)
+                    continue
+                done, _ = wait(active, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    device, attempt, group = active.pop(future)
+                    group_active[group] -= 1
+                    try:
+                        outcome, connect_seconds, details = future.result()
+                    except Exception as unknown_error:
+                        print('Some other error ' + str(unknown_error))
+                        outcome, connect_seconds, details = FAILED, None, {'error': type(unknown_error).__name__}
+                    if outcome == BUSY and deferred.get(device, 0) < self.deferrals:
+                        # Same attempt again later, the limiter never saw it
+                        deferred[device] = deferred.get(device, 0) + 1
+                        sequence += 1
+                        heapq.heappush(delayed, (time.monotonic() + self._delay(deferred[device] - 1), sequence, device,
+                                                 attempt))
+                        continue
+                    if outcome != BUSY:
+                        self.limiter.record(connect_seconds, outcome in CONGESTION)
+                    if outcome == TIMEOUT and attempt < self.retries:
+                        sequence += 1
+                        heapq.heappush(delayed, (time.monotonic() + self._delay(attempt), sequence, device, attempt + 1))
+                    else:
+                        progress.finished(device, outcome)
+                        if self.on_finished is not None:
+                            self.on_finished(device, outcome, attempt + 1, details)
+        return progress
+
+    def _next_group(self, queues, group_active):
+        # First group with work and spare capacity, moved to the back so groups are served round-robin
+        for group, queue in queues.items():
+            if queue and (self.group_limit is None or group_active.get(group, 0) < self.group_limit):
+                queues[group] = queues.pop(group)
+                return group
+        return _NO_GROUP
+
+    def _delay(self, attempt):
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))